@@ -10,7 +10,7 @@ CREATE TABLE Turma (
     nome_turma VARCHAR(50),
     id_professor INT,
     horario VARCHAR(100),
-    FOREIGN KEY (id_professor) REFERENCES Professor(id_professor)
+    FOREIGN KEY (id_professor) REFERENCES Professor(id_professor) ON DELETE SET NULL
 );
 
 CREATE TABLE Aluno (
@@ -22,7 +22,7 @@ CREATE TABLE Aluno (
     telefone_responsavel VARCHAR(20),
     email_responsavel VARCHAR(100),
     informacoes_adicionais TEXT,
-    FOREIGN KEY (id_turma) REFERENCES Turma(id_turma)
+    FOREIGN KEY (id_turma) REFERENCES Turma(id_turma) ON DELETE SET NULL
 );
 
 CREATE TABLE Pagamento (
@@ -33,7 +33,7 @@ CREATE TABLE Pagamento (
     forma_pagamento VARCHAR(50),
     referencia VARCHAR(100),
     status VARCHAR(20),
-    FOREIGN KEY (id_aluno) REFERENCES Aluno(id_aluno)
+    FOREIGN KEY (id_aluno) REFERENCES Aluno(id_aluno) ON DELETE CASCADE
 );
 
 CREATE TABLE Presenca (
@@ -41,7 +41,7 @@ CREATE TABLE Presenca (
     id_aluno INT,
     data_presenca DATE,
     presente BOOLEAN,
-    FOREIGN KEY (id_aluno) REFERENCES Aluno(id_aluno)
+    FOREIGN KEY (id_aluno) REFERENCES Aluno(id_aluno) ON DELETE CASCADE
 );
 
 CREATE TABLE Atividade (
@@ -54,8 +54,8 @@ CREATE TABLE Atividade_Aluno (
     id_atividade INT,
     id_aluno INT,
     PRIMARY KEY (id_atividade, id_aluno),
-    FOREIGN KEY (id_atividade) REFERENCES Atividade(id_atividade),
-    FOREIGN KEY (id_aluno) REFERENCES Aluno(id_aluno)
+    FOREIGN KEY (id_atividade) REFERENCES Atividade(id_atividade) ON DELETE CASCADE,
+    FOREIGN KEY (id_aluno) REFERENCES Aluno(id_aluno) ON DELETE CASCADE
 );
 
 CREATE TABLE Usuario (
@@ -64,9 +64,169 @@ CREATE TABLE Usuario (
     senha VARCHAR(255),
     nivel_acesso VARCHAR(20),
     id_professor INT,
-    FOREIGN KEY (id_professor) REFERENCES Professor(id_professor)
+    FOREIGN KEY (id_professor) REFERENCES Professor(id_professor) ON DELETE SET NULL
 );
 
+-- Fila de jobs em segundo plano (consumida com SELECT ... FOR UPDATE SKIP LOCKED)
+CREATE TABLE Job (
+    id_job SERIAL PRIMARY KEY,
+    tipo VARCHAR(50) NOT NULL,
+    parametros JSON,
+    status VARCHAR(20) NOT NULL DEFAULT 'pendente',
+    tentativas INT NOT NULL DEFAULT 0,
+    max_tentativas INT NOT NULL DEFAULT 3,
+    resultado JSON,
+    erro TEXT,
+    criado_em TIMESTAMP NOT NULL DEFAULT (now() AT TIME ZONE 'utc'),
+    executar_apos TIMESTAMP NOT NULL DEFAULT (now() AT TIME ZONE 'utc'),
+    iniciado_em TIMESTAMP,
+    renovado_em TIMESTAMP,
+    concluido_em TIMESTAMP
+);
+
+-- Arquivos de resultado dos jobs (ex.: CSV exportado), gravados e lidos em partes
+CREATE TABLE Parte_Resultado_Job (
+    id_job INT NOT NULL REFERENCES Job(id_job) ON DELETE CASCADE,
+    parte INT NOT NULL,
+    dados BYTEA NOT NULL,
+    PRIMARY KEY (id_job, parte)
+);
+
+-- Histórico arquivado: linhas antigas de presença/pagamento movidas para lotes comprimidos
+-- (um lote por aluno e ano, colunas em JSON comprimido com zlib), lidos só sob demanda
+CREATE SCHEMA IF NOT EXISTS arquivo;
+
+CREATE TABLE arquivo.lote (
+    id_lote SERIAL PRIMARY KEY,
+    entidade VARCHAR(20) NOT NULL,
+    id_aluno INT NOT NULL,
+    inicio DATE NOT NULL,
+    fim DATE NOT NULL,
+    quantidade INT NOT NULL,
+    dados BYTEA NOT NULL,
+    arquivado_em TIMESTAMP NOT NULL DEFAULT (now() AT TIME ZONE 'utc'),
+    FOREIGN KEY (id_aluno) REFERENCES Aluno(id_aluno) ON DELETE CASCADE
+);
+
+-- Multi-escola: escola -> esquema e shard (banco) que a atende; usado só com ESCOLAS_ATIVAS=1
+CREATE TABLE escola_catalogo (
+    slug VARCHAR(40) PRIMARY KEY,
+    esquema VARCHAR(63) NOT NULL UNIQUE,
+    shard VARCHAR(50) NOT NULL DEFAULT 'principal',
+    dominio VARCHAR(255) UNIQUE,
+    status VARCHAR(20) NOT NULL DEFAULT 'ativa' CHECK (status IN ('ativa', 'migrando'))
+);
+
+-- Aulas semanais das turmas (dia_semana 0 = segunda). id_professor é copiado da turma pelas
+-- triggers, e a exclusão GiST impede aulas sobrepostas do mesmo professor no mesmo dia
+CREATE EXTENSION IF NOT EXISTS btree_gist WITH SCHEMA public;
+CREATE TYPE public.faixa_horario AS RANGE (subtype = time);
+
+CREATE TABLE Horario_Turma (
+    id_horario SERIAL PRIMARY KEY,
+    id_turma INT NOT NULL,
+    id_professor INT,
+    dia_semana SMALLINT NOT NULL,
+    inicio TIME NOT NULL,
+    fim TIME NOT NULL,
+    FOREIGN KEY (id_turma) REFERENCES Turma(id_turma) ON DELETE CASCADE,
+    CONSTRAINT ck_horario_turma_dia CHECK (dia_semana BETWEEN 0 AND 6),
+    CONSTRAINT ck_horario_turma_intervalo CHECK (inicio < fim),
+    CONSTRAINT ex_horario_turma_professor EXCLUDE USING gist
+        (id_professor WITH =, dia_semana WITH =, public.faixa_horario(inicio, fim) WITH &&)
+);
+
+CREATE OR REPLACE FUNCTION public.horario_turma_professor() RETURNS trigger AS $f$
+BEGIN
+    EXECUTE format('SELECT id_professor FROM %I.turma WHERE id_turma = $1', TG_TABLE_SCHEMA)
+        INTO NEW.id_professor USING NEW.id_turma;
+    RETURN NEW;
+END;
+$f$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION public.turma_professor_horarios() RETURNS trigger AS $f$
+BEGIN
+    EXECUTE format('UPDATE %I.horario_turma SET id_professor = $1 WHERE id_turma = $2', TG_TABLE_SCHEMA)
+        USING NEW.id_professor, NEW.id_turma;
+    RETURN NULL;
+END;
+$f$ LANGUAGE plpgsql;
+
+CREATE TRIGGER horario_turma_professor BEFORE INSERT OR UPDATE OF id_turma ON Horario_Turma
+    FOR EACH ROW EXECUTE FUNCTION public.horario_turma_professor();
+CREATE TRIGGER turma_professor_horarios AFTER UPDATE OF id_professor ON Turma
+    FOR EACH ROW WHEN (OLD.id_professor IS DISTINCT FROM NEW.id_professor)
+    EXECUTE FUNCTION public.turma_professor_horarios();
+
+-- Idempotency-Key: resposta da primeira execução de um POST/PUT, devolvida às repetições até expira_em
+CREATE TABLE Chave_Idempotencia (
+    chave VARCHAR(255) PRIMARY KEY,
+    assinatura BYTEA NOT NULL,
+    status SMALLINT,
+    content_type VARCHAR(100),
+    corpo BYTEA,
+    criado_em TIMESTAMP NOT NULL DEFAULT (now() AT TIME ZONE 'utc'),
+    expira_em TIMESTAMP NOT NULL
+);
+
+-- Tokens de acesso revogados antes de expirar (um jti ou todos os tokens de um usuário)
+CREATE TABLE Revogacao (
+    id_revogacao SERIAL PRIMARY KEY,
+    jti VARCHAR(32),
+    id_usuario INT REFERENCES Usuario(id_usuario) ON DELETE CASCADE,
+    revogado_em TIMESTAMP NOT NULL DEFAULT (now() AT TIME ZONE 'utc'),
+    expira_em TIMESTAMP NOT NULL,
+    CONSTRAINT ck_revogacao_alvo CHECK (jti IS NOT NULL OR id_usuario IS NOT NULL)
+);
+
+-- Auditoria: alterações de cada linha (valores antigos e novos, usuário e origem), gravadas em lotes
+-- pela aplicação. Somente inserção (trigger) e particionada por mês: o histórico antigo sai com
+-- DETACH/DROP da partição, sem DELETE
+CREATE TABLE Auditoria (
+    id_auditoria BIGSERIAL,
+    registrado_em TIMESTAMP NOT NULL,
+    entidade VARCHAR(50) NOT NULL,
+    id_registro VARCHAR(100),
+    operacao VARCHAR(10) NOT NULL,
+    antes JSONB,
+    depois JSONB,
+    id_usuario INT,
+    origem VARCHAR(255),
+    PRIMARY KEY (id_auditoria, registrado_em)
+) PARTITION BY RANGE (registrado_em);
+
+CREATE TABLE Auditoria_Padrao PARTITION OF Auditoria DEFAULT;
+
+-- As partições mensais ficam a cargo da aplicação: public.auditoria_particoes é definida só em
+-- app/models.py (FUNCAO_AUDITORIA_PARTICOES) e criada pelo create_all ou pela thread de auditoria,
+-- que a chama antes de gravar. Até lá os registros ficam em Auditoria_Padrao e são redistribuídos
+
+CREATE OR REPLACE FUNCTION public.auditoria_somente_insercao() RETURNS trigger AS $f$
+BEGIN
+    RAISE EXCEPTION 'auditoria aceita somente inserções (% recusado)', TG_OP;
+END;
+$f$ LANGUAGE plpgsql;
+
+CREATE TRIGGER auditoria_somente_insercao BEFORE UPDATE OR DELETE ON Auditoria
+    FOR EACH ROW EXECUTE FUNCTION public.auditoria_somente_insercao();
+
+CREATE INDEX ix_job_fila ON Job (status, executar_apos);
+CREATE INDEX ix_chave_idempotencia_expira_em ON Chave_Idempotencia (expira_em);
+CREATE INDEX ix_revogacao_expira_em ON Revogacao (expira_em);
+CREATE INDEX ix_revogacao_id_usuario ON Revogacao (id_usuario);
+CREATE INDEX ix_auditoria_registro ON Auditoria (entidade, id_registro, registrado_em);
+CREATE INDEX ix_auditoria_entidade ON Auditoria (entidade, registrado_em);
+
+-- Índices nas chaves estrangeiras: exclusões em cascata/SET NULL sem varrer as tabelas filhas
+CREATE INDEX ix_turma_id_professor ON Turma (id_professor);
+CREATE INDEX ix_aluno_id_turma ON Aluno (id_turma);
+CREATE INDEX ix_pagamento_id_aluno ON Pagamento (id_aluno);
+CREATE INDEX ix_presenca_id_aluno ON Presenca (id_aluno);
+CREATE INDEX ix_atividade_aluno_id_aluno ON Atividade_Aluno (id_aluno);
+CREATE INDEX ix_usuario_id_professor ON Usuario (id_professor);
+CREATE INDEX ix_lote_entidade_aluno ON arquivo.lote (entidade, id_aluno, inicio);
+CREATE INDEX ix_horario_turma_id_turma ON Horario_Turma (id_turma);
+
 INSERT INTO Professor (nome_completo, email, telefone) VALUES
 ('Professor A', 'profA@example.com', '1234567890'),
 ('Professor B', 'profB@example.com', '1234567891'),
@@ -91,6 +251,11 @@ INSERT INTO Turma (nome_turma, id_professor, horario) VALUES
 ('Turma 9', 9, '13:00 - 17:00'),
 ('Turma 10', 10, '13:00 - 17:00');
 
+-- Turmas de segunda a sexta no horário descrito em Turma.horario
+INSERT INTO Horario_Turma (id_turma, dia_semana, inicio, fim)
+SELECT t.id_turma, d.dia, split_part(t.horario, ' - ', 1)::time, split_part(t.horario, ' - ', 2)::time
+FROM Turma t CROSS JOIN generate_series(0, 4) AS d(dia);
+
 INSERT INTO Aluno (nome_completo, data_nascimento, id_turma, nome_responsavel, telefone_responsavel, email_responsavel, informacoes_adicionais) VALUES
 ('Aluno A', '2010-01-01', 1, 'Responsável A', '9876543210', 'respA@example.com', NULL),
 ('Aluno B', '2010-02-01', 2, 'Responsável B', '9876543211', 'respB@example.com', NULL),
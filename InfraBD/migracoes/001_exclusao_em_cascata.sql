@@ -0,0 +1,40 @@
+-- Aplica as regras de exclusão (ON DELETE) em bancos criados antes da mudança.
+-- Uso: psql -U postgres -d escola -f InfraBD/migracoes/001_exclusao_em_cascata.sql
+BEGIN;
+
+ALTER TABLE Turma DROP CONSTRAINT IF EXISTS turma_id_professor_fkey,
+    ADD CONSTRAINT turma_id_professor_fkey FOREIGN KEY (id_professor)
+        REFERENCES Professor(id_professor) ON DELETE SET NULL;
+
+ALTER TABLE Aluno DROP CONSTRAINT IF EXISTS aluno_id_turma_fkey,
+    ADD CONSTRAINT aluno_id_turma_fkey FOREIGN KEY (id_turma)
+        REFERENCES Turma(id_turma) ON DELETE SET NULL;
+
+ALTER TABLE Pagamento DROP CONSTRAINT IF EXISTS pagamento_id_aluno_fkey,
+    ADD CONSTRAINT pagamento_id_aluno_fkey FOREIGN KEY (id_aluno)
+        REFERENCES Aluno(id_aluno) ON DELETE CASCADE;
+
+ALTER TABLE Presenca DROP CONSTRAINT IF EXISTS presenca_id_aluno_fkey,
+    ADD CONSTRAINT presenca_id_aluno_fkey FOREIGN KEY (id_aluno)
+        REFERENCES Aluno(id_aluno) ON DELETE CASCADE;
+
+ALTER TABLE Atividade_Aluno DROP CONSTRAINT IF EXISTS atividade_aluno_id_atividade_fkey,
+    ADD CONSTRAINT atividade_aluno_id_atividade_fkey FOREIGN KEY (id_atividade)
+        REFERENCES Atividade(id_atividade) ON DELETE CASCADE;
+
+ALTER TABLE Atividade_Aluno DROP CONSTRAINT IF EXISTS atividade_aluno_id_aluno_fkey,
+    ADD CONSTRAINT atividade_aluno_id_aluno_fkey FOREIGN KEY (id_aluno)
+        REFERENCES Aluno(id_aluno) ON DELETE CASCADE;
+
+ALTER TABLE Usuario DROP CONSTRAINT IF EXISTS usuario_id_professor_fkey,
+    ADD CONSTRAINT usuario_id_professor_fkey FOREIGN KEY (id_professor)
+        REFERENCES Professor(id_professor) ON DELETE SET NULL;
+
+CREATE INDEX IF NOT EXISTS ix_turma_id_professor ON Turma (id_professor);
+CREATE INDEX IF NOT EXISTS ix_aluno_id_turma ON Aluno (id_turma);
+CREATE INDEX IF NOT EXISTS ix_pagamento_id_aluno ON Pagamento (id_aluno);
+CREATE INDEX IF NOT EXISTS ix_presenca_id_aluno ON Presenca (id_aluno);
+CREATE INDEX IF NOT EXISTS ix_atividade_aluno_id_aluno ON Atividade_Aluno (id_aluno);
+CREATE INDEX IF NOT EXISTS ix_usuario_id_professor ON Usuario (id_professor);
+
+COMMIT;
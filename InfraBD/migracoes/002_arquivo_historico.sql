@@ -0,0 +1,23 @@
+-- Cria o esquema do histórico arquivado em bancos criados antes da mudança.
+-- Uso: psql -U postgres -d escola -f InfraBD/migracoes/002_arquivo_historico.sql
+BEGIN;
+
+-- Histórico arquivado: linhas antigas de presença/pagamento movidas para lotes comprimidos
+-- (um lote por aluno e ano, colunas em JSON comprimido com zlib), lidos só sob demanda
+CREATE SCHEMA IF NOT EXISTS arquivo;
+
+CREATE TABLE IF NOT EXISTS arquivo.lote (
+    id_lote SERIAL PRIMARY KEY,
+    entidade VARCHAR(20) NOT NULL,
+    id_aluno INT NOT NULL,
+    inicio DATE NOT NULL,
+    fim DATE NOT NULL,
+    quantidade INT NOT NULL,
+    dados BYTEA NOT NULL,
+    arquivado_em TIMESTAMP NOT NULL DEFAULT (now() AT TIME ZONE 'utc'),
+    FOREIGN KEY (id_aluno) REFERENCES Aluno(id_aluno) ON DELETE CASCADE
+);
+
+CREATE INDEX IF NOT EXISTS ix_lote_entidade_aluno ON arquivo.lote (entidade, id_aluno, inicio);
+
+COMMIT;
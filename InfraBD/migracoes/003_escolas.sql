@@ -0,0 +1,14 @@
+-- Cria o catálogo de escolas (multi-escola) em bancos criados antes da mudança.
+-- Uso: psql -U postgres -d escola -f InfraBD/migracoes/003_escolas.sql
+-- Em cada shard, aplique também InfraBD/notificacoes.sql (função instalar_notificacoes).
+BEGIN;
+
+CREATE TABLE IF NOT EXISTS escola_catalogo (
+    slug VARCHAR(40) PRIMARY KEY,
+    esquema VARCHAR(63) NOT NULL UNIQUE,
+    shard VARCHAR(50) NOT NULL DEFAULT 'principal',
+    dominio VARCHAR(255) UNIQUE,
+    status VARCHAR(20) NOT NULL DEFAULT 'ativa' CHECK (status IN ('ativa', 'migrando'))
+);
+
+COMMIT;
@@ -0,0 +1,53 @@
+-- Cria as aulas semanais das turmas (horario_turma) em bancos criados antes da mudança.
+-- Uso: psql -U postgres -d escola -f InfraBD/migracoes/004_horarios_turma.sql
+-- Com multi-escola, aplique em cada esquema (SET search_path) e reaplique InfraBD/notificacoes.sql.
+-- Turma.horario continua texto livre: as aulas das turmas existentes são cadastradas pela API.
+BEGIN;
+
+CREATE EXTENSION IF NOT EXISTS btree_gist WITH SCHEMA public;
+DO $$ BEGIN
+    CREATE TYPE public.faixa_horario AS RANGE (subtype = time);
+EXCEPTION WHEN duplicate_object THEN NULL;
+END $$;
+
+CREATE TABLE IF NOT EXISTS Horario_Turma (
+    id_horario SERIAL PRIMARY KEY,
+    id_turma INT NOT NULL,
+    id_professor INT,
+    dia_semana SMALLINT NOT NULL,
+    inicio TIME NOT NULL,
+    fim TIME NOT NULL,
+    FOREIGN KEY (id_turma) REFERENCES Turma(id_turma) ON DELETE CASCADE,
+    CONSTRAINT ck_horario_turma_dia CHECK (dia_semana BETWEEN 0 AND 6),
+    CONSTRAINT ck_horario_turma_intervalo CHECK (inicio < fim),
+    CONSTRAINT ex_horario_turma_professor EXCLUDE USING gist
+        (id_professor WITH =, dia_semana WITH =, public.faixa_horario(inicio, fim) WITH &&)
+);
+
+CREATE OR REPLACE FUNCTION public.horario_turma_professor() RETURNS trigger AS $f$
+BEGIN
+    EXECUTE format('SELECT id_professor FROM %I.turma WHERE id_turma = $1', TG_TABLE_SCHEMA)
+        INTO NEW.id_professor USING NEW.id_turma;
+    RETURN NEW;
+END;
+$f$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION public.turma_professor_horarios() RETURNS trigger AS $f$
+BEGIN
+    EXECUTE format('UPDATE %I.horario_turma SET id_professor = $1 WHERE id_turma = $2', TG_TABLE_SCHEMA)
+        USING NEW.id_professor, NEW.id_turma;
+    RETURN NULL;
+END;
+$f$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS horario_turma_professor ON Horario_Turma;
+DROP TRIGGER IF EXISTS turma_professor_horarios ON Turma;
+CREATE TRIGGER horario_turma_professor BEFORE INSERT OR UPDATE OF id_turma ON Horario_Turma
+    FOR EACH ROW EXECUTE FUNCTION public.horario_turma_professor();
+CREATE TRIGGER turma_professor_horarios AFTER UPDATE OF id_professor ON Turma
+    FOR EACH ROW WHEN (OLD.id_professor IS DISTINCT FROM NEW.id_professor)
+    EXECUTE FUNCTION public.turma_professor_horarios();
+
+CREATE INDEX IF NOT EXISTS ix_horario_turma_id_turma ON Horario_Turma (id_turma);
+
+COMMIT;
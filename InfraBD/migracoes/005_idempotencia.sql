@@ -0,0 +1,18 @@
+-- Cria a tabela de chaves de idempotência em bancos criados antes da mudança.
+-- Uso: psql -U postgres -d escola -f InfraBD/migracoes/005_idempotencia.sql
+BEGIN;
+
+-- Idempotency-Key: resposta da primeira execução de um POST/PUT, devolvida às repetições até expira_em
+CREATE TABLE IF NOT EXISTS Chave_Idempotencia (
+    chave VARCHAR(255) PRIMARY KEY,
+    assinatura BYTEA NOT NULL,
+    status SMALLINT,
+    content_type VARCHAR(100),
+    corpo BYTEA,
+    criado_em TIMESTAMP NOT NULL DEFAULT (now() AT TIME ZONE 'utc'),
+    expira_em TIMESTAMP NOT NULL
+);
+
+CREATE INDEX IF NOT EXISTS ix_chave_idempotencia_expira_em ON Chave_Idempotencia (expira_em);
+
+COMMIT;
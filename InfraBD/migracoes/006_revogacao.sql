@@ -0,0 +1,21 @@
+-- Cria a tabela de revogação de tokens em bancos criados antes da mudança.
+-- Uso: psql -U postgres -d escola -f InfraBD/migracoes/006_revogacao.sql
+-- As senhas em texto puro de Usuario são convertidas para scrypt no primeiro login de cada usuário.
+BEGIN;
+
+-- Tokens de acesso revogados antes de expirar (um jti ou todos os tokens de um usuário)
+CREATE TABLE IF NOT EXISTS Revogacao (
+    id_revogacao SERIAL PRIMARY KEY,
+    jti VARCHAR(32),
+    id_usuario INT REFERENCES Usuario(id_usuario) ON DELETE CASCADE,
+    revogado_em TIMESTAMP NOT NULL DEFAULT (now() AT TIME ZONE 'utc'),
+    expira_em TIMESTAMP NOT NULL,
+    CONSTRAINT ck_revogacao_alvo CHECK (jti IS NOT NULL OR id_usuario IS NOT NULL)
+);
+
+CREATE INDEX IF NOT EXISTS ix_revogacao_expira_em ON Revogacao (expira_em);
+CREATE INDEX IF NOT EXISTS ix_revogacao_id_usuario ON Revogacao (id_usuario);
+
+COMMIT;
+
+-- Depois, aplique de novo InfraBD/notificacoes.sql: a lista de tabelas de instalar_notificacoes inclui revogacao
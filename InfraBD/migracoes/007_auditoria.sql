@@ -0,0 +1,41 @@
+-- Cria a tabela de auditoria em bancos criados antes da mudança.
+-- Uso: psql -U postgres -d escola -f InfraBD/migracoes/007_auditoria.sql
+-- Com várias escolas, rode uma vez por esquema: PGOPTIONS="-csearch_path=escola_x" psql ... (as funções
+-- ficam em public e são as mesmas para todos)
+BEGIN;
+
+-- Auditoria: alterações de cada linha (valores antigos e novos, usuário e origem), gravadas em lotes
+-- pela aplicação. Somente inserção (trigger) e particionada por mês: o histórico antigo sai com
+-- DETACH/DROP da partição, sem DELETE
+CREATE TABLE IF NOT EXISTS Auditoria (
+    id_auditoria BIGSERIAL,
+    registrado_em TIMESTAMP NOT NULL,
+    entidade VARCHAR(50) NOT NULL,
+    id_registro VARCHAR(100),
+    operacao VARCHAR(10) NOT NULL,
+    antes JSONB,
+    depois JSONB,
+    id_usuario INT,
+    origem VARCHAR(255),
+    PRIMARY KEY (id_auditoria, registrado_em)
+) PARTITION BY RANGE (registrado_em);
+
+CREATE TABLE IF NOT EXISTS Auditoria_Padrao PARTITION OF Auditoria DEFAULT;
+
+-- As partições mensais ficam a cargo da aplicação: public.auditoria_particoes é definida só em
+-- app/models.py (FUNCAO_AUDITORIA_PARTICOES) e criada pelo create_all ou pela thread de auditoria,
+-- que a chama antes de gravar. Até lá os registros ficam em Auditoria_Padrao e são redistribuídos
+
+CREATE OR REPLACE FUNCTION public.auditoria_somente_insercao() RETURNS trigger AS $f$
+BEGIN
+    RAISE EXCEPTION 'auditoria aceita somente inserções (% recusado)', TG_OP;
+END;
+$f$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE TRIGGER auditoria_somente_insercao BEFORE UPDATE OR DELETE ON Auditoria
+    FOR EACH ROW EXECUTE FUNCTION public.auditoria_somente_insercao();
+
+CREATE INDEX IF NOT EXISTS ix_auditoria_registro ON Auditoria (entidade, id_registro, registrado_em);
+CREATE INDEX IF NOT EXISTS ix_auditoria_entidade ON Auditoria (entidade, registrado_em);
+
+COMMIT;
@@ -0,0 +1,14 @@
+-- Cria a tabela das partes dos arquivos de resultado dos jobs em bancos criados antes da mudança.
+-- Uso: psql -U postgres -d escola -f InfraBD/migracoes/008_resultado_job.sql
+-- Jobs exportar_csv concluídos antes da mudança guardam o CSV em resultado e continuam sendo servidos.
+BEGIN;
+
+-- Arquivos de resultado dos jobs (ex.: CSV exportado), gravados e lidos em partes
+CREATE TABLE Parte_Resultado_Job (
+    id_job INT NOT NULL REFERENCES Job(id_job) ON DELETE CASCADE,
+    parte INT NOT NULL,
+    dados BYTEA NOT NULL,
+    PRIMARY KEY (id_job, parte)
+);
+
+COMMIT;
@@ -0,0 +1,9 @@
+-- Acrescenta o arrendamento dos jobs em bancos criados antes da mudança.
+-- Uso: psql -U postgres -d escola -f InfraBD/migracoes/009_arrendamento_job.sql
+-- Jobs já em execução sem renovado_em usam iniciado_em até a primeira renovação.
+BEGIN;
+
+-- Renovado pelo worker durante a execução; sem renovação por JOB_TIMEOUT o job volta à fila
+ALTER TABLE Job ADD COLUMN IF NOT EXISTS renovado_em TIMESTAMP;
+
+COMMIT;
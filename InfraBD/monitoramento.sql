@@ -0,0 +1,3 @@
+-- Extensão usada pelas consultas customizadas do postgres-exporter (postgres-exporter/queries.yaml).
+-- Requer shared_preload_libraries=pg_stat_statements (definido no CMD do Dockerfile).
+CREATE EXTENSION IF NOT EXISTS pg_stat_statements;
@@ -0,0 +1,72 @@
+-- Notificações de alteração (LISTEN/NOTIFY) para invalidação de cache e atualização ao vivo.
+-- Triggers por instrução com transition tables: um único NOTIFY por INSERT/UPDATE/DELETE,
+-- com os IDs afetados (ou NULL quando passam de 100, ex.: importações em massa).
+-- Também pode ser aplicado em bancos existentes: psql -U postgres -d escola -f notificacoes.sql
+
+CREATE OR REPLACE FUNCTION notificar_alteracao() RETURNS trigger AS $$
+DECLARE
+    total INT;
+    ids JSON;
+BEGIN
+    IF TG_OP = 'DELETE' THEN
+        EXECUTE format('SELECT count(*), json_agg(%I) FROM (SELECT %I FROM antigos LIMIT 101) x',
+                       TG_ARGV[0], TG_ARGV[0]) INTO total, ids;
+    ELSE
+        EXECUTE format('SELECT count(*), json_agg(%I) FROM (SELECT %I FROM novos LIMIT 101) x',
+                       TG_ARGV[0], TG_ARGV[0]) INTO total, ids;
+    END IF;
+
+    IF total = 0 THEN
+        RETURN NULL;
+    END IF;
+    IF total > 100 THEN
+        ids := NULL;
+    END IF;
+
+    PERFORM pg_notify('escola_alteracoes', json_build_object(
+        'entidade', TG_TABLE_NAME,
+        'operacao', TG_OP,
+        'ids', ids,
+        -- Com multi-escola, identifica a escola (esquema) da alteração
+        'esquema', TG_TABLE_SCHEMA
+    )::text);
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Instala as triggers nas tabelas de um esquema ('public' ou o esquema de uma escola, ver
+-- "flask escolas registrar"). Pode ser chamada de novo: as triggers são recriadas.
+CREATE OR REPLACE FUNCTION instalar_notificacoes(esquema TEXT DEFAULT 'public') RETURNS void AS $$
+DECLARE
+    tabela RECORD;
+BEGIN
+    FOR tabela IN SELECT * FROM (VALUES
+        ('professor', 'id_professor'),
+        ('turma', 'id_turma'),
+        ('aluno', 'id_aluno'),
+        ('pagamento', 'id_pagamento'),
+        ('presenca', 'id_presenca'),
+        ('atividade', 'id_atividade'),
+        -- Participantes: os IDs publicados são das atividades afetadas
+        ('atividade_aluno', 'id_atividade'),
+        ('horario_turma', 'id_horario'),
+        ('revogacao', 'id_revogacao')
+    ) AS t(nome, pk)
+    LOOP
+        EXECUTE format('DROP TRIGGER IF EXISTS %I ON %I.%I', tabela.nome || '_notificar_insert', esquema, tabela.nome);
+        EXECUTE format('DROP TRIGGER IF EXISTS %I ON %I.%I', tabela.nome || '_notificar_update', esquema, tabela.nome);
+        EXECUTE format('DROP TRIGGER IF EXISTS %I ON %I.%I', tabela.nome || '_notificar_delete', esquema, tabela.nome);
+        EXECUTE format('CREATE TRIGGER %I AFTER INSERT ON %I.%I REFERENCING NEW TABLE AS novos '
+                       'FOR EACH STATEMENT EXECUTE FUNCTION public.notificar_alteracao(%L)',
+                       tabela.nome || '_notificar_insert', esquema, tabela.nome, tabela.pk);
+        EXECUTE format('CREATE TRIGGER %I AFTER UPDATE ON %I.%I REFERENCING NEW TABLE AS novos '
+                       'FOR EACH STATEMENT EXECUTE FUNCTION public.notificar_alteracao(%L)',
+                       tabela.nome || '_notificar_update', esquema, tabela.nome, tabela.pk);
+        EXECUTE format('CREATE TRIGGER %I AFTER DELETE ON %I.%I REFERENCING OLD TABLE AS antigos '
+                       'FOR EACH STATEMENT EXECUTE FUNCTION public.notificar_alteracao(%L)',
+                       tabela.nome || '_notificar_delete', esquema, tabela.nome, tabela.pk);
+    END LOOP;
+END;
+$$ LANGUAGE plpgsql;
+
+SELECT instalar_notificacoes('public');
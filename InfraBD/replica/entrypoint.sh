@@ -0,0 +1,18 @@
+#!/bin/bash
+# Inicializa a réplica a partir de um pg_basebackup do primário e sobe em modo standby
+set -e
+
+if [ ! -s "$PGDATA/PG_VERSION" ]; then
+    echo "Aguardando o primário em ${PRIMARY_HOST}..."
+    until pg_isready -h "$PRIMARY_HOST" -p "${PRIMARY_PORT:-5432}" -U "$REPLICATION_USER"; do
+        sleep 1
+    done
+
+    export PGPASSWORD="$REPLICATION_PASSWORD"
+    pg_basebackup -h "$PRIMARY_HOST" -p "${PRIMARY_PORT:-5432}" -U "$REPLICATION_USER" \
+        -D "$PGDATA" -R -X stream -P
+    chown -R postgres:postgres "$PGDATA"
+    chmod 700 "$PGDATA"
+fi
+
+exec gosu postgres postgres -c hot_standby=on
@@ -0,0 +1,160 @@
+import logging
+import math
+import threading
+import time
+from collections import OrderedDict
+
+from flask import current_app, jsonify, request
+
+from metricas import ADMISSAO, EM_EXECUCAO, ESPERA_FILA
+
+logger = logging.getLogger(__name__)
+
+# Rotas sem limite de concorrência (conexões longas ou de infraestrutura)
+LIVRE = 'livre'
+
+
+def classe_rota(classe):
+    """Define explicitamente a classe de admissão de uma rota ('leitura', 'cara', 'escrita' ou 'livre')"""
+    def marcar(view):
+        view._classe_rota = classe
+        return view
+    return marcar
+
+
+def classificar(view):
+    """Classe da requisição: listagens/relatórios são caras, GET por ID é leitura, o resto é escrita"""
+    classe = getattr(view, '_classe_rota', None)
+    if classe:
+        return classe
+    if request.method not in ('GET', 'HEAD'):
+        return 'escrita'
+    if not request.view_args:
+        return 'cara'
+    return 'leitura'
+
+
+def cliente():
+    # Atrás do nginx o ProxyFix (PROXIES_CONFIAVEIS) já trocou remote_addr pelo IP que o proxy viu; os
+    # primeiros itens do X-Forwarded-For vêm do próprio cliente e trocariam de balde a cada requisição
+    return request.remote_addr or 'desconhecido'
+
+
+class TokenBuckets:
+    """Token bucket por (cliente, classe), com limite de chaves guardadas em memória"""
+
+    def __init__(self, max_chaves=10000):
+        self._baldes = OrderedDict()
+        self._lock = threading.Lock()
+        self._max_chaves = max_chaves
+
+    def consumir(self, chave, taxa, rajada):
+        """Retorna 0 se admitido, ou os segundos até haver um token disponível"""
+        agora = time.monotonic()
+        with self._lock:
+            tokens, atualizado = self._baldes.pop(chave, (rajada, agora))
+            tokens = min(rajada, tokens + (agora - atualizado) * taxa)
+            espera = 0.0
+            if tokens >= 1:
+                tokens -= 1
+            else:
+                espera = (1 - tokens) / taxa
+            self._baldes[chave] = (tokens, agora)
+            while len(self._baldes) > self._max_chaves:
+                self._baldes.popitem(last=False)
+            return espera
+
+
+class Vagas:
+    """Limite de concorrência de uma classe, com fila limitada pelo orçamento de latência"""
+
+    def __init__(self, limite):
+        self._semaforo = threading.BoundedSemaphore(limite)
+        self._lock = threading.Lock()
+        self.limite = limite
+        self.aguardando = 0
+        # Média móvel do tempo de atendimento, usada para estimar a espera na fila
+        self.tempo_medio = 0.05
+
+    def espera_estimada(self):
+        return (self.aguardando + 1) * self.tempo_medio / self.limite
+
+    def ocupar(self, orcamento):
+        with self._lock:
+            if self.espera_estimada() > orcamento:
+                return False
+            self.aguardando += 1
+        try:
+            return self._semaforo.acquire(timeout=orcamento)
+        finally:
+            with self._lock:
+                self.aguardando -= 1
+
+    def liberar(self, duracao):
+        self.tempo_medio = 0.8 * self.tempo_medio + 0.2 * duracao
+        self._semaforo.release()
+
+
+class ControleAdmissao:
+
+    def __init__(self, app=None):
+        self.buckets = TokenBuckets()
+        self.vagas = {}
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.extensions['admissao'] = self
+        if not app.config['ADMISSAO_ATIVA']:
+            return
+        self.vagas = {classe: Vagas(limite) for classe, limite in app.config['LIMITES_CONCORRENCIA'].items()}
+        app.before_request(self._admitir)
+        app.teardown_request(self._liberar)
+
+    def _recusar(self, classe, status, espera, mensagem):
+        ADMISSAO.labels(classe, 'limitada' if status == 429 else 'descartada').inc()
+        logger.warning(f'ADMISSAO: {mensagem} ({classe}, {request.method} {request.path}, cliente {cliente()}).')
+        resposta = jsonify({'error': mensagem})
+        resposta.status_code = status
+        resposta.headers['Retry-After'] = str(max(1, math.ceil(espera)))
+        return resposta
+
+    def _admitir(self):
+        view = current_app.view_functions.get(request.endpoint)
+        if view is None:
+            return None
+        classe = classificar(view)
+        if classe == LIVRE:
+            return None
+
+        taxa, rajada = current_app.config['LIMITES_TAXA'][classe]
+        espera = self.buckets.consumir((cliente(), classe), taxa, rajada)
+        if espera:
+            return self._recusar(classe, 429, espera, 'Limite de requisições excedido')
+
+        vagas = self.vagas.get(classe)
+        if vagas is not None:
+            orcamento = current_app.config['ORCAMENTO_LATENCIA']
+            inicio = time.monotonic()
+            if not vagas.ocupar(orcamento):
+                return self._recusar(classe, 503, vagas.espera_estimada(), 'Servidor sobrecarregado')
+            ESPERA_FILA.labels(classe).observe(time.monotonic() - inicio)
+            request.environ['escola.admissao_vaga'] = (vagas, time.monotonic())
+
+        # No environ e não em g: as sub-requisições de /batch compartilham o g da requisição original
+        request.environ['escola.admissao_classe'] = classe
+        EM_EXECUCAO.labels(classe).inc()
+        ADMISSAO.labels(classe, 'admitida').inc()
+        return None
+
+    def _liberar(self, exc=None):
+        classe = request.environ.pop('escola.admissao_classe', None)
+        if classe is not None:
+            EM_EXECUCAO.labels(classe).dec()
+        vaga = request.environ.pop('escola.admissao_vaga', None)
+        if vaga is not None:
+            vagas, inicio = vaga
+            vagas.liberar(time.monotonic() - inicio)
+
+
+admissao = ControleAdmissao()
@@ -1,10 +1,49 @@
+import io
+import json
 import logging
+import queue
 from logging.handlers import RotatingFileHandler
-from flask import Flask, request, jsonify, render_template, redirect
+from flask import Flask, Response, g, request, jsonify, render_template, redirect, stream_with_context
 from flask_restx import Api, Resource, fields
-from models import db, Turma, Professor, Aluno, Pagamento, Presenca, Atividade, AtividadeAluno, Usuario
+from werkzeug.middleware.proxy_fix import ProxyFix
+from models import db, Turma, HorarioTurma, Professor, Aluno, Pagamento, Presenca, Atividade, AtividadeAluno, Usuario, Job
 from config import Config
+from escolas import escolas, SHARD_PRINCIPAL
+from provisionamento import registrar, mover
+from replicas import router, usa_primario, somente_leitura
+from jobs import enfileirar, ler_partes, tipos_registrados
+import tarefas  # noqa: F401 - registra os tipos de job
+from arquivo import ARQUIVAVEIS, historico, restaurar
+from importacao import ENTIDADES as ENTIDADES_IMPORTACAO, importar
+from notificacoes import barramento, evento_sse
+from admissao import admissao, classe_rota, LIVRE
+import metricas
+from perfil import perfil_requisicoes, admin_requerido
+import rastreamento
+from saude import saude
+from estaticos import estaticos
+from cache_html import cache_html
+from busca import busca, ENTIDADES_BUSCA, LIMITE_PADRAO, LIMITE_MAXIMO
+from idempotencia import idempotencia, sem_idempotencia
+from auditoria import auditoria, registrar_em_massa, EXCLUIDAS as NAO_AUDITADAS
+from autenticacao import (
+    autenticacao, publica, permite_professor, escopo_professor, somente_administrador, turmas_permitidas,
+    alunos_permitidos, pode_ver_turma, pode_ver_aluno, acesso_negado, COOKIE
+)
+from formatos import resposta_negociada, tabela_negociada
+from documentos import (
+    documentos, folhas_frequencia, ler_mes, nome_arquivo, recibos, renderizar, FORMATOS as FORMATOS_DOCUMENTO, ZIP
+)
+from lote import carrega_por_id, em_lote, executar_lote, listar_por_ids
+from consultas import listar, totais_inicio
+from horarios import agenda, ConflitoHorario, descrever, ler_hora, ler_horarios, violou_exclusao
 from datetime import datetime
+from urllib.parse import urlsplit
+import click
+from sqlalchemy import select, literal
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import joinedload, selectinload
+from sqlalchemy.dialects.postgresql import insert as pg_insert
 
 # Configuração do logging com rotação de logs
 handler = RotatingFileHandler('escola_infantil.log', maxBytes=2000, backupCount=5)
@@ -17,7 +56,26 @@ logger = logging.getLogger(__name__)
 
 app = Flask(__name__)
 app.config.from_object(Config)
+if app.config['PROXIES_CONFIAVEIS']:
+    app.wsgi_app = ProxyFix(app.wsgi_app, x_for=app.config['PROXIES_CONFIAVEIS'])
 db.init_app(app)
+escolas.init_app(app)
+router.init_app(app)
+barramento.init_app(app)
+perfil_requisicoes.init_app(app)
+admissao.init_app(app)
+# Antes da idempotência: uma requisição sem token não reserva a chave
+autenticacao.init_app(app)
+rastreamento.init_app(app)
+saude.init_app(app)
+# Antes dos estáticos: registra os filtros usados pelos templates de documentos/
+documentos.init_app(app)
+estaticos.init_app(app)
+cache_html.init_app(app)
+busca.init_app(app)
+agenda.init_app(app)
+idempotencia.init_app(app)
+auditoria.init_app(app)
 
 # Configuração do Swagger
 api = Api(app, 
@@ -41,10 +99,17 @@ professor_model = api.model('Professor', {
     'telefone': fields.String(required=True, description='Telefone do professor')
 })
 
+horario_turma_model = api.model('HorarioTurma', {
+    'dia_semana': fields.Integer(required=True, description='Dia da semana (0 = segunda ... 6 = domingo)'),
+    'inicio': fields.String(required=True, description='Início da aula (HH:MM)'),
+    'fim': fields.String(required=True, description='Fim da aula (HH:MM)')
+})
+
 turma_model = api.model('Turma', {
     'nome_turma': fields.String(required=True, description='Nome da turma'),
     'id_professor': fields.Integer(required=True, description='ID do professor'),
-    'horario': fields.String(required=True, description='Horário da turma')
+    'horario': fields.String(description='Horário da turma (texto livre, gerado a partir de horarios quando informados)'),
+    'horarios': fields.List(fields.Nested(horario_turma_model), description='Aulas semanais; sem sobreposição com outras turmas do professor')
 })
 
 aluno_model = api.model('Aluno', {
@@ -81,6 +146,7 @@ except Exception as e:
 
 # Rota para API
 @app.route('/api')
+@classe_rota('leitura')
 def api_index():
     return jsonify({
         "message": "API da Escola Infantil",
@@ -96,14 +162,27 @@ def api_index():
 
 # Rotas para Professores com Swagger
 @ns_professores.route('/')
+@em_lote
 class ProfessoresList(Resource):
     @ns_professores.doc('listar_professores')
     def get(self):
         """Lista todos os professores"""
         try:
-            professores = Professor.query.all()
+            # ?ids=1,2,3: só as linhas pedidas, em um SELECT ... IN
+            por_ids = listar_por_ids(Professor)
+            if por_ids is not None:
+                logger.info(f'READ: {len(por_ids)} professores solicitados por ID.')
+                return por_ids
+            # MessagePack/Arrow em fluxo quando pedidos no Accept ou em ?formato=
+            binaria = tabela_negociada(Professor.__table__)
+            if binaria is not None:
+                logger.info(f'READ: Listagem de todos os professores solicitada ({binaria.content_type}).')
+                return binaria
+            professores = listar(Professor)
             logger.info('READ: Listagem de todos os professores solicitada.')
             return [professor.to_dict() for professor in professores]
+        except ValueError as e:
+            return {'error': str(e)}, 400
         except Exception as e:
             logger.error(f'ERROR: Falha ao listar professores - {e}')
             return {'error': 'Falha ao listar professores'}, 500
@@ -128,12 +207,13 @@ class ProfessoresList(Resource):
             return {'error': 'Falha ao cadastrar professor'}, 500
 
 @ns_professores.route('/<int:professor_id>')
+@carrega_por_id(Professor, 'professor_id')
 class ProfessorResource(Resource):
     @ns_professores.doc('obter_professor')
     def get(self, professor_id):
         """Obtém um professor por ID"""
         try:
-            professor = Professor.query.get(professor_id)
+            professor = db.session.get(Professor, professor_id)
             if not professor:
                 logger.warning(f'READ: Professor com ID {professor_id} não encontrado.')
                 return {'error': 'Professor não encontrado'}, 404
@@ -148,7 +228,7 @@ class ProfessorResource(Resource):
     def put(self, professor_id):
         """Atualiza um professor"""
         try:
-            professor = Professor.query.get(professor_id)
+            professor = db.session.get(Professor, professor_id)
             if not professor:
                 logger.warning(f'UPDATE: Professor com ID {professor_id} não encontrado.')
                 return {'error': 'Professor não encontrado'}, 404
@@ -172,12 +252,12 @@ class ProfessorResource(Resource):
     def delete(self, professor_id):
         """Exclui um professor"""
         try:
-            professor = Professor.query.get(professor_id)
-            if not professor:
+            # Uma única instrução DELETE; dependentes são tratados pelo banco (ON DELETE)
+            removidos = Professor.query.filter_by(id_professor=professor_id).delete(synchronize_session=False)
+            if not removidos:
                 logger.warning(f'DELETE: Professor com ID {professor_id} não encontrado.')
                 return {'error': 'Professor não encontrado'}, 404
             
-            db.session.delete(professor)
             db.session.commit()
             logger.info(f'DELETE: Professor com ID {professor_id} removido com sucesso.')
             return '', 204
@@ -185,16 +265,58 @@ class ProfessorResource(Resource):
             logger.error(f'ERROR: Falha ao excluir professor com ID {professor_id} - {e}')
             return {'error': 'Falha ao excluir professor'}, 500
 
+def aplicar_horarios(turma, id_professor, itens=None):
+    """Troca as aulas da turma (itens=None mantém as atuais), recusando sobreposição com as outras turmas do professor"""
+    id_professor = int(id_professor) if id_professor not in (None, '') else None
+    if itens is None:
+        if turma.id_turma is None or id_professor == turma.id_professor:
+            return
+        # Troca de professor: as aulas atuais precisam caber na agenda do novo
+        horarios = [(horario.dia_semana, horario.inicio, horario.fim) for horario in turma.horarios]
+    else:
+        horarios = ler_horarios(itens)
+    agenda.verificar(id_professor, horarios, ignorar_turma=turma.id_turma)
+    if itens is None:
+        return
+    if turma.id_turma is not None:
+        # Aulas antigas removidas antes das novas, para a exclusão não compará-las entre si
+        HorarioTurma.query.filter_by(id_turma=turma.id_turma).delete(synchronize_session=False)
+    for dia, inicio, fim in horarios:
+        db.session.add(HorarioTurma(turma=turma, id_professor=id_professor, dia_semana=dia, inicio=inicio, fim=fim))
+    if horarios:
+        turma.horario = descrever(horarios)
+
+def horarios_do_formulario(form):
+    """Aulas das linhas do formulário de turma (linhas sem início e fim são ignoradas)"""
+    return [
+        {'dia_semana': dia, 'inicio': inicio, 'fim': fim}
+        for dia, inicio, fim in zip(form.getlist('dia_semana'), form.getlist('inicio'), form.getlist('fim'))
+        if inicio or fim
+    ]
+
 # Rotas para Turmas com Swagger
 @ns_turmas.route('/')
+@em_lote
+@escopo_professor
 class TurmasList(Resource):
     @ns_turmas.doc('listar_turmas')
     def get(self):
         """Lista todas as turmas"""
         try:
-            turmas = Turma.query.all()
+            # ?ids=1,2,3: só as linhas pedidas, em um SELECT ... IN
+            permitidas = turmas_permitidas()
+            por_ids = listar_por_ids(Turma, selectinload(Turma.horarios))
+            if por_ids is not None:
+                por_ids = [turma for turma in por_ids if permitidas is None or turma['id_turma'] in permitidas]
+                logger.info(f'READ: {len(por_ids)} turmas solicitadas por ID.')
+                return por_ids
+            # Professor: só as próprias turmas
+            turmas = listar(Turma, selectinload(Turma.horarios),
+                            em=None if permitidas is None else (Turma.id_turma, permitidas))
             logger.info('READ: Listagem de todas as turmas solicitada.')
             return [turma.to_dict() for turma in turmas]
+        except ValueError as e:
+            return {'error': str(e)}, 400
         except Exception as e:
             logger.error(f'ERROR: Falha ao listar turmas - {e}')
             return {'error': 'Falha ao listar turmas'}, 500
@@ -208,26 +330,46 @@ class TurmasList(Resource):
             turma = Turma(
                 nome_turma=dados['nome_turma'],
                 id_professor=dados['id_professor'],
-                horario=dados['horario']
+                horario=dados.get('horario')
             )
+            aplicar_horarios(turma, dados['id_professor'], dados.get('horarios'))
             db.session.add(turma)
             db.session.commit()
             logger.info(f'CREATE: Turma {turma.nome_turma} inserida com sucesso.')
             return turma.to_dict(), 201
+        except ValueError as e:
+            db.session.rollback()
+            logger.warning(f'CREATE: Horários inválidos ao cadastrar turma - {e}')
+            return {'error': str(e)}, 400
+        except ConflitoHorario as e:
+            db.session.rollback()
+            logger.warning(f'CREATE: Turma recusada - {e}')
+            return {'error': str(e), 'conflitos': e.conflitos}, 409
+        except IntegrityError as e:
+            db.session.rollback()
+            if violou_exclusao(e):
+                logger.warning('CREATE: Turma recusada pela exclusão de horários do banco.')
+                return {'error': 'Conflito de horário com outra turma do professor'}, 409
+            logger.error(f'ERROR: Falha ao cadastrar turma - {e}')
+            return {'error': 'Falha ao cadastrar turma'}, 500
         except Exception as e:
             logger.error(f'ERROR: Falha ao cadastrar turma - {e}')
             return {'error': 'Falha ao cadastrar turma'}, 500
 
 @ns_turmas.route('/<int:turma_id>')
+@carrega_por_id(Turma, 'turma_id')
+@escopo_professor
 class TurmaResource(Resource):
     @ns_turmas.doc('obter_turma')
     def get(self, turma_id):
         """Obtém uma turma por ID"""
         try:
-            turma = Turma.query.get(turma_id)
+            turma = db.session.get(Turma, turma_id)
             if not turma:
                 logger.warning(f'READ: Turma com ID {turma_id} não encontrada.')
                 return {'error': 'Turma não encontrada'}, 404
+            if not pode_ver_turma(turma.id_turma):
+                return acesso_negado()
             logger.info(f'READ: Turma com ID {turma_id} encontrada.')
             return turma.to_dict()
         except Exception as e:
@@ -239,22 +381,38 @@ class TurmaResource(Resource):
     def put(self, turma_id):
         """Atualiza uma turma"""
         try:
-            turma = Turma.query.get(turma_id)
+            turma = db.session.get(Turma, turma_id)
             if not turma:
                 logger.warning(f'UPDATE: Turma com ID {turma_id} não encontrada.')
                 return {'error': 'Turma não encontrada'}, 404
             
             dados = request.json
+            aplicar_horarios(turma, dados.get('id_professor', turma.id_professor), dados.get('horarios'))
             if 'nome_turma' in dados:
                 turma.nome_turma = dados['nome_turma']
             if 'id_professor' in dados:
                 turma.id_professor = dados['id_professor']
-            if 'horario' in dados:
+            if 'horario' in dados and 'horarios' not in dados:
                 turma.horario = dados['horario']
             
             db.session.commit()
             logger.info(f'UPDATE: Turma com ID {turma_id} atualizada com sucesso.')
             return turma.to_dict()
+        except ValueError as e:
+            db.session.rollback()
+            logger.warning(f'UPDATE: Horários inválidos para a turma com ID {turma_id} - {e}')
+            return {'error': str(e)}, 400
+        except ConflitoHorario as e:
+            db.session.rollback()
+            logger.warning(f'UPDATE: Turma com ID {turma_id} recusada - {e}')
+            return {'error': str(e), 'conflitos': e.conflitos}, 409
+        except IntegrityError as e:
+            db.session.rollback()
+            if violou_exclusao(e):
+                logger.warning(f'UPDATE: Turma com ID {turma_id} recusada pela exclusão de horários do banco.')
+                return {'error': 'Conflito de horário com outra turma do professor'}, 409
+            logger.error(f'ERROR: Falha ao atualizar turma com ID {turma_id} - {e}')
+            return {'error': 'Falha ao atualizar turma'}, 500
         except Exception as e:
             logger.error(f'ERROR: Falha ao atualizar turma com ID {turma_id} - {e}')
             return {'error': 'Falha ao atualizar turma'}, 500
@@ -263,12 +421,11 @@ class TurmaResource(Resource):
     def delete(self, turma_id):
         """Exclui uma turma"""
         try:
-            turma = Turma.query.get(turma_id)
-            if not turma:
+            removidos = Turma.query.filter_by(id_turma=turma_id).delete(synchronize_session=False)
+            if not removidos:
                 logger.warning(f'DELETE: Turma com ID {turma_id} não encontrada.')
                 return {'error': 'Turma não encontrada'}, 404
             
-            db.session.delete(turma)
             db.session.commit()
             logger.info(f'DELETE: Turma com ID {turma_id} removida com sucesso.')
             return '', 204
@@ -278,14 +435,32 @@ class TurmaResource(Resource):
 
 # Rotas para Alunos com Swagger
 @ns_alunos.route('/')
+@em_lote
+@escopo_professor
 class AlunosList(Resource):
     @ns_alunos.doc('listar_alunos')
     def get(self):
         """Lista todos os alunos"""
         try:
-            alunos = Aluno.query.all()
+            # ?ids=1,2,3: só as linhas pedidas, em um SELECT ... IN
+            permitidos = alunos_permitidos()
+            por_ids = listar_por_ids(Aluno)
+            if por_ids is not None:
+                por_ids = [aluno for aluno in por_ids if permitidos is None or aluno['id_aluno'] in permitidos]
+                logger.info(f'READ: {len(por_ids)} alunos solicitados por ID.')
+                return por_ids
+            # Professor: só os alunos das próprias turmas
+            condicoes = [] if permitidos is None else [Aluno.id_aluno.in_(permitidos)]
+            # MessagePack/Arrow em fluxo quando pedidos no Accept ou em ?formato=
+            binaria = tabela_negociada(Aluno.__table__, *condicoes)
+            if binaria is not None:
+                logger.info(f'READ: Listagem de todos os alunos solicitada ({binaria.content_type}).')
+                return binaria
+            alunos = listar(Aluno, em=None if permitidos is None else (Aluno.id_aluno, permitidos))
             logger.info('READ: Listagem de todos os alunos solicitada.')
             return [aluno.to_dict() for aluno in alunos]
+        except ValueError as e:
+            return {'error': str(e)}, 400
         except Exception as e:
             logger.error(f'ERROR: Falha ao listar alunos - {e}')
             return {'error': 'Falha ao listar alunos'}, 500
@@ -315,19 +490,44 @@ class AlunosList(Resource):
             logger.error(f'ERROR: Falha ao cadastrar aluno - {e}')
             return {'error': 'Falha ao cadastrar aluno'}, 500
 
-@app.route('/alunos/<aluno_id>', methods=['GET'])
+@app.route('/alunos/<int:aluno_id>', methods=['GET'])
+@carrega_por_id(Aluno, 'aluno_id')
+@escopo_professor
 def obter_aluno(aluno_id):
     try:
-        aluno = Aluno.query.get(aluno_id)
+        aluno = db.session.get(Aluno, aluno_id)
         if not aluno:
             logger.warning(f'READ: Aluno com ID {aluno_id} não encontrado.')
             return jsonify({'error': 'Aluno não encontrado'}), 404
+        if not pode_ver_aluno(aluno.id_aluno):
+            return acesso_negado()
         logger.info(f'READ: Aluno com ID {aluno_id} encontrado.')
         return jsonify(aluno.to_dict())
     except Exception as e:
         logger.error(f'ERROR: Falha ao obter aluno com ID {aluno_id} - {e}')
         return jsonify({'error': 'Falha ao obter aluno'}), 500
 
+# GET /alunos?ids=1,2,3 (sem a barra final) para resolver vários alunos em uma chamada
+@app.route('/alunos', methods=['GET'])
+@em_lote
+@escopo_professor
+def obter_alunos_por_ids():
+    try:
+        alunos = listar_por_ids(Aluno)
+        permitidos = alunos_permitidos()
+        if alunos is not None and permitidos is not None:
+            alunos = [aluno for aluno in alunos if aluno['id_aluno'] in permitidos]
+        if alunos is None:
+            consulta = request.query_string.decode()
+            return redirect(f'/alunos/?{consulta}' if consulta else '/alunos/', code=308)
+        logger.info(f'READ: {len(alunos)} alunos solicitados por ID.')
+        return jsonify(alunos)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        logger.error(f'ERROR: Falha ao obter alunos por ID - {e}')
+        return jsonify({'error': 'Falha ao obter alunos'}), 500
+
 @app.route('/alunos', methods=['POST'])
 def cadastrar_aluno():
     try:
@@ -354,7 +554,7 @@ def cadastrar_aluno():
 @app.route('/alunos/<aluno_id>', methods=['PUT'])
 def atualizar_aluno(aluno_id):
     try:
-        aluno = Aluno.query.get(aluno_id)
+        aluno = db.session.get(Aluno, aluno_id)
         if not aluno:
             logger.warning(f'UPDATE: Aluno com ID {aluno_id} não encontrado.')
             return jsonify({'error': 'Aluno não encontrado'}), 404
@@ -385,12 +585,11 @@ def atualizar_aluno(aluno_id):
 @app.route('/alunos/<aluno_id>', methods=['DELETE'])
 def excluir_aluno(aluno_id):
     try:
-        aluno = Aluno.query.get(aluno_id)
-        if not aluno:
+        removidos = Aluno.query.filter_by(id_aluno=aluno_id).delete(synchronize_session=False)
+        if not removidos:
             logger.warning(f'DELETE: Aluno com ID {aluno_id} não encontrado.')
             return jsonify({'error': 'Aluno não encontrado'}), 404
         
-        db.session.delete(aluno)
         db.session.commit()
         logger.info(f'DELETE: Aluno com ID {aluno_id} removido com sucesso.')
         return '', 204
@@ -400,14 +599,28 @@ def excluir_aluno(aluno_id):
 
 # Rotas para Pagamentos com Swagger
 @ns_pagamentos.route('/')
+@em_lote
+@somente_administrador
 class PagamentosList(Resource):
     @ns_pagamentos.doc('listar_pagamentos')
     def get(self):
         """Lista todos os pagamentos"""
         try:
-            pagamentos = Pagamento.query.all()
+            # ?ids=1,2,3: só as linhas pedidas, em um SELECT ... IN
+            por_ids = listar_por_ids(Pagamento)
+            if por_ids is not None:
+                logger.info(f'READ: {len(por_ids)} pagamentos solicitados por ID.')
+                return por_ids
+            # MessagePack/Arrow em fluxo quando pedidos no Accept ou em ?formato=
+            binaria = tabela_negociada(Pagamento.__table__)
+            if binaria is not None:
+                logger.info(f'READ: Listagem de todos os pagamentos solicitada ({binaria.content_type}).')
+                return binaria
+            pagamentos = listar(Pagamento)
             logger.info('READ: Listagem de todos os pagamentos solicitada.')
             return [pagamento.to_dict() for pagamento in pagamentos]
+        except ValueError as e:
+            return {'error': str(e)}, 400
         except Exception as e:
             logger.error(f'ERROR: Falha ao listar pagamentos - {e}')
             return {'error': 'Falha ao listar pagamentos'}, 500
@@ -436,10 +649,12 @@ class PagamentosList(Resource):
             logger.error(f'ERROR: Falha ao cadastrar pagamento - {e}')
             return {'error': 'Falha ao cadastrar pagamento'}, 500
 
-@app.route('/pagamentos/<pagamento_id>', methods=['GET'])
+@app.route('/pagamentos/<int:pagamento_id>', methods=['GET'])
+@carrega_por_id(Pagamento, 'pagamento_id')
+@somente_administrador
 def obter_pagamento(pagamento_id):
     try:
-        pagamento = Pagamento.query.get(pagamento_id)
+        pagamento = db.session.get(Pagamento, pagamento_id)
         if not pagamento:
             logger.warning(f'READ: Pagamento com ID {pagamento_id} não encontrado.')
             return jsonify({'error': 'Pagamento não encontrado'}), 404
@@ -474,7 +689,7 @@ def cadastrar_pagamento():
 @app.route('/pagamentos/<pagamento_id>', methods=['PUT'])
 def atualizar_pagamento(pagamento_id):
     try:
-        pagamento = Pagamento.query.get(pagamento_id)
+        pagamento = db.session.get(Pagamento, pagamento_id)
         if not pagamento:
             logger.warning(f'UPDATE: Pagamento com ID {pagamento_id} não encontrado.')
             return jsonify({'error': 'Pagamento não encontrado'}), 404
@@ -503,7 +718,7 @@ def atualizar_pagamento(pagamento_id):
 @app.route('/pagamentos/<pagamento_id>', methods=['DELETE'])
 def excluir_pagamento(pagamento_id):
     try:
-        pagamento = Pagamento.query.get(pagamento_id)
+        pagamento = db.session.get(Pagamento, pagamento_id)
         if not pagamento:
             logger.warning(f'DELETE: Pagamento com ID {pagamento_id} não encontrado.')
             return jsonify({'error': 'Pagamento não encontrado'}), 404
@@ -518,22 +733,36 @@ def excluir_pagamento(pagamento_id):
 
 # Rotas para Presenças
 @app.route('/presencas', methods=['GET'])
+@em_lote
+@escopo_professor
 def listar_presencas():
     try:
-        presencas = Presenca.query.all()
+        # MessagePack/Arrow em fluxo quando pedidos no Accept ou em ?formato=
+        # Professor: só as presenças dos alunos das próprias turmas
+        permitidos = alunos_permitidos()
+        condicoes = [] if permitidos is None else [Presenca.id_aluno.in_(permitidos)]
+        binaria = tabela_negociada(Presenca.__table__, *condicoes)
+        if binaria is not None:
+            logger.info(f'READ: Listagem de todas as presenças solicitada ({binaria.content_type}).')
+            return binaria
+        presencas = listar(Presenca, em=None if permitidos is None else (Presenca.id_aluno, permitidos))
         logger.info('READ: Listagem de todas as presenças solicitada.')
         return jsonify([presenca.to_dict() for presenca in presencas])
     except Exception as e:
         logger.error(f'ERROR: Falha ao listar presenças - {e}')
         return jsonify({'error': 'Falha ao listar presenças'}), 500
 
-@app.route('/presencas/<presenca_id>', methods=['GET'])
+@app.route('/presencas/<int:presenca_id>', methods=['GET'])
+@carrega_por_id(Presenca, 'presenca_id')
+@escopo_professor
 def obter_presenca(presenca_id):
     try:
-        presenca = Presenca.query.get(presenca_id)
+        presenca = db.session.get(Presenca, presenca_id)
         if not presenca:
             logger.warning(f'READ: Presença com ID {presenca_id} não encontrada.')
             return jsonify({'error': 'Presença não encontrada'}), 404
+        if not pode_ver_aluno(presenca.id_aluno):
+            return acesso_negado()
         logger.info(f'READ: Presença com ID {presenca_id} encontrada.')
         return jsonify(presenca.to_dict())
     except Exception as e:
@@ -541,9 +770,12 @@ def obter_presenca(presenca_id):
         return jsonify({'error': 'Falha ao obter presença'}), 500
 
 @app.route('/presencas', methods=['POST'])
+@permite_professor
 def cadastrar_presenca():
     try:
         dados = request.json
+        if not pode_ver_aluno(dados['id_aluno']):
+            return acesso_negado()
         data_presenca = datetime.strptime(dados['data_presenca'], '%Y-%m-%d').date() if 'data_presenca' in dados else None
         
         presenca = Presenca(
@@ -560,14 +792,17 @@ def cadastrar_presenca():
         return jsonify({'error': 'Falha ao cadastrar presença'}), 500
 
 @app.route('/presencas/<presenca_id>', methods=['PUT'])
+@permite_professor
 def atualizar_presenca(presenca_id):
     try:
-        presenca = Presenca.query.get(presenca_id)
+        presenca = db.session.get(Presenca, presenca_id)
         if not presenca:
             logger.warning(f'UPDATE: Presença com ID {presenca_id} não encontrada.')
             return jsonify({'error': 'Presença não encontrada'}), 404
         
         dados = request.json
+        if not pode_ver_aluno(presenca.id_aluno) or not pode_ver_aluno(dados.get('id_aluno', presenca.id_aluno)):
+            return acesso_negado()
         if 'id_aluno' in dados:
             presenca.id_aluno = dados['id_aluno']
         if 'data_presenca' in dados:
@@ -585,7 +820,7 @@ def atualizar_presenca(presenca_id):
 @app.route('/presencas/<presenca_id>', methods=['DELETE'])
 def excluir_presenca(presenca_id):
     try:
-        presenca = Presenca.query.get(presenca_id)
+        presenca = db.session.get(Presenca, presenca_id)
         if not presenca:
             logger.warning(f'DELETE: Presença com ID {presenca_id} não encontrada.')
             return jsonify({'error': 'Presença não encontrada'}), 404
@@ -598,14 +833,66 @@ def excluir_presenca(presenca_id):
         logger.error(f'ERROR: Falha ao excluir presença com ID {presenca_id} - {e}')
         return jsonify({'error': 'Falha ao excluir presença'}), 500
 
+# Participantes de atividades: alterações por diferença, em instruções únicas
+def ids_participantes(atividade_id):
+    """IDs dos alunos associados à atividade, sem carregar os objetos Aluno"""
+    return set(db.session.execute(
+        select(AtividadeAluno.id_aluno).where(AtividadeAluno.id_atividade == atividade_id)
+    ).scalars())
+
+def adicionar_participantes(atividade_id, criterio):
+    """INSERT ... SELECT dos alunos que atendem ao critério; pares já existentes são ignorados"""
+    stmt = pg_insert(AtividadeAluno.__table__).from_select(
+        ['id_atividade', 'id_aluno'],
+        select(literal(int(atividade_id)), Aluno.id_aluno).where(criterio)
+    ).on_conflict_do_nothing()
+    return db.session.execute(stmt).rowcount
+
+def adicionar_alunos_atividade(atividade_id, alunos_ids):
+    if not alunos_ids:
+        return 0
+    return adicionar_participantes(atividade_id, Aluno.id_aluno.in_(alunos_ids))
+
+def remover_alunos_atividade(atividade_id, alunos_ids):
+    if not alunos_ids:
+        return 0
+    return db.session.execute(
+        AtividadeAluno.__table__.delete().where(
+            AtividadeAluno.id_atividade == atividade_id,
+            AtividadeAluno.id_aluno.in_(alunos_ids)
+        )
+    ).rowcount
+
+def ids_alunos(valores):
+    """IDs de alunos como inteiros; ValueError (400 nas rotas) se algum não for número"""
+    if not isinstance(valores, (list, tuple)):
+        raise ValueError('ids deve ser uma lista de números inteiros')
+    try:
+        return {int(id_aluno) for id_aluno in valores}
+    except (TypeError, ValueError):
+        raise ValueError('ids deve ser uma lista de números inteiros') from None
+
+def sincronizar_alunos_atividade(atividade_id, alunos_ids):
+    """Aplica apenas a diferença entre os participantes atuais e os desejados"""
+    desejados = ids_alunos(alunos_ids)
+    atuais = ids_participantes(atividade_id)
+    adicionados = adicionar_alunos_atividade(atividade_id, desejados - atuais)
+    removidos = remover_alunos_atividade(atividade_id, atuais - desejados)
+    return adicionados, removidos
+
+def ids_da_requisicao():
+    dados = request.json or {}
+    return ids_alunos(dados.get('ids', []))
+
 # Rotas para Atividades com Swagger
 @ns_atividades.route('/')
+@em_lote
 class AtividadesList(Resource):
     @ns_atividades.doc('listar_atividades')
     def get(self):
         """Lista todas as atividades"""
         try:
-            atividades = Atividade.query.all()
+            atividades = listar(Atividade)
             logger.info('READ: Listagem de todas as atividades solicitada.')
             return [atividade.to_dict() for atividade in atividades]
         except Exception as e:
@@ -632,10 +919,11 @@ class AtividadesList(Resource):
             logger.error(f'ERROR: Falha ao cadastrar atividade - {e}')
             return {'error': 'Falha ao cadastrar atividade'}, 500
 
-@app.route('/atividades/<atividade_id>', methods=['GET'])
+@app.route('/atividades/<int:atividade_id>', methods=['GET'])
+@carrega_por_id(Atividade, 'atividade_id')
 def obter_atividade(atividade_id):
     try:
-        atividade = Atividade.query.get(atividade_id)
+        atividade = db.session.get(Atividade, atividade_id)
         if not atividade:
             logger.warning(f'READ: Atividade com ID {atividade_id} não encontrada.')
             return jsonify({'error': 'Atividade não encontrada'}), 404
@@ -666,7 +954,7 @@ def cadastrar_atividade():
 @app.route('/atividades/<atividade_id>', methods=['PUT'])
 def atualizar_atividade(atividade_id):
     try:
-        atividade = Atividade.query.get(atividade_id)
+        atividade = db.session.get(Atividade, atividade_id)
         if not atividade:
             logger.warning(f'UPDATE: Atividade com ID {atividade_id} não encontrada.')
             return jsonify({'error': 'Atividade não encontrada'}), 404
@@ -687,12 +975,11 @@ def atualizar_atividade(atividade_id):
 @app.route('/atividades/<atividade_id>', methods=['DELETE'])
 def excluir_atividade(atividade_id):
     try:
-        atividade = Atividade.query.get(atividade_id)
-        if not atividade:
+        removidos = Atividade.query.filter_by(id_atividade=atividade_id).delete(synchronize_session=False)
+        if not removidos:
             logger.warning(f'DELETE: Atividade com ID {atividade_id} não encontrada.')
             return jsonify({'error': 'Atividade não encontrada'}), 404
         
-        db.session.delete(atividade)
         db.session.commit()
         logger.info(f'DELETE: Atividade com ID {atividade_id} removida com sucesso.')
         return '', 204
@@ -700,13 +987,589 @@ def excluir_atividade(atividade_id):
         logger.error(f'ERROR: Falha ao excluir atividade com ID {atividade_id} - {e}')
         return jsonify({'error': 'Falha ao excluir atividade'}), 500
 
+@app.route('/atividades/<atividade_id>/alunos', methods=['POST'])
+def adicionar_participantes_atividade(atividade_id):
+    try:
+        if not db.session.get(Atividade, atividade_id):
+            logger.warning(f'UPDATE: Atividade com ID {atividade_id} não encontrada.')
+            return jsonify({'error': 'Atividade não encontrada'}), 404
+        
+        adicionados = adicionar_alunos_atividade(atividade_id, ids_da_requisicao())
+        db.session.commit()
+        logger.info(f'UPDATE: {adicionados} aluno(s) adicionado(s) à atividade com ID {atividade_id}.')
+        return jsonify({'adicionados': adicionados})
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        logger.error(f'ERROR: Falha ao adicionar alunos à atividade com ID {atividade_id} - {e}')
+        return jsonify({'error': 'Falha ao adicionar alunos à atividade'}), 500
+
+@app.route('/atividades/<atividade_id>/alunos', methods=['DELETE'])
+def remover_participantes_atividade(atividade_id):
+    try:
+        if not db.session.get(Atividade, atividade_id):
+            logger.warning(f'UPDATE: Atividade com ID {atividade_id} não encontrada.')
+            return jsonify({'error': 'Atividade não encontrada'}), 404
+        
+        removidos = remover_alunos_atividade(atividade_id, ids_da_requisicao())
+        db.session.commit()
+        logger.info(f'UPDATE: {removidos} aluno(s) removido(s) da atividade com ID {atividade_id}.')
+        return jsonify({'removidos': removidos})
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        logger.error(f'ERROR: Falha ao remover alunos da atividade com ID {atividade_id} - {e}')
+        return jsonify({'error': 'Falha ao remover alunos da atividade'}), 500
+
+@app.route('/atividades/<atividade_id>/turmas/<turma_id>', methods=['POST'])
+def inscrever_turma_atividade(atividade_id, turma_id):
+    try:
+        if not db.session.get(Atividade, atividade_id):
+            logger.warning(f'UPDATE: Atividade com ID {atividade_id} não encontrada.')
+            return jsonify({'error': 'Atividade não encontrada'}), 404
+        
+        # INSERT ... SELECT: todos os alunos da turma em uma única instrução
+        adicionados = adicionar_participantes(atividade_id, Aluno.id_turma == turma_id)
+        db.session.commit()
+        logger.info(f'UPDATE: Turma com ID {turma_id} inscrita na atividade com ID {atividade_id} ({adicionados} aluno(s)).')
+        return jsonify({'adicionados': adicionados})
+    except Exception as e:
+        logger.error(f'ERROR: Falha ao inscrever turma com ID {turma_id} na atividade com ID {atividade_id} - {e}')
+        return jsonify({'error': 'Falha ao inscrever turma na atividade'}), 500
+
+# Autenticação: token de acesso para a API (Authorization: Bearer) e cookie para as páginas
+@app.route('/auth/login', methods=['POST'])
+@publica
+@sem_idempotencia  # a resposta leva o token
+def login_api():
+    dados = request.get_json(silent=True) or {}
+    resultado = autenticacao.entrar(dados.get('login', ''), dados.get('senha', ''))
+    if resultado is None:
+        logger.warning(f"AUTH: Login recusado para {dados.get('login')}.")
+        return jsonify({'error': 'Login ou senha inválidos'}), 401
+    token, claims = resultado
+    logger.info(f"AUTH: Login de {dados.get('login')} ({claims['nivel']}).")
+    return jsonify({
+        'token': token,
+        'expira_em': datetime.utcfromtimestamp(claims['exp']).isoformat(),
+        'nivel_acesso': claims['nivel'],
+        'id_professor': claims['professor']
+    })
+
+@app.route('/auth/logout', methods=['POST'])
+@permite_professor
+def logout_api():
+    usuario = g.get('usuario')
+    if usuario is None:
+        return jsonify({'error': 'Autenticação desativada'}), 400
+    autenticacao.revogar(jti=usuario['jti'])
+    logger.info(f"AUTH: Token do usuário ID {usuario['sub']} revogado (logout).")
+    resposta = jsonify({'revogado': usuario['jti']})
+    resposta.delete_cookie(COOKIE)
+    return resposta
+
+@app.route('/auth/usuarios/<int:usuario_id>/revogar', methods=['POST'])
+def revogar_tokens_usuario(usuario_id):
+    """Revoga todos os tokens já emitidos para o usuário (ex.: senha trocada, acesso retirado)"""
+    if not db.session.get(Usuario, usuario_id):
+        return jsonify({'error': 'Usuário não encontrado'}), 404
+    autenticacao.revogar(id_usuario=usuario_id)
+    logger.info(f'AUTH: Todos os tokens do usuário ID {usuario_id} revogados.')
+    return jsonify({'id_usuario': usuario_id})
+
+def _destino_local(proximo):
+    """Caminho deste site para o redirect após o login; '/' para qualquer outro destino"""
+    # Navegadores leem a barra invertida como '/' e descartam tabulações e quebras de linha (/\evil vira //evil)
+    normalizado = proximo.replace('\\', '/')
+    partes = urlsplit(normalizado)
+    if (
+        not normalizado.startswith('/') or normalizado.startswith('//') or partes.scheme or partes.netloc
+        or any(ord(caractere) < 32 for caractere in proximo)
+    ):
+        return '/'
+    return proximo
+
+@app.route('/login', methods=['GET', 'POST'])
+@publica
+@sem_idempotencia
+def login_view():
+    proximo = _destino_local(request.values.get('proximo', '/'))
+    if request.method == 'GET':
+        return render_template('login.html', proximo=proximo)
+    resultado = autenticacao.entrar(request.form.get('login', ''), request.form.get('senha', ''))
+    if resultado is None:
+        return render_template('login.html', proximo=proximo, erro='Login ou senha inválidos'), 401
+    token, claims = resultado
+    resposta = redirect(proximo)
+    resposta.set_cookie(COOKIE, token, max_age=app.config['AUTH_TOKEN_TTL'], httponly=True, samesite='Lax',
+                        secure=request.is_secure)
+    return resposta
+
+# Busca por prefixo de nome usada pelos campos de seleção dos formulários
+@app.route('/lookup/<entidade>')
+@usa_primario
+def lookup(entidade):
+    if entidade not in ENTIDADES_BUSCA:
+        return jsonify({'error': 'Entidade desconhecida'}), 404
+    try:
+        limite = min(LIMITE_MAXIMO, max(1, int(request.args.get('limit', LIMITE_PADRAO))))
+    except ValueError:
+        return jsonify({'error': 'Parâmetro limit inválido'}), 400
+    try:
+        return jsonify(busca.buscar(entidade, request.args.get('q', ''), limite))
+    except Exception as e:
+        logger.error(f'ERROR: Falha na busca de {entidade} - {e}')
+        return jsonify({'error': 'Falha na busca'}), 500
+
+# Várias leituras em uma chamada: {"requisicoes": [{"caminho": "/alunos/1"}, ...]}
+@app.route('/batch', methods=['POST'])
+@classe_rota('cara')
+@somente_leitura
+@permite_professor  # cada sub-requisição passa por autorizar()
+@sem_idempotencia  # nada é gravado
+def batch():
+    dados = request.get_json(silent=True) or {}
+    try:
+        respostas = executar_lote(dados.get('requisicoes'))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    logger.info(f'READ: Lote com {len(respostas)} sub-requisições executado.')
+    return jsonify({'respostas': respostas})
+
+# Horários livres e ocupados do professor, a partir do índice de horários em memória
+@app.route('/professores/<int:professor_id>/disponibilidade')
+@usa_primario
+def disponibilidade_professor(professor_id):
+    try:
+        dia = request.args.get('dia')
+        dias = [int(dia)] if dia not in (None, '') else list(range(7))
+        if not all(0 <= d <= 6 for d in dias):
+            raise ValueError('dia deve ir de 0 (segunda) a 6 (domingo)')
+        inicio = ler_hora(request.args.get('inicio', app.config['AGENDA_INICIO']))
+        fim = ler_hora(request.args.get('fim', app.config['AGENDA_FIM']))
+        if inicio >= fim:
+            raise ValueError('inicio deve ser anterior a fim')
+        duracao = int(request.args.get('duracao', 0))
+    except ValueError as e:
+        return jsonify({'error': f'Parâmetros inválidos - {e}'}), 400
+    try:
+        if db.session.query(Professor.id_professor).filter_by(id_professor=professor_id).first() is None:
+            logger.warning(f'READ: Professor com ID {professor_id} não encontrado.')
+            return jsonify({'error': 'Professor não encontrado'}), 404
+        dias = agenda.disponibilidade(professor_id, dias, inicio, fim, duracao)
+        logger.info(f'READ: Disponibilidade do professor com ID {professor_id} consultada.')
+        return jsonify({'id_professor': professor_id, 'dias': dias})
+    except Exception as e:
+        logger.error(f'ERROR: Falha ao consultar disponibilidade do professor com ID {professor_id} - {e}')
+        return jsonify({'error': 'Falha ao consultar disponibilidade'}), 500
+
+# Verificações de saúde usadas pelo balanceador de carga e pelo orquestrador
+@app.route('/saude/vivo')
+@classe_rota(LIVRE)
+@publica
+def saude_vivo():
+    # Vivacidade: o processo responde; não depende do banco para não reiniciar réplicas em cascata
+    return jsonify({'status': 'ok'})
+
+@app.route('/saude/pronto')
+@classe_rota(LIVRE)
+@publica
+def saude_pronto():
+    pronto, motivo = saude.pronto()
+    if not pronto:
+        return jsonify({'status': 'indisponivel', 'motivo': motivo}), 503
+    return jsonify({'status': 'ok'})
+
+@app.route('/metrics')
+@classe_rota(LIVRE)
+@publica
+def metrics():
+    corpo, content_type = metricas.exportar()
+    return Response(corpo, content_type=content_type)
+
+# Profiler sob demanda (somente administradores)
+@app.route('/admin/profiler', methods=['GET'])
+@admin_requerido
+def estado_profiler():
+    return jsonify(perfil_requisicoes.profiler.estado())
+
+@app.route('/admin/profiler', methods=['POST'])
+@admin_requerido
+def ativar_profiler():
+    try:
+        dados = request.json or {}
+        endpoint = dados.get('endpoint')
+        if endpoint not in app.view_functions:
+            return jsonify({'error': 'Endpoint desconhecido'}), 400
+        
+        taxa = min(1.0, max(0.0, float(dados.get('taxa', 0.1))))
+        duracao = int(dados.get('duracao', 300))
+        perfil_requisicoes.profiler.ativar(endpoint, taxa, duracao)
+        logger.info(f'ADMIN: Profiler ativado para {endpoint} (taxa {taxa}, {duracao}s).')
+        return jsonify(perfil_requisicoes.profiler.estado()['ativos']), 201
+    except Exception as e:
+        logger.error(f'ERROR: Falha ao ativar profiler - {e}')
+        return jsonify({'error': 'Falha ao ativar profiler'}), 500
+
+@app.route('/admin/profiler/<endpoint>', methods=['DELETE'])
+@admin_requerido
+def desativar_profiler(endpoint):
+    if not perfil_requisicoes.profiler.desativar(endpoint):
+        return jsonify({'error': 'Profiler não está ativo para este endpoint'}), 404
+    logger.info(f'ADMIN: Profiler desativado para {endpoint}.')
+    return '', 204
+
+# Eventos de alteração em tempo real (Server-Sent Events)
+@app.route('/eventos')
+@classe_rota(LIVRE)
+@escopo_professor  # só entidade e IDs alterados, sem os dados
+def eventos():
+    entidades = {nome for nome in request.args.get('entidades', '').split(',') if nome}
+    heartbeat = app.config['SSE_HEARTBEAT']
+    # Cada cliente prende uma thread do servidor enquanto conectado: acima do limite, o stream termina
+    # na hora e o navegador reconecta depois de SSE_RETRY_LOTADO segundos
+    fila = barramento.conectar_cliente(escolas.esquema_atual(), limite=app.config['SSE_MAX_CLIENTES'])
+    if fila is None:
+        logger.warning('READ: Limite de clientes SSE do processo atingido, reconexão adiada.')
+        return Response(f"retry: {int(app.config['SSE_RETRY_LOTADO'] * 1000)}\n\n", mimetype='text/event-stream',
+                        headers={'Cache-Control': 'no-cache'})
+    logger.info(f"READ: Cliente SSE conectado ({', '.join(sorted(entidades)) or 'todas as entidades'}).")
+
+    def gerar():
+        try:
+            yield 'retry: 3000\n\n'
+            while True:
+                try:
+                    evento = fila.get(timeout=heartbeat)
+                except queue.Empty:
+                    if saude.drenando.is_set():
+                        # Encerra o stream para o cliente reconectar (retry) em outra réplica
+                        return
+                    yield ': keep-alive\n\n'
+                    continue
+                if not entidades or evento.get('entidade') in entidades:
+                    yield evento_sse(evento)
+        finally:
+            barramento.desconectar_cliente(fila)
+
+    return Response(gerar(), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no'
+    })
+
+# Importação em massa (CSV ou NDJSON) via COPY
+@app.route('/importacao/<entidade>', methods=['POST'])
+@classe_rota('cara')
+@sem_idempotencia  # corpo lido em fluxo e gravado em lotes
+def importar_dados(entidade):
+    try:
+        if entidade not in ENTIDADES_IMPORTACAO:
+            logger.warning(f'CREATE: Importação de entidade inválida: {entidade}.')
+            return jsonify({'error': 'Entidade inválida', 'entidades': sorted(ENTIDADES_IMPORTACAO)}), 400
+        
+        formato = request.args.get('formato') or ('ndjson' if 'ndjson' in (request.mimetype or '') else 'csv')
+        arquivo = io.TextIOWrapper(request.stream, encoding='utf-8', newline='')
+        relatorio = importar(entidade, arquivo, formato, app.config['IMPORT_CHUNK_SIZE'])
+        # O COPY não passa pela sessão: a auditoria recebe um resumo da importação
+        registrar_em_massa(tarefas.EXPORTAVEIS[entidade].__table__.name, 'INSERT', {
+            'importadas': relatorio['importadas'], 'rejeitadas': relatorio['rejeitadas'], 'formato': formato
+        })
+        return jsonify(relatorio), 201
+    except Exception as e:
+        logger.error(f'ERROR: Falha ao importar {entidade} - {e}')
+        return jsonify({'error': f'Falha ao importar {entidade}'}), 500
+
+@app.cli.command('importar')
+@click.argument('entidade', type=click.Choice(sorted(ENTIDADES_IMPORTACAO)))
+@click.argument('arquivo', type=click.File('r', encoding='utf-8'))
+@click.option('--formato', type=click.Choice(['csv', 'ndjson']), default='csv')
+def importar_comando(entidade, arquivo, formato):
+    """Importa alunos, professores ou presenças de um arquivo CSV/NDJSON"""
+    relatorio = importar(entidade, arquivo, formato, app.config['IMPORT_CHUNK_SIZE'])
+    click.echo(f"{relatorio['importadas']} importada(s), {relatorio['rejeitadas']} rejeitada(s)")
+    for erro in relatorio['erros']:
+        click.echo(f"  linha {erro['linha']}: {erro['motivo']}")
+
+# Multi-escola: cadastro de escolas e movimentação entre shards
+@app.cli.group('escolas')
+def escolas_comando():
+    """Gerencia as escolas atendidas (esquema e shard de cada uma)"""
+
+@escolas_comando.command('listar')
+def listar_escolas_comando():
+    """Lista as escolas do catálogo"""
+    for escola in sorted(escolas.todas(), key=lambda escola: escola['slug']):
+        click.echo(f"{escola['slug']}: shard {escola['shard']}, esquema {escola['esquema']}, "
+                   f"domínio {escola['dominio'] or '-'} ({escola['status']})")
+
+@escolas_comando.command('registrar')
+@click.argument('slug')
+@click.option('--shard', default=SHARD_PRINCIPAL)
+@click.option('--dominio', help='Domínio que identifica a escola (ex.: escola-a.exemplo.com.br)')
+@click.option('--esquema', help='Esquema já existente (ex.: public, para os dados atuais)')
+def registrar_escola_comando(slug, shard, dominio, esquema):
+    """Cria o esquema da escola no shard e a registra no catálogo"""
+    escola = registrar(slug, shard, dominio, esquema)
+    click.echo(f"Escola {slug} registrada no shard {escola['shard']} (esquema {escola['esquema']})")
+
+@escolas_comando.command('mover')
+@click.argument('slug')
+@click.argument('shard')
+@click.option('--remover-origem', is_flag=True, help='Apaga o esquema do shard de origem após a troca')
+def mover_escola_comando(slug, shard, remover_origem):
+    """Copia a escola para outro shard e passa a atendê-la por ele"""
+    copiadas = mover(slug, shard, remover_origem)
+    click.echo(f'Escola {slug} movida para o shard {shard}')
+    for tabela, linhas in copiadas.items():
+        click.echo(f'  {tabela}: {linhas} linha(s)')
+
+# Rotas para Jobs em segundo plano
+@app.route('/jobs', methods=['POST'])
+def criar_job():
+    try:
+        dados = request.json or {}
+        if dados.get('tipo') not in tipos_registrados():
+            logger.warning(f"JOB: Tipo de job inválido: {dados.get('tipo')}.")
+            return jsonify({'error': 'Tipo de job inválido', 'tipos': tipos_registrados()}), 400
+        
+        job = enfileirar(dados['tipo'], dados.get('parametros'), dados.get('max_tentativas'))
+        db.session.commit()
+        logger.info(f'CREATE: Job {job.id_job} ({job.tipo}) enfileirado.')
+        return jsonify(job.to_dict()), 202, {'Location': f'/jobs/{job.id_job}'}
+    except Exception as e:
+        logger.error(f'ERROR: Falha ao enfileirar job - {e}')
+        return jsonify({'error': 'Falha ao enfileirar job'}), 500
+
+@app.route('/jobs/<job_id>', methods=['GET'])
+@usa_primario
+def obter_job(job_id):
+    try:
+        job = db.session.get(Job, job_id)
+        if not job:
+            logger.warning(f'READ: Job com ID {job_id} não encontrado.')
+            return jsonify({'error': 'Job não encontrado'}), 404
+        return jsonify(job.to_dict())
+    except Exception as e:
+        logger.error(f'ERROR: Falha ao obter job com ID {job_id} - {e}')
+        return jsonify({'error': 'Falha ao obter job'}), 500
+
+@app.route('/jobs/<job_id>/resultado', methods=['GET'])
+@usa_primario
+def obter_resultado_job(job_id):
+    try:
+        job = db.session.get(Job, job_id)
+        if not job:
+            logger.warning(f'READ: Job com ID {job_id} não encontrado.')
+            return jsonify({'error': 'Job não encontrado'}), 404
+        if job.status != 'concluido':
+            return jsonify(job.to_dict()), 409 if job.status == 'falhou' else 202
+        
+        if isinstance(job.resultado, dict) and 'partes' in job.resultado:
+            return Response(stream_with_context(ler_partes(job.id_job, job.resultado['partes'])), mimetype='text/csv', headers={
+                'Content-Disposition': f"attachment; filename={job.resultado['entidade']}.csv"
+            })
+        # Exportações concluídas antes da gravação em partes guardam o CSV no próprio resultado
+        if isinstance(job.resultado, dict) and 'csv' in job.resultado:
+            return Response(job.resultado['csv'], mimetype='text/csv', headers={
+                'Content-Disposition': f"attachment; filename={job.resultado['entidade']}.csv"
+            })
+        return jsonify(job.resultado)
+    except Exception as e:
+        logger.error(f'ERROR: Falha ao obter resultado do job com ID {job_id} - {e}')
+        return jsonify({'error': 'Falha ao obter resultado do job'}), 500
+
+# Documentos: recibos de pagamento e folhas de frequência em PDF (padrão) ou HTML (?formato=html)
+def _formato_documento():
+    formato = request.args.get('formato', 'pdf')
+    return formato if formato in FORMATOS_DOCUMENTO else None
+
+def _formato_invalido():
+    return jsonify({'error': 'Formato inválido', 'formatos': sorted(FORMATOS_DOCUMENTO)}), 400
+
+def _documento(documento, formato, dados):
+    metricas.DOCUMENTOS.labels(documento, formato).inc()
+    return Response(renderizar(documento, formato, dados), mimetype=FORMATOS_DOCUMENTO[formato], headers={
+        'Content-Disposition': f'inline; filename={nome_arquivo(documento, dados, formato)}'
+    })
+
+def _zip_documentos(documento, formato, dados, nome):
+    # Renderizado no pool de processos e enviado em fluxo, arquivo por arquivo
+    contador = metricas.DOCUMENTOS.labels(documento, formato)
+    return Response(stream_with_context(documentos.zip(documento, formato, dados, contador.inc)), mimetype=ZIP, headers={
+        'Content-Disposition': f'attachment; filename={nome}'
+    })
+
+@app.route('/documentos/recibos/<int:pagamento_id>', methods=['GET'])
+@somente_administrador
+def recibo_pagamento(pagamento_id):
+    formato = _formato_documento()
+    if formato is None:
+        return _formato_invalido()
+    try:
+        encontrados = list(recibos(ids=[pagamento_id]))
+        if not encontrados:
+            logger.warning(f'READ: Recibo do pagamento com ID {pagamento_id} não encontrado (inexistente ou não pago).')
+            return jsonify({'error': 'Pagamento pago não encontrado'}), 404
+        logger.info(f'READ: Recibo do pagamento com ID {pagamento_id} gerado ({formato}).')
+        return _documento('recibo', formato, encontrados[0])
+    except Exception as e:
+        logger.error(f'ERROR: Falha ao gerar recibo do pagamento com ID {pagamento_id} - {e}')
+        return jsonify({'error': 'Falha ao gerar recibo'}), 500
+
+@app.route('/documentos/recibos', methods=['GET'])
+@classe_rota('cara')
+@somente_administrador
+def recibos_em_lote():
+    formato = _formato_documento()
+    if formato is None:
+        return _formato_invalido()
+    try:
+        mes = ler_mes(request.args['mes']) if request.args.get('mes') else None
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    referencia = request.args.get('referencia')
+    if mes is None and not referencia:
+        return jsonify({'error': 'Informe mes (AAAA-MM) ou referencia'}), 400
+    logger.info(f'READ: Recibos em lote solicitados (mes={request.args.get("mes")}, referencia={referencia}, {formato}).')
+    nome = f"recibos-{request.args['mes']}.zip" if mes else 'recibos.zip'
+    return _zip_documentos('recibo', formato, recibos(mes, referencia or None), nome)
+
+@app.route('/documentos/frequencia/<int:turma_id>', methods=['GET'])
+@escopo_professor
+def frequencia_turma(turma_id):
+    formato = _formato_documento()
+    if formato is None:
+        return _formato_invalido()
+    try:
+        ano, mes = ler_mes(request.args.get('mes'))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    if not pode_ver_turma(turma_id):
+        return acesso_negado()
+    try:
+        folhas = folhas_frequencia(ano, mes, [turma_id])
+        if not folhas:
+            logger.warning(f'READ: Turma com ID {turma_id} não encontrada.')
+            return jsonify({'error': 'Turma não encontrada'}), 404
+        logger.info(f'READ: Folha de frequência da turma com ID {turma_id} gerada ({formato}).')
+        return _documento('frequencia', formato, folhas[0])
+    except Exception as e:
+        logger.error(f'ERROR: Falha ao gerar folha de frequência da turma com ID {turma_id} - {e}')
+        return jsonify({'error': 'Falha ao gerar folha de frequência'}), 500
+
+@app.route('/documentos/frequencia', methods=['GET'])
+@classe_rota('cara')
+@escopo_professor
+def frequencia_em_lote():
+    formato = _formato_documento()
+    if formato is None:
+        return _formato_invalido()
+    try:
+        ano, mes = ler_mes(request.args.get('mes'))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    logger.info(f'READ: Folhas de frequência em lote solicitadas ({ano}-{mes:02d}, {formato}).')
+
+    def folhas():
+        # Lidas dentro do fluxo, já com o contexto da requisição preservado
+        yield from folhas_frequencia(ano, mes, turmas_permitidas())
+    return _zip_documentos('frequencia', formato, folhas(), f'frequencia-{ano}-{mes:02d}.zip')
+
+@app.cli.command('documentos')
+@click.argument('documento', type=click.Choice(['recibos', 'frequencia']))
+@click.option('--mes', required=True, help='AAAA-MM')
+@click.option('--formato', type=click.Choice(sorted(FORMATOS_DOCUMENTO)), default='pdf')
+@click.option('--saida', type=click.File('wb'), required=True, help='Arquivo .zip gerado')
+def documentos_comando(documento, mes, formato, saida):
+    """Gera em um .zip os recibos (pagamentos pagos no mês) ou as folhas de frequência do mês"""
+    ano_mes = ler_mes(mes)
+    if documento == 'recibos':
+        dados, tipo = recibos(ano_mes), 'recibo'
+    else:
+        dados, tipo = folhas_frequencia(*ano_mes), 'frequencia'
+    gerados = [0]
+
+    def contar(quantidade):
+        gerados[0] += quantidade
+    for parte in documentos.zip(tipo, formato, dados, contar):
+        saida.write(parte)
+    click.echo(f'{gerados[0]} documento(s) gravado(s) em {saida.name}')
+
+# Auditoria das escritas: histórico de uma linha ou de uma entidade, do registro mais recente ao mais antigo
+@app.route('/auditoria/<entidade>', methods=['GET'])
+@app.route('/auditoria/<entidade>/<id_registro>', methods=['GET'])
+@usa_primario
+@somente_administrador
+def consultar_auditoria(entidade, id_registro=None):
+    if entidade not in db.metadata.tables or entidade in NAO_AUDITADAS:
+        return jsonify({'error': 'Entidade não auditada'}), 404
+    try:
+        desde = datetime.fromisoformat(request.args['desde']) if request.args.get('desde') else None
+        ate = datetime.fromisoformat(request.args['ate']) if request.args.get('ate') else None
+        id_usuario = int(request.args['id_usuario']) if request.args.get('id_usuario') else None
+        limite = min(1000, max(1, int(request.args.get('limit', 100))))
+    except ValueError:
+        return jsonify({'error': 'Datas devem estar em ISO 8601 (AAAA-MM-DDTHH:MM:SS); limit e id_usuario, números'}), 400
+    try:
+        # Os registros deste processo que ainda estão em memória entram na consulta
+        auditoria.descarregar()
+        registros = auditoria.consultar(entidade, id_registro, desde, ate, id_usuario, limite)
+        logger.info(f'READ: Auditoria de {entidade} {id_registro or ""} solicitada ({len(registros)} registro(s)).')
+        return jsonify(registros)
+    except Exception as e:
+        logger.error(f'ERROR: Falha ao consultar auditoria de {entidade} - {e}')
+        return jsonify({'error': 'Falha ao consultar auditoria'}), 500
+
+# Histórico arquivado (esquema "arquivo"), lido lote a lote
+@app.route('/arquivo/<entidade>', methods=['GET'])
+@classe_rota('cara')
+def consultar_arquivo(entidade):
+    if entidade not in ARQUIVAVEIS:
+        return jsonify({'error': 'Entidade não arquivada'}), 404
+    try:
+        id_aluno = request.args.get('id_aluno', type=int)
+        inicio = datetime.strptime(request.args['inicio'], '%Y-%m-%d').date() if request.args.get('inicio') else None
+        fim = datetime.strptime(request.args['fim'], '%Y-%m-%d').date() if request.args.get('fim') else None
+    except ValueError:
+        return jsonify({'error': 'Datas devem estar no formato AAAA-MM-DD'}), 400
+
+    colunas = list(ARQUIVAVEIS[entidade]['modelo'].__table__.columns)
+    binaria = resposta_negociada(colunas, lambda: (
+        tuple(linha[coluna.name] for coluna in colunas) for linha in historico(entidade, id_aluno, inicio, fim)
+    ))
+    if binaria is not None:
+        logger.info(f'READ: Consulta ao histórico arquivado de {entidade} solicitada ({binaria.content_type}).')
+        return binaria
+
+    def gerar():
+        # NDJSON: cada lote é descomprimido só quando o cliente chega nele
+        for linha in historico(entidade, id_aluno, inicio, fim):
+            yield json.dumps(linha, default=str) + '\n'
+
+    logger.info(f'READ: Consulta ao histórico arquivado de {entidade} solicitada.')
+    return Response(stream_with_context(gerar()), mimetype='application/x-ndjson')
+
+@app.route('/arquivo/alunos/<aluno_id>/restaurar', methods=['POST'])
+def restaurar_historico_aluno(aluno_id):
+    try:
+        aluno = db.session.get(Aluno, aluno_id)
+        if not aluno:
+            logger.warning(f'UPDATE: Aluno com ID {aluno_id} não encontrado.')
+            return jsonify({'error': 'Aluno não encontrado'}), 404
+        
+        return jsonify(restaurar(aluno.id_aluno))
+    except Exception as e:
+        db.session.rollback()
+        logger.error(f'ERROR: Falha ao restaurar histórico do aluno com ID {aluno_id} - {e}')
+        return jsonify({'error': 'Falha ao restaurar histórico'}), 500
+
 # Rotas para renderizar as páginas HTML
 @app.route('/')
+@somente_administrador
 def home():
     try:
-        total_turmas = Turma.query.count()
-        total_professores = Professor.query.count()
-        total_alunos = Aluno.query.count()
+        # Os três totais em um SELECT só
+        total_turmas, total_professores, total_alunos = totais_inicio()
         return render_template('index.html', 
                               total_turmas=total_turmas,
                               total_professores=total_professores,
@@ -716,70 +1579,90 @@ def home():
         return render_template('error.html', error='Falha ao carregar a página inicial')
 
 @app.route('/turmas_view')
+@somente_administrador
 def turmas_view():
     try:
-        turmas = Turma.query.all()
-        return render_template('turmas.html', turmas=turmas)
+        # Página guardada até a próxima alteração em turmas; só as linhas alteradas são renderizadas de novo
+        return cache_html.pagina(('turma',), lambda: render_template(
+            'turmas.html', linhas=cache_html.linhas(Turma, 'linhas/turma.html', 'turma')
+        ))
     except Exception as e:
         logger.error(f'ERROR: Falha ao renderizar página de turmas - {e}')
         return render_template('error.html', error='Falha ao carregar a página de turmas')
 
 @app.route('/turmas/nova', methods=['GET', 'POST'])
+@somente_administrador
 def nova_turma():
     try:
         if request.method == 'POST':
             nome_turma = request.form['nome_turma']
             id_professor = request.form['id_professor']
-            horario = request.form['horario']
             
             turma = Turma(
                 nome_turma=nome_turma,
-                id_professor=id_professor,
-                horario=horario
+                id_professor=id_professor
             )
+            aplicar_horarios(turma, id_professor, horarios_do_formulario(request.form))
             db.session.add(turma)
             db.session.commit()
             logger.info(f'CREATE: Turma {turma.nome_turma} inserida com sucesso via formulário.')
             return redirect('/turmas_view')
         
-        professores = Professor.query.all()
-        return render_template('nova_turma.html', professores=professores)
+        # Professor escolhido por busca assíncrona (/lookup/professores)
+        return render_template('nova_turma.html')
+    except (ValueError, ConflitoHorario) as e:
+        db.session.rollback()
+        logger.warning(f'CREATE: Turma recusada via formulário - {e}')
+        return render_template('error.html', error=str(e))
+    except IntegrityError as e:
+        db.session.rollback()
+        logger.error(f'ERROR: Falha ao criar nova turma - {e}')
+        return render_template('error.html', error='Conflito de horário com outra turma do professor' if violou_exclusao(e) else 'Falha ao criar nova turma')
     except Exception as e:
         logger.error(f'ERROR: Falha ao criar nova turma - {e}')
         return render_template('error.html', error='Falha ao criar nova turma')
 
 @app.route('/turmas/<turma_id>/edit', methods=['GET', 'POST'])
+@somente_administrador
 def editar_turma(turma_id):
     try:
-        turma = Turma.query.get(turma_id)
+        turma = db.session.get(Turma, turma_id)
         if not turma:
             logger.warning(f'UPDATE: Turma com ID {turma_id} não encontrada.')
             return render_template('error.html', error='Turma não encontrada')
         
         if request.method == 'POST':
+            aplicar_horarios(turma, request.form['id_professor'], horarios_do_formulario(request.form))
             turma.nome_turma = request.form['nome_turma']
             turma.id_professor = request.form['id_professor']
-            turma.horario = request.form['horario']
             
             db.session.commit()
             logger.info(f'UPDATE: Turma com ID {turma_id} atualizada com sucesso via formulário.')
             return redirect('/turmas_view')
         
-        professores = Professor.query.all()
-        return render_template('editar_turma.html', turma=turma, professores=professores)
+        return render_template('editar_turma.html', turma=turma)
+    except (ValueError, ConflitoHorario) as e:
+        db.session.rollback()
+        logger.warning(f'UPDATE: Turma com ID {turma_id} recusada via formulário - {e}')
+        return render_template('error.html', error=str(e))
+    except IntegrityError as e:
+        db.session.rollback()
+        logger.error(f'ERROR: Falha ao editar turma com ID {turma_id} - {e}')
+        return render_template('error.html', error='Conflito de horário com outra turma do professor' if violou_exclusao(e) else 'Falha ao editar turma')
     except Exception as e:
         logger.error(f'ERROR: Falha ao editar turma com ID {turma_id} - {e}')
         return render_template('error.html', error='Falha ao editar turma')
 
 @app.route('/turmas/<turma_id>/delete')
+@somente_administrador
+@usa_primario
 def deletar_turma_view(turma_id):
     try:
-        turma = Turma.query.get(turma_id)
-        if not turma:
+        removidos = Turma.query.filter_by(id_turma=turma_id).delete(synchronize_session=False)
+        if not removidos:
             logger.warning(f'DELETE: Turma com ID {turma_id} não encontrada.')
             return render_template('error.html', error='Turma não encontrada')
         
-        db.session.delete(turma)
         db.session.commit()
         logger.info(f'DELETE: Turma com ID {turma_id} removida com sucesso via interface web.')
         return redirect('/turmas_view')
@@ -788,15 +1671,18 @@ def deletar_turma_view(turma_id):
         return render_template('error.html', error='Falha ao excluir turma')
 
 @app.route('/professores_view')
+@somente_administrador
 def professores_view():
     try:
-        professores = Professor.query.all()
-        return render_template('professores.html', professores=professores)
+        return cache_html.pagina(('professor',), lambda: render_template(
+            'professores.html', linhas=cache_html.linhas(Professor, 'linhas/professor.html', 'professor')
+        ))
     except Exception as e:
         logger.error(f'ERROR: Falha ao renderizar página de professores - {e}')
         return render_template('error.html', error='Falha ao carregar a página de professores')
 
 @app.route('/professores/novo', methods=['GET', 'POST'])
+@somente_administrador
 def novo_professor():
     try:
         if request.method == 'POST':
@@ -820,9 +1706,10 @@ def novo_professor():
         return render_template('error.html', error='Falha ao criar novo professor')
 
 @app.route('/professores/<professor_id>/edit', methods=['GET', 'POST'])
+@somente_administrador
 def editar_professor(professor_id):
     try:
-        professor = Professor.query.get(professor_id)
+        professor = db.session.get(Professor, professor_id)
         if not professor:
             logger.warning(f'UPDATE: Professor com ID {professor_id} não encontrado.')
             return render_template('error.html', error='Professor não encontrado')
@@ -842,14 +1729,15 @@ def editar_professor(professor_id):
         return render_template('error.html', error='Falha ao editar professor')
 
 @app.route('/professores/<professor_id>/delete')
+@somente_administrador
+@usa_primario
 def deletar_professor_view(professor_id):
     try:
-        professor = Professor.query.get(professor_id)
-        if not professor:
+        removidos = Professor.query.filter_by(id_professor=professor_id).delete(synchronize_session=False)
+        if not removidos:
             logger.warning(f'DELETE: Professor com ID {professor_id} não encontrado.')
             return render_template('error.html', error='Professor não encontrado')
         
-        db.session.delete(professor)
         db.session.commit()
         logger.info(f'DELETE: Professor com ID {professor_id} removido com sucesso via interface web.')
         return redirect('/professores_view')
@@ -858,15 +1746,20 @@ def deletar_professor_view(professor_id):
         return render_template('error.html', error='Falha ao excluir professor')
 
 @app.route('/alunos_view')
+@somente_administrador
 def alunos_view():
     try:
-        alunos = Aluno.query.all()
-        return render_template('alunos.html', alunos=alunos)
+        return cache_html.pagina(('aluno', 'turma'), lambda: render_template(
+            'alunos.html', linhas=cache_html.linhas(
+                Aluno, 'linhas/aluno.html', 'aluno', opcoes=[joinedload(Aluno.turma)], dependencias=('turma',)
+            )
+        ))
     except Exception as e:
         logger.error(f'ERROR: Falha ao renderizar página de alunos - {e}')
         return render_template('error.html', error='Falha ao carregar a página de alunos')
 
 @app.route('/alunos/novo', methods=['GET', 'POST'])
+@somente_administrador
 def novo_aluno():
     try:
         if request.method == 'POST':
@@ -892,16 +1785,16 @@ def novo_aluno():
             logger.info(f'CREATE: Aluno {aluno.nome_completo} inserido com sucesso via formulário.')
             return redirect('/alunos_view')
         
-        turmas = Turma.query.all()
-        return render_template('novo_aluno.html', turmas=turmas)
+        return render_template('novo_aluno.html')
     except Exception as e:
         logger.error(f'ERROR: Falha ao criar novo aluno - {e}')
         return render_template('error.html', error='Falha ao criar novo aluno')
 
 @app.route('/alunos/<aluno_id>/edit', methods=['GET', 'POST'])
+@somente_administrador
 def editar_aluno(aluno_id):
     try:
-        aluno = Aluno.query.get(aluno_id)
+        aluno = db.session.get(Aluno, aluno_id)
         if not aluno:
             logger.warning(f'UPDATE: Aluno com ID {aluno_id} não encontrado.')
             return render_template('error.html', error='Aluno não encontrado')
@@ -919,21 +1812,21 @@ def editar_aluno(aluno_id):
             logger.info(f'UPDATE: Aluno com ID {aluno_id} atualizado com sucesso via formulário.')
             return redirect('/alunos_view')
         
-        turmas = Turma.query.all()
-        return render_template('editar_aluno.html', aluno=aluno, turmas=turmas)
+        return render_template('editar_aluno.html', aluno=aluno)
     except Exception as e:
         logger.error(f'ERROR: Falha ao editar aluno com ID {aluno_id} - {e}')
         return render_template('error.html', error='Falha ao editar aluno')
 
 @app.route('/alunos/<aluno_id>/delete')
+@somente_administrador
+@usa_primario
 def deletar_aluno_view(aluno_id):
     try:
-        aluno = Aluno.query.get(aluno_id)
-        if not aluno:
+        removidos = Aluno.query.filter_by(id_aluno=aluno_id).delete(synchronize_session=False)
+        if not removidos:
             logger.warning(f'DELETE: Aluno com ID {aluno_id} não encontrado.')
             return render_template('error.html', error='Aluno não encontrado')
         
-        db.session.delete(aluno)
         db.session.commit()
         logger.info(f'DELETE: Aluno com ID {aluno_id} removido com sucesso via interface web.')
         return redirect('/alunos_view')
@@ -942,15 +1835,21 @@ def deletar_aluno_view(aluno_id):
         return render_template('error.html', error='Falha ao excluir aluno')
 
 @app.route('/pagamentos_view')
+@somente_administrador
 def pagamentos_view():
     try:
-        pagamentos = Pagamento.query.all()
-        return render_template('pagamentos.html', pagamentos=pagamentos)
+        return cache_html.pagina(('pagamento', 'aluno'), lambda: render_template(
+            'pagamentos.html', linhas=cache_html.linhas(
+                Pagamento, 'linhas/pagamento.html', 'pagamento', opcoes=[joinedload(Pagamento.aluno)],
+                dependencias=('aluno',)
+            )
+        ))
     except Exception as e:
         logger.error(f'ERROR: Falha ao renderizar página de pagamentos - {e}')
         return render_template('error.html', error='Falha ao carregar a página de pagamentos')
 
 @app.route('/pagamentos/novo', methods=['GET', 'POST'])
+@somente_administrador
 def novo_pagamento():
     try:
         if request.method == 'POST':
@@ -974,16 +1873,16 @@ def novo_pagamento():
             logger.info(f'CREATE: Pagamento para aluno ID {pagamento.id_aluno} inserido com sucesso via formulário.')
             return redirect('/pagamentos_view')
         
-        alunos = Aluno.query.all()
-        return render_template('novo_pagamento.html', alunos=alunos)
+        return render_template('novo_pagamento.html')
     except Exception as e:
         logger.error(f'ERROR: Falha ao criar novo pagamento - {e}')
         return render_template('error.html', error='Falha ao criar novo pagamento')
 
 @app.route('/pagamentos/<pagamento_id>/edit', methods=['GET', 'POST'])
+@somente_administrador
 def editar_pagamento(pagamento_id):
     try:
-        pagamento = Pagamento.query.get(pagamento_id)
+        pagamento = db.session.get(Pagamento, pagamento_id)
         if not pagamento:
             logger.warning(f'UPDATE: Pagamento com ID {pagamento_id} não encontrado.')
             return render_template('error.html', error='Pagamento não encontrado')
@@ -1000,16 +1899,17 @@ def editar_pagamento(pagamento_id):
             logger.info(f'UPDATE: Pagamento com ID {pagamento_id} atualizado com sucesso via formulário.')
             return redirect('/pagamentos_view')
         
-        alunos = Aluno.query.all()
-        return render_template('editar_pagamento.html', pagamento=pagamento, alunos=alunos)
+        return render_template('editar_pagamento.html', pagamento=pagamento)
     except Exception as e:
         logger.error(f'ERROR: Falha ao editar pagamento com ID {pagamento_id} - {e}')
         return render_template('error.html', error='Falha ao editar pagamento')
 
 @app.route('/pagamentos/<pagamento_id>/delete')
+@somente_administrador
+@usa_primario
 def deletar_pagamento_view(pagamento_id):
     try:
-        pagamento = Pagamento.query.get(pagamento_id)
+        pagamento = db.session.get(Pagamento, pagamento_id)
         if not pagamento:
             logger.warning(f'DELETE: Pagamento com ID {pagamento_id} não encontrado.')
             return render_template('error.html', error='Pagamento não encontrado')
@@ -1023,18 +1923,24 @@ def deletar_pagamento_view(pagamento_id):
         return render_template('error.html', error='Falha ao excluir pagamento')
 
 @app.route('/atividades_view')
+@somente_administrador
 def atividades_view():
     try:
-        atividades = Atividade.query.all()
-        return render_template('atividades.html', atividades=atividades)
+        # Participantes alteram a contagem exibida na linha (eventos de atividade_aluno)
+        return cache_html.pagina(('atividade', 'atividade_aluno'), lambda: render_template(
+            'atividades.html', linhas=cache_html.linhas(
+                Atividade, 'linhas/atividade.html', 'atividade', opcoes=[selectinload(Atividade.alunos)]
+            )
+        ))
     except Exception as e:
         logger.error(f'ERROR: Falha ao renderizar página de atividades - {e}')
         return render_template('error.html', error='Falha ao carregar a página de atividades')
 
 @app.route('/atividades/<atividade_id>/alunos')
+@somente_administrador
 def alunos_atividade(atividade_id):
     try:
-        atividade = Atividade.query.get(atividade_id)
+        atividade = db.session.get(Atividade, atividade_id)
         if not atividade:
             logger.warning(f'READ: Atividade com ID {atividade_id} não encontrada.')
             return render_template('error.html', error='Atividade não encontrada')
@@ -1047,6 +1953,7 @@ def alunos_atividade(atividade_id):
         return render_template('error.html', error='Falha ao listar alunos da atividade')
 
 @app.route('/atividades/nova', methods=['GET', 'POST'])
+@somente_administrador
 def nova_atividade():
     try:
         if request.method == 'POST':
@@ -1058,27 +1965,26 @@ def nova_atividade():
                 data_realizacao=data_realizacao
             )
             
+            db.session.add(atividade)
+            db.session.flush()
+            
             # Se houver alunos selecionados
-            alunos_ids = request.form.getlist('alunos')
-            if alunos_ids:
-                alunos = Aluno.query.filter(Aluno.id_aluno.in_(alunos_ids)).all()
-                atividade.alunos = alunos
+            adicionar_alunos_atividade(atividade.id_atividade, {int(id_aluno) for id_aluno in request.form.getlist('alunos')})
             
-            db.session.add(atividade)
             db.session.commit()
             logger.info(f'CREATE: Atividade {atividade.descricao} inserida com sucesso via formulário.')
             return redirect('/atividades_view')
         
-        alunos = Aluno.query.all()
-        return render_template('nova_atividade.html', alunos=alunos)
+        return render_template('nova_atividade.html')
     except Exception as e:
         logger.error(f'ERROR: Falha ao criar nova atividade - {e}')
         return render_template('error.html', error='Falha ao criar nova atividade')
 
 @app.route('/atividades/<atividade_id>/edit', methods=['GET', 'POST'])
+@somente_administrador
 def editar_atividade(atividade_id):
     try:
-        atividade = Atividade.query.get(atividade_id)
+        atividade = db.session.get(Atividade, atividade_id)
         if not atividade:
             logger.warning(f'UPDATE: Atividade com ID {atividade_id} não encontrada.')
             return render_template('error.html', error='Atividade não encontrada')
@@ -1087,31 +1993,38 @@ def editar_atividade(atividade_id):
             atividade.descricao = request.form['descricao']
             atividade.data_realizacao = datetime.strptime(request.form['data_realizacao'], '%Y-%m-%d').date() if request.form['data_realizacao'] else None
             
-            # Atualizar alunos associados
-            alunos_ids = request.form.getlist('alunos')
-            alunos = Aluno.query.filter(Aluno.id_aluno.in_(alunos_ids)).all() if alunos_ids else []
-            atividade.alunos = alunos
+            # Atualizar alunos associados (somente inclusões e remoções)
+            sincronizar_alunos_atividade(atividade.id_atividade, request.form.getlist('alunos'))
             
             db.session.commit()
             logger.info(f'UPDATE: Atividade com ID {atividade_id} atualizada com sucesso via formulário.')
             return redirect('/atividades_view')
         
-        alunos = Aluno.query.all()
-        alunos_selecionados = [aluno.id_aluno for aluno in atividade.alunos]
-        return render_template('editar_atividade.html', atividade=atividade, alunos=alunos, alunos_selecionados=alunos_selecionados)
+        # Só os participantes atuais; novos alunos são adicionados pela busca (/lookup/alunos)
+        participantes = [
+            {'id': id_aluno, 'nome': nome}
+            for id_aluno, nome in db.session.query(Aluno.id_aluno, Aluno.nome_completo)
+            .join(AtividadeAluno, AtividadeAluno.id_aluno == Aluno.id_aluno)
+            .filter(AtividadeAluno.id_atividade == atividade.id_atividade)
+            .order_by(Aluno.nome_completo)
+        ]
+        return render_template('editar_atividade.html', atividade=atividade, participantes=participantes)
+    except ValueError as e:
+        return render_template('error.html', error=f'Dados inválidos - {e}'), 400
     except Exception as e:
         logger.error(f'ERROR: Falha ao editar atividade com ID {atividade_id} - {e}')
         return render_template('error.html', error='Falha ao editar atividade')
 
 @app.route('/atividades/<atividade_id>/delete')
+@somente_administrador
+@usa_primario
 def deletar_atividade_view(atividade_id):
     try:
-        atividade = Atividade.query.get(atividade_id)
-        if not atividade:
+        removidos = Atividade.query.filter_by(id_atividade=atividade_id).delete(synchronize_session=False)
+        if not removidos:
             logger.warning(f'DELETE: Atividade com ID {atividade_id} não encontrada.')
             return render_template('error.html', error='Atividade não encontrada')
         
-        db.session.delete(atividade)
         db.session.commit()
         logger.info(f'DELETE: Atividade com ID {atividade_id} removida com sucesso via interface web.')
         return redirect('/atividades_view')
@@ -0,0 +1,144 @@
+import json
+import logging
+import zlib
+from collections import defaultdict
+from datetime import date
+from decimal import Decimal
+
+from sqlalchemy import and_, select
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+
+from models import db, LoteArquivo, Pagamento, Presenca
+
+logger = logging.getLogger(__name__)
+
+# Entidades arquivadas: coluna de data usada no corte e filtro adicional das linhas elegíveis
+ARQUIVAVEIS = {
+    'presencas': {'modelo': Presenca, 'data': 'data_presenca', 'filtro': None},
+    'pagamentos': {'modelo': Pagamento, 'data': 'data_pagamento', 'filtro': Pagamento.status == 'Pago'},
+}
+
+
+def _codificar(valor):
+    if isinstance(valor, date):
+        return valor.isoformat()
+    if isinstance(valor, Decimal):
+        return str(valor)
+    return valor
+
+
+def _decodificar(coluna, valor):
+    if valor is None:
+        return None
+    tipo = coluna.type.python_type
+    if tipo is date:
+        return date.fromisoformat(valor)
+    if tipo is Decimal:
+        return Decimal(valor)
+    return valor
+
+
+def comprimir(tabela, linhas):
+    """Lote em formato colunar ({coluna: [valores]}): valores parecidos ficam juntos e comprimem melhor"""
+    colunas = {coluna.name: [_codificar(linha[coluna.name]) for linha in linhas] for coluna in tabela.columns}
+    return zlib.compress(json.dumps(colunas, separators=(',', ':')).encode('utf-8'), 9)
+
+
+def descomprimir(tabela, dados):
+    colunas = json.loads(zlib.decompress(dados))
+    nomes = list(colunas)
+    convertidas = [[_decodificar(tabela.c[nome], valor) for valor in colunas[nome]] for nome in nomes]
+    return [dict(zip(nomes, valores)) for valores in zip(*convertidas)]
+
+
+def arquivar(corte, alunos_por_lote=500):
+    """Move as linhas anteriores a `corte` para arquivo.lote, um lote por aluno e ano.
+
+    Cada grupo de alunos é movido em uma transação (DELETE ... RETURNING seguido do INSERT dos lotes),
+    então uma falha no meio não perde nem duplica linhas."""
+    resumo = {}
+    for nome, spec in ARQUIVAVEIS.items():
+        tabela = spec['modelo'].__table__
+        coluna_data = tabela.c[spec['data']]
+        criterio = coluna_data < corte
+        if spec['filtro'] is not None:
+            criterio = and_(criterio, spec['filtro'])
+
+        linhas_movidas = lotes_criados = 0
+        while True:
+            alunos = db.session.execute(
+                select(tabela.c.id_aluno).where(criterio, tabela.c.id_aluno.isnot(None))
+                .distinct().limit(alunos_por_lote)
+            ).scalars().all()
+            if not alunos:
+                break
+
+            removidas = db.session.execute(
+                tabela.delete().where(criterio, tabela.c.id_aluno.in_(alunos)).returning(*tabela.columns)
+            ).mappings().all()
+            grupos = defaultdict(list)
+            for linha in removidas:
+                grupos[(linha['id_aluno'], linha[coluna_data.name].year)].append(linha)
+
+            db.session.add_all([
+                LoteArquivo(
+                    entidade=tabela.name,
+                    id_aluno=id_aluno,
+                    inicio=min(linha[coluna_data.name] for linha in linhas),
+                    fim=max(linha[coluna_data.name] for linha in linhas),
+                    quantidade=len(linhas),
+                    dados=comprimir(tabela, linhas)
+                )
+                for (id_aluno, _), linhas in grupos.items()
+            ])
+            db.session.commit()
+            linhas_movidas += len(removidas)
+            lotes_criados += len(grupos)
+
+        resumo[nome] = {'linhas': linhas_movidas, 'lotes': lotes_criados}
+        logger.info(f'ARQUIVO: {linhas_movidas} linha(s) de {nome} anteriores a {corte} arquivadas em {lotes_criados} lote(s).')
+    return resumo
+
+
+def historico(entidade, id_aluno=None, inicio=None, fim=None):
+    """Gerador das linhas arquivadas (dicts), descomprimindo apenas os lotes que cobrem o filtro"""
+    spec = ARQUIVAVEIS[entidade]
+    tabela = spec['modelo'].__table__
+    consulta = select(LoteArquivo.dados).where(LoteArquivo.entidade == tabela.name)
+    if id_aluno is not None:
+        consulta = consulta.where(LoteArquivo.id_aluno == id_aluno)
+    if inicio is not None:
+        consulta = consulta.where(LoteArquivo.fim >= inicio)
+    if fim is not None:
+        consulta = consulta.where(LoteArquivo.inicio <= fim)
+    consulta = consulta.order_by(LoteArquivo.id_aluno, LoteArquivo.inicio).execution_options(yield_per=100)
+
+    for dados in db.session.execute(consulta).scalars():
+        for linha in descomprimir(tabela, dados):
+            data = linha[spec['data']]
+            if (inicio is None or data >= inicio) and (fim is None or data <= fim):
+                yield linha
+
+
+def restaurar(id_aluno):
+    """Devolve às tabelas ativas todo o histórico arquivado do aluno (com os IDs originais)"""
+    resumo = {}
+    for nome, spec in ARQUIVAVEIS.items():
+        tabela = spec['modelo'].__table__
+        lotes = (
+            LoteArquivo.query
+            .filter_by(entidade=tabela.name, id_aluno=id_aluno)
+            .with_for_update()
+            .all()
+        )
+        restauradas = 0
+        for lote in lotes:
+            linhas = descomprimir(tabela, lote.dados)
+            restauradas += db.session.execute(
+                pg_insert(tabela).values(linhas).on_conflict_do_nothing()
+            ).rowcount
+            db.session.delete(lote)
+        resumo[nome] = restauradas
+    db.session.commit()
+    logger.info(f'ARQUIVO: Histórico do aluno com ID {id_aluno} restaurado ({resumo}).')
+    return resumo
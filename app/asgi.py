@@ -0,0 +1,272 @@
+import asyncio
+import json
+import logging
+import re
+from collections import OrderedDict
+from http.cookies import SimpleCookie
+from urllib.parse import parse_qs
+
+from a2wsgi import WSGIMiddleware
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+from sqlalchemy.orm import selectinload
+
+from app import app as flask_app
+from autenticacao import ADMINISTRADOR, COOKIE, autenticacao
+from consultas import instrucao_listagem
+from escolas import ESQUEMA_PADRAO, SHARD_PRINCIPAL, escolas
+from models import Professor, Turma, Aluno, Pagamento, Presenca, Atividade
+from notificacoes import barramento, evento_sse
+from saude import saude
+
+# Modo assíncrono: uvicorn asgi:app (perfil "async" do docker-compose)
+logger = logging.getLogger(__name__)
+
+# Leituras atendidas em corrotinas: entidade -> (modelo, carga dos relacionamentos usados em to_dict, erro 404)
+ENTIDADES = {
+    'professores': (Professor, (), 'Professor não encontrado'),
+    'turmas': (Turma, (selectinload(Turma.horarios),), 'Turma não encontrada'),
+    'alunos': (Aluno, (), 'Aluno não encontrado'),
+    'pagamentos': (Pagamento, (), 'Pagamento não encontrado'),
+    'presencas': (Presenca, (), 'Presença não encontrada'),
+    'atividades': (Atividade, (selectinload(Atividade.alunos),), 'Atividade não encontrada'),
+}
+# Mesmos caminhos das rotas do Flask: /professores/, /presencas (sem barra) e /<entidade>/<id>
+LISTAGEM = re.compile(r'^/(professores|turmas|alunos|pagamentos|atividades)/$|^/(presencas)$')
+POR_ID = re.compile(r'^/(professores|turmas|alunos|pagamentos|presencas|atividades)/(\d+)$')
+
+
+def _rota(caminho):
+    """(entidade, id) de uma leitura atendida aqui (id None nas listagens) ou None"""
+    encontrada = LISTAGEM.match(caminho)
+    if encontrada:
+        return encontrada.group(1) or encontrada.group(2), None
+    encontrada = POR_ID.match(caminho)
+    if encontrada:
+        return encontrada.group(1), int(encontrada.group(2))
+    return None
+
+
+def _token(cabecalhos):
+    autorizacao = cabecalhos.get('authorization', '')
+    if autorizacao.startswith('Bearer '):
+        return autorizacao[len('Bearer '):].strip()
+    cookie = SimpleCookie(cabecalhos.get('cookie', '')).get(COOKIE)
+    return cookie.value if cookie else None
+
+
+def _cabecalhos(scope):
+    return {nome.decode('latin-1').lower(): valor.decode('latin-1') for nome, valor in scope['headers']}
+
+
+class _FilaAssincrona:
+    """Fila de um cliente SSE em corrotina: a thread do LISTEN entrega os eventos no loop do asyncio"""
+
+    def __init__(self, loop):
+        self.loop = loop
+        self.eventos = asyncio.Queue(maxsize=100)
+
+    def put_nowait(self, evento):
+        try:
+            self.loop.call_soon_threadsafe(self._colocar, evento)
+        except RuntimeError:
+            # Loop já encerrado: o cliente está sendo desconectado
+            pass
+
+    def _colocar(self, evento):
+        try:
+            self.eventos.put_nowait(evento)
+        except asyncio.QueueFull:
+            # Cliente lento: descarta o evento em vez de acumular memória (como no Flask)
+            pass
+
+
+async def _desconexao(receive):
+    while (await receive())['type'] != 'http.disconnect':
+        pass
+
+
+async def _enviar(send, texto):
+    await send({'type': 'http.response.body', 'body': texto.encode(), 'more_body': True})
+
+
+class LeituraAssincrona:
+    """Aplicação ASGI: listagens e GET por ID de JSON simples rodam em corrotinas sobre o asyncpg,
+    sem ocupar uma thread durante a ida ao banco.
+
+    O stream /eventos também é atendido aqui, sem uma thread por cliente conectado. Todo o resto
+    (escritas, páginas, ?ids=, ?formato=, /batch) segue para o Flask, executado em um pool de
+    ASYNC_WSGI_THREADS threads. Os modelos são os mesmos de models.py."""
+
+    def __init__(self, app):
+        self.app = app
+        self.config = app.config
+        self.wsgi = WSGIMiddleware(app, workers=self.config['ASYNC_WSGI_THREADS'])
+        self._engines = OrderedDict()
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            return await self._ciclo_de_vida(receive, send)
+        if scope['type'] == 'http' and scope['method'] == 'GET' and scope['path'] == '/eventos':
+            cabecalhos = _cabecalhos(scope)
+            escola = await self._escola(cabecalhos)
+            # Sem token válido o Flask responde (401, ou o stream se a lista de revogação estava desatualizada)
+            if escola is not None and (not autenticacao.ativa or self._usuario(cabecalhos, escola[1]) is not None):
+                return await self._eventos(scope, receive, send, escola[1])
+        if scope['type'] == 'http' and scope['method'] == 'GET' and not scope['query_string']:
+            rota = _rota(scope['path'])
+            cabecalhos = _cabecalhos(scope)
+            if rota is not None and self._pede_json(cabecalhos):
+                engine, esquema = await self._engine(cabecalhos)
+                if engine is not None and self._autorizado(cabecalhos, esquema):
+                    status, corpo = await self._ler(engine, *rota)
+                    return await self._responder(send, status, corpo)
+        await self.wsgi(scope, receive, send)
+
+    @staticmethod
+    def _pede_json(cabecalhos):
+        # MessagePack e Arrow são servidos pelo Flask (formatos.py)
+        aceita = cabecalhos.get('accept', '')
+        return 'msgpack' not in aceita and 'arrow' not in aceita
+
+    @staticmethod
+    def _usuario(cabecalhos, esquema):
+        """Dados do token da requisição ou None"""
+        token = _token(cabecalhos)
+        # Sem consultar o banco: com a lista de revogação desatualizada a requisição vai para o Flask
+        return autenticacao.verificar(token, esquema, carregar=False) if token else None
+
+    def _autorizado(self, cabecalhos, esquema):
+        """Sem autenticação ou com token de administrador; o resto (401, 403 e o escopo do professor) fica com o Flask"""
+        if not autenticacao.ativa:
+            return True
+        dados = self._usuario(cabecalhos, esquema)
+        return dados is not None and dados['nivel'] == ADMINISTRADOR
+
+    async def _escola(self, cabecalhos):
+        """(shard, esquema) da requisição; None quando a escola não é reconhecida (o Flask responde)"""
+        if not escolas.ativo:
+            return SHARD_PRINCIPAL, ESQUEMA_PADRAO
+        if escolas.catalogo_vencido():
+            # A releitura do catálogo usa o engine síncrono do Flask
+            escola = await asyncio.to_thread(self._identificar, cabecalhos)
+        else:
+            escola = escolas.identificar(cabecalhos.get('x-escola'), cabecalhos.get('host', ''))
+        return None if escola is None else (escola['shard'], escola['esquema'])
+
+    async def _engine(self, cabecalhos):
+        """Engine assíncrona e esquema do banco (ou da escola); engine None deixa o Flask responder"""
+        escola = await self._escola(cabecalhos)
+        if escola is None:
+            return None, None
+        shard, esquema = escola
+        return self._engine_para(shard, esquema if escolas.ativo else None), esquema
+
+    def _identificar(self, cabecalhos):
+        with self.app.app_context():
+            return escolas.identificar(cabecalhos.get('x-escola'), cabecalhos.get('host', ''))
+
+    def _engine_para(self, shard, esquema):
+        chave = (shard, esquema)
+        engine = self._engines.get(chave)
+        if engine is not None:
+            self._engines.move_to_end(chave)
+            return engine
+
+        # O dialeto asyncpg prepara cada instrução no servidor e guarda as preparadas por conexão
+        url = make_url(escolas.shards[shard]).set(drivername='postgresql+asyncpg').update_query_dict(
+            {'prepared_statement_cache_size': str(self.config['ASYNC_INSTRUCOES_PREPARADAS'])}
+        )
+        engine = create_async_engine(
+            url,
+            pool_size=self.config['ASYNC_POOL_SIZE'],
+            max_overflow=self.config['ASYNC_MAX_OVERFLOW'],
+            pool_pre_ping=True,
+            connect_args={'server_settings': {'search_path': esquema}} if esquema else {},
+        )
+        self._engines[chave] = engine
+        while len(self._engines) > self.config['ESCOLAS_MAX_POOLS']:
+            _, antiga = self._engines.popitem(last=False)
+            asyncio.ensure_future(antiga.dispose())
+        return engine
+
+    async def _ler(self, engine, entidade, id_):
+        modelo, opcoes, nao_encontrado = ENTIDADES[entidade]
+        try:
+            async with AsyncSession(engine) as sessao:
+                if id_ is None:
+                    objetos = (await sessao.execute(instrucao_listagem(modelo, *opcoes))).scalars().all()
+                    logger.info(f'READ: Listagem de {entidade} solicitada (async).')
+                    return 200, [objeto.to_dict() for objeto in objetos]
+                objeto = await sessao.get(modelo, id_, options=opcoes)
+                if objeto is None:
+                    logger.warning(f'READ: {entidade} com ID {id_} não encontrado (async).')
+                    return 404, {'error': nao_encontrado}
+                logger.info(f'READ: {entidade} com ID {id_} encontrado (async).')
+                return 200, objeto.to_dict()
+        except Exception as e:
+            logger.error(f'ERROR: Falha na leitura assíncrona de {entidade} - {e}')
+            return 500, {'error': f'Falha ao obter {entidade}'}
+
+    async def _eventos(self, scope, receive, send, esquema):
+        """Stream SSE de /eventos (o mesmo do Flask) em uma corrotina"""
+        parametros = parse_qs(scope['query_string'].decode())
+        entidades = {nome for nome in parametros.get('entidades', [''])[0].split(',') if nome}
+        heartbeat = self.config['SSE_HEARTBEAT']
+        if self.config['NOTIFICACOES_ATIVAS']:
+            # No Flask a escuta começa no before_request; aqui, no primeiro cliente
+            barramento.iniciar()
+        fila = barramento.conectar_cliente(esquema, fila=_FilaAssincrona(asyncio.get_running_loop()))
+        desconectado = asyncio.ensure_future(_desconexao(receive))
+        logger.info(f"READ: Cliente SSE conectado ({', '.join(sorted(entidades)) or 'todas as entidades'}) (async).")
+        try:
+            await send({
+                'type': 'http.response.start',
+                'status': 200,
+                'headers': [(b'content-type', b'text/event-stream; charset=utf-8'), (b'cache-control', b'no-cache'),
+                            (b'x-accel-buffering', b'no')],
+            })
+            await _enviar(send, 'retry: 3000\n\n')
+            while not desconectado.done():
+                proximo = asyncio.ensure_future(fila.eventos.get())
+                await asyncio.wait({proximo, desconectado}, timeout=heartbeat, return_when=asyncio.FIRST_COMPLETED)
+                if not proximo.done():
+                    proximo.cancel()
+                    if desconectado.done() or saude.drenando.is_set():
+                        # Drenagem: encerra o stream para o cliente reconectar (retry) em outra réplica
+                        break
+                    await _enviar(send, ': keep-alive\n\n')
+                    continue
+                evento = proximo.result()
+                if not entidades or evento.get('entidade') in entidades:
+                    await _enviar(send, evento_sse(evento))
+            if not desconectado.done():
+                await send({'type': 'http.response.body', 'body': b'', 'more_body': False})
+        finally:
+            desconectado.cancel()
+            barramento.desconectar_cliente(fila)
+
+    @staticmethod
+    async def _responder(send, status, corpo):
+        dados = json.dumps(corpo).encode()
+        await send({
+            'type': 'http.response.start',
+            'status': status,
+            'headers': [(b'content-type', b'application/json'), (b'content-length', str(len(dados)).encode())],
+        })
+        await send({'type': 'http.response.body', 'body': dados})
+
+    async def _ciclo_de_vida(self, receive, send):
+        while True:
+            mensagem = await receive()
+            if mensagem['type'] == 'lifespan.startup':
+                await send({'type': 'lifespan.startup.complete'})
+            elif mensagem['type'] == 'lifespan.shutdown':
+                # Devolve as conexões ao banco em vez de esperar o timeout do servidor
+                while self._engines:
+                    await self._engines.popitem()[1].dispose()
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+
+app = LeituraAssincrona(flask_app)
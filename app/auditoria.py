@@ -0,0 +1,304 @@
+import atexit
+import logging
+import os
+import threading
+import time
+from contextlib import nullcontext
+from datetime import date, datetime, time as hora
+from decimal import Decimal
+
+import sqlalchemy as sa
+from flask import g, has_app_context, has_request_context, request
+from sqlalchemy.dialects import postgresql
+
+from escolas import escolas
+from metricas import AUDITORIA, AUDITORIA_PENDENTES
+from models import db, FUNCAO_AUDITORIA_PARTICOES, RegistroAuditoria
+from replicas import RoutingSession
+
+logger = logging.getLogger(__name__)
+
+# Tabelas que não são auditadas: a própria auditoria, a fila de jobs e seus arquivos de resultado,
+# respostas de idempotência e os lotes do histórico arquivado (cópias comprimidas de linhas que já
+# estão na auditoria)
+EXCLUIDAS = {'auditoria', 'job', 'parte_resultado_job', 'chave_idempotencia', 'lote'}
+# Colunas gravadas só como "alterada", sem o valor
+OCULTAS = {'usuario': {'senha'}}
+OCULTO = '***'
+# Intervalo (segundos) entre verificações das partições mensais de cada banco/escola
+INTERVALO_PARTICOES = 6 * 3600
+CRIAR_PARTICOES = sa.text('SELECT public.auditoria_particoes(:meses)')
+# Bancos criados só pelos scripts SQL (InfraBD/escola.sql) ainda não têm a função
+FUNCAO_EXISTE = sa.text("SELECT to_regprocedure('public.auditoria_particoes(integer)') IS NOT NULL")
+# Registros fora de qualquer partição mensal (datas muito antigas ou adiante de AUDITORIA_MESES)
+CONTAR_PADRAO = sa.text('SELECT count(*) FROM auditoria_padrao')
+
+
+def _valor(valor):
+    """Valor de coluna em JSON: datas em ISO 8601, decimais como texto (valor exato)"""
+    if isinstance(valor, (datetime, date, hora)):
+        return valor.isoformat()
+    if isinstance(valor, Decimal):
+        return str(valor)
+    if isinstance(valor, (bytes, bytearray, memoryview)):
+        return None
+    return valor
+
+
+def _colunas(mapper, estado, ler):
+    ocultas = OCULTAS.get(mapper.local_table.name, ())
+    valores = {}
+    for atributo in mapper.column_attrs:
+        nome = atributo.columns[0].name
+        valor = ler(estado, atributo.key)
+        valores[nome] = OCULTO if nome in ocultas and valor is not None else _valor(valor)
+    return valores
+
+
+def _alteradas(mapper, estado):
+    """(antes, depois) só das colunas alteradas no flush"""
+    ocultas = OCULTAS.get(mapper.local_table.name, ())
+    antes, depois = {}, {}
+    for atributo in mapper.column_attrs:
+        historico = estado.attrs[atributo.key].history
+        if not historico.has_changes():
+            continue
+        nome = atributo.columns[0].name
+        anterior = historico.deleted[0] if historico.deleted else None
+        novo = historico.added[0] if historico.added else None
+        if anterior == novo and historico.deleted:
+            continue
+        antes[nome] = OCULTO if nome in ocultas else _valor(anterior)
+        depois[nome] = OCULTO if nome in ocultas else _valor(novo)
+    return antes, depois
+
+
+def _atual(estado, chave):
+    return estado.dict.get(chave)
+
+
+def _quem():
+    """(id do usuário, origem) da escrita: a requisição, o job ou "sistema" (comandos, inicialização)"""
+    usuario = g.get('usuario') if has_app_context() else None
+    if has_request_context():
+        origem = f'{request.method} {request.path}'
+    else:
+        origem = g.get('origem_auditoria', 'sistema') if has_app_context() else 'sistema'
+    return (int(usuario['sub']) if usuario else None), origem[:255]
+
+
+class Auditoria:
+    """Registro de todas as escritas (entidade, id, valores antigos e novos, usuário).
+
+    Os registros são montados nos eventos da sessão, guardados em memória no commit (descartados
+    no rollback) e gravados por uma thread em lotes, em um INSERT de várias linhas por banco/escola,
+    fora da transação da requisição."""
+
+    def __init__(self, app=None):
+        self.app = None
+        self.ativa = False
+        self._pendentes = []
+        self._lock = threading.Lock()
+        self._descarga = threading.Lock()
+        self._acordar = threading.Event()
+        self._thread_pid = None
+        self._particoes = {}
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.extensions['auditoria'] = self
+        self.app = app
+        self._config = app.config
+        self.ativa = app.config['AUDITORIA_ATIVA']
+        if self.ativa:
+            # Na saída do processo, grava o que ainda está em memória
+            atexit.register(self.descarregar)
+
+    def registrar(self, registros):
+        """Adiciona registros (já confirmados no banco) ao buffer de gravação"""
+        if not registros:
+            return
+        with self._lock:
+            self._pendentes.extend(registros)
+            pendentes = len(self._pendentes)
+        AUDITORIA_PENDENTES.set(pendentes)
+        self._iniciar()
+        if pendentes >= self._config['AUDITORIA_MAX_PENDENTES']:
+            # Banco lento ou muitas escritas: quem confirma grava também, em vez de acumular memória
+            self.descarregar()
+        elif pendentes >= self._config['AUDITORIA_LOTE']:
+            self._acordar.set()
+
+    def _iniciar(self):
+        # Uma thread por processo (também nos processos criados por fork depois do init_app)
+        if self._thread_pid == os.getpid():
+            return
+        with self._lock:
+            if self._thread_pid == os.getpid():
+                return
+            self._thread_pid = os.getpid()
+        threading.Thread(target=self._loop, name='auditoria', daemon=True).start()
+
+    def _loop(self):
+        while True:
+            self._acordar.wait(self._config['AUDITORIA_INTERVALO'])
+            self._acordar.clear()
+            self.descarregar()
+
+    def descarregar(self):
+        """Grava agora os registros em memória; devolve quantos foram gravados"""
+        with self._descarga:
+            with self._lock:
+                registros, self._pendentes = self._pendentes, []
+            if not registros:
+                return 0
+            destinos = {}
+            for escola, registro in registros:
+                chave = (escola['shard'], escola['esquema']) if escola else None
+                destinos.setdefault(chave, (escola, []))[1].append(registro)
+
+            gravados = 0
+            # Chamada também no commit de uma requisição (buffer cheio): usa o contexto que já existe
+            with nullcontext() if has_app_context() else self.app.app_context():
+                for chave, (escola, itens) in destinos.items():
+                    try:
+                        self._gravar(chave, escola, itens)
+                        gravados += len(itens)
+                        AUDITORIA.labels('gravado').inc(len(itens))
+                    except Exception as e:
+                        # Voltam para o buffer e são tentados de novo no próximo ciclo
+                        logger.error(f'AUDITORIA: Falha ao gravar {len(itens)} registro(s) - {e}')
+                        AUDITORIA.labels('falhou').inc(len(itens))
+                        with self._lock:
+                            self._pendentes[:0] = [(escola, item) for item in itens]
+            with self._lock:
+                AUDITORIA_PENDENTES.set(len(self._pendentes))
+            return gravados
+
+    def _gravar(self, chave, escola, itens):
+        engine = escolas.engine(escola) if escola else db.engine
+        self._garantir_particoes(chave, engine)
+        tabela = RegistroAuditoria.__table__
+        tamanho = self._config['AUDITORIA_LOTE']
+        with engine.begin() as conexao:
+            for inicio in range(0, len(itens), tamanho):
+                # executemany do psycopg2 com execute_values: um INSERT de várias linhas por lote
+                conexao.execute(tabela.insert(), itens[inicio:inicio + tamanho])
+
+    def _garantir_particoes(self, chave, engine):
+        agora = time.monotonic()
+        if agora - self._particoes.get(chave, -INTERVALO_PARTICOES) < INTERVALO_PARTICOES:
+            return
+        try:
+            with engine.begin() as conexao:
+                if not conexao.execute(FUNCAO_EXISTE).scalar():
+                    conexao.execute(FUNCAO_AUDITORIA_PARTICOES)
+                criadas = conexao.execute(CRIAR_PARTICOES, {'meses': self._config['AUDITORIA_MESES']}).scalar()
+                na_padrao = conexao.execute(CONTAR_PADRAO).scalar()
+            if criadas:
+                logger.info(f'AUDITORIA: {criadas} partição(ões) mensal(is) criada(s).')
+            if na_padrao:
+                logger.warning(f'AUDITORIA: {na_padrao} registro(s) na partição padrão, fora das partições mensais.')
+        except Exception as e:
+            # Sem a partição do mês os registros vão para a partição padrão
+            logger.warning(f'AUDITORIA: Falha ao criar partições - {e}')
+        self._particoes[chave] = agora
+
+    def consultar(self, entidade, id_registro=None, desde=None, ate=None, id_usuario=None, limite=100):
+        """Registros de uma entidade (ou de uma linha dela), do mais recente para o mais antigo"""
+        consulta = sa.select(RegistroAuditoria).where(RegistroAuditoria.entidade == entidade)
+        if id_registro is not None:
+            consulta = consulta.where(RegistroAuditoria.id_registro == str(id_registro))
+        # Intervalo em registrado_em: o PostgreSQL lê só as partições dos meses pedidos
+        if desde is not None:
+            consulta = consulta.where(RegistroAuditoria.registrado_em >= desde)
+        if ate is not None:
+            consulta = consulta.where(RegistroAuditoria.registrado_em < ate)
+        if id_usuario is not None:
+            consulta = consulta.where(RegistroAuditoria.id_usuario == id_usuario)
+        consulta = consulta.order_by(RegistroAuditoria.registrado_em.desc(), RegistroAuditoria.id_auditoria.desc()).limit(limite)
+        return [registro.to_dict() for registro in db.session.scalars(consulta)]
+
+
+auditoria = Auditoria()
+
+
+# Registros montados no flush e entregues ao buffer só depois do commit
+def _pendentes(session):
+    return session.info.setdefault('auditoria', [])
+
+
+def _registro(entidade, id_registro, operacao, antes, depois, usuario, origem, instante):
+    return (escolas.atual(), {
+        'registrado_em': instante, 'entidade': entidade, 'id_registro': id_registro, 'operacao': operacao,
+        'antes': antes, 'depois': depois, 'id_usuario': usuario, 'origem': origem,
+    })
+
+
+@sa.event.listens_for(RoutingSession, 'after_flush')
+def _registrar_flush(session, flush_context):
+    if not auditoria.ativa:
+        return
+    usuario, origem = _quem()
+    instante = datetime.utcnow()
+    registros = _pendentes(session)
+    for operacao, objetos in (('INSERT', session.new), ('UPDATE', session.dirty), ('DELETE', session.deleted)):
+        for objeto in objetos:
+            estado = sa.inspect(objeto)
+            mapper = estado.mapper
+            entidade = mapper.local_table.name
+            if entidade in EXCLUIDAS:
+                continue
+            if operacao == 'INSERT':
+                antes, depois = None, _colunas(mapper, estado, _atual)
+            elif operacao == 'DELETE':
+                antes, depois = _colunas(mapper, estado, _atual), None
+            else:
+                antes, depois = _alteradas(mapper, estado)
+                if not depois:
+                    continue
+            chave = ','.join(str(valor) for valor in mapper.primary_key_from_instance(objeto))
+            registros.append(_registro(entidade, chave, operacao, antes, depois, usuario, origem, instante))
+
+
+@sa.event.listens_for(RoutingSession, 'do_orm_execute')
+def _registrar_instrucao(orm_execute_state):
+    # INSERT ... SELECT, query.update()/delete() e afins: uma linha por instrução, com o SQL
+    if not auditoria.ativa or orm_execute_state.is_select:
+        return
+    tabela = getattr(orm_execute_state.statement, 'table', None)
+    if tabela is None or tabela.name in EXCLUIDAS:
+        return
+    if orm_execute_state.is_delete:
+        operacao = 'DELETE'
+    elif orm_execute_state.is_insert:
+        operacao = 'INSERT'
+    else:
+        operacao = 'UPDATE'
+    try:
+        instrucao = str(orm_execute_state.statement.compile(dialect=postgresql.dialect()))[:2000]
+    except Exception:
+        instrucao = None
+    usuario, origem = _quem()
+    _pendentes(orm_execute_state.session).append(_registro(
+        tabela.name, None, operacao, None, {'instrucao': instrucao}, usuario, origem, datetime.utcnow()
+    ))
+
+
+@sa.event.listens_for(RoutingSession, 'after_commit')
+def _entregar_commit(session):
+    auditoria.registrar(session.info.pop('auditoria', None))
+
+
+@sa.event.listens_for(RoutingSession, 'after_rollback')
+def _descartar_rollback(session):
+    session.info.pop('auditoria', None)
+
+
+def registrar_em_massa(entidade, operacao, resumo):
+    """Registro de uma escrita feita fora da sessão (ex.: COPY da importação), depois de confirmada"""
+    if not auditoria.ativa:
+        return
+    usuario, origem = _quem()
+    auditoria.registrar([_registro(entidade, None, operacao, None, resumo, usuario, origem, datetime.utcnow())])
@@ -0,0 +1,390 @@
+import base64
+import hashlib
+import hmac
+import json
+import logging
+import secrets
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+from urllib.parse import quote
+
+import sqlalchemy as sa
+from flask import current_app, g, jsonify, redirect, request
+
+from escolas import ESQUEMA_PADRAO, escolas
+from metricas import AUTENTICACAO
+from models import db, Aluno, Revogacao, Turma, Usuario
+from notificacoes import barramento
+
+logger = logging.getLogger(__name__)
+
+ADMINISTRADOR = 'administrador'
+PROFESSOR = 'professor'
+NIVEIS = (ADMINISTRADOR, PROFESSOR)
+COOKIE = 'escola_token'
+# Rotas do Swagger e arquivos estáticos, liberadas como as marcadas com @publica
+ENDPOINTS_PUBLICOS = {'doc', 'specs', 'root', 'static', 'estaticos'}
+# Cabeçalho fixo dos tokens: {"alg":"HS256","typ":"JWT"}
+CABECALHO_TOKEN = base64.urlsafe_b64encode(b'{"alg":"HS256","typ":"JWT"}').rstrip(b'=').decode()
+
+
+def publica(view):
+    """Marca uma rota que dispensa token (ex.: login, saúde). A classe de admissão não conta: uma rota
+    LIVRE (sem limite de taxa) ainda exige token se não tiver esta marca"""
+    view._publica = True
+    return view
+
+
+def permite_professor(view):
+    """Marca uma rota de escrita liberada ao nível professor (a rota confere o escopo com pode_ver_aluno)"""
+    view._permite_professor = True
+    return view
+
+
+def escopo_professor(view):
+    """Marca uma leitura (GET) liberada ao nível professor: a rota restringe o resultado às turmas e
+    alunos dele (turmas_permitidas, alunos_permitidos, pode_ver_*). Leituras sem a marca são só do administrador"""
+    view._escopo_professor = True
+    return view
+
+
+def somente_administrador(view):
+    """Marca uma rota negada ao nível professor mesmo em GET (ex.: páginas de cadastro e links de exclusão)"""
+    view._somente_administrador = True
+    return view
+
+
+def _b64(dados):
+    return base64.urlsafe_b64encode(dados).rstrip(b'=').decode()
+
+
+def _de_b64(texto):
+    return base64.urlsafe_b64decode(texto + '=' * (-len(texto) % 4))
+
+
+# Senhas: scrypt com custo configurável (SENHA_SCRYPT_N/R/P), guardado junto do hash
+def gerar_hash(senha, n, r, p):
+    sal = secrets.token_bytes(16)
+    chave = hashlib.scrypt(senha.encode(), salt=sal, n=n, r=r, p=p, maxmem=_memoria(n, r, p))
+    return f'scrypt${n}${r}${p}${_b64(sal)}${_b64(chave)}'
+
+
+def _memoria(n, r, p):
+    return 128 * r * (n + p + 2) + 1024 * 1024
+
+
+def conferir_senha(senha, guardada):
+    """True se a senha confere; senhas antigas em texto puro também são aceitas (e trocadas no login)"""
+    if not guardada:
+        return False
+    if not guardada.startswith('scrypt$'):
+        return hmac.compare_digest(senha.encode(), guardada.encode())
+    _, n, r, p, sal, chave = guardada.split('$')
+    n, r, p = int(n), int(r), int(p)
+    calculada = hashlib.scrypt(senha.encode(), salt=_de_b64(sal), n=n, r=r, p=p, maxmem=_memoria(n, r, p))
+    return hmac.compare_digest(calculada, _de_b64(chave))
+
+
+def precisa_novo_hash(guardada, n, r, p):
+    return not guardada.startswith(f'scrypt${n}${r}${p}$')
+
+
+# Tokens: JWT HS256 (cabeçalho.dados.assinatura), conferidos sem consultar o banco
+def emitir_token(dados, segredo):
+    corpo = f'{CABECALHO_TOKEN}.{_b64(json.dumps(dados, separators=(",", ":")).encode())}'
+    assinatura = hmac.new(segredo, corpo.encode(), hashlib.sha256).digest()
+    return f'{corpo}.{_b64(assinatura)}'
+
+
+def ler_token(token, segredo, agora=None):
+    """Dados do token se a assinatura confere e ele não expirou; None caso contrário"""
+    try:
+        corpo, assinatura = token.rsplit('.', 1)
+        cabecalho, dados = corpo.split('.')
+        if cabecalho != CABECALHO_TOKEN:
+            return None
+        esperada = hmac.new(segredo, corpo.encode(), hashlib.sha256).digest()
+        if not hmac.compare_digest(esperada, _de_b64(assinatura)):
+            return None
+        dados = json.loads(_de_b64(dados))
+    except (ValueError, TypeError):
+        return None
+    if dados.get('exp', 0) <= (agora or time.time()):
+        return None
+    return dados
+
+
+class ListaRevogacao:
+    """Revogações ainda válidas de uma escola: jti -> expiração e usuário -> instante da revogação"""
+
+    def __init__(self, linhas=()):
+        self.jtis = {}
+        self.usuarios = {}
+        for jti, id_usuario, revogado_em, expira_em in linhas:
+            self.adicionar(jti, id_usuario, revogado_em.timestamp(), expira_em.timestamp())
+
+    def adicionar(self, jti, id_usuario, revogado_em, expira_em):
+        if jti:
+            self.jtis[jti] = expira_em
+        if id_usuario is not None:
+            self.usuarios[id_usuario] = max(self.usuarios.get(id_usuario, 0), revogado_em)
+
+    def revogado(self, dados):
+        if dados['jti'] in self.jtis:
+            return True
+        # Revogação de todos os tokens do usuário: vale para os emitidos até aquele instante
+        return dados['iat'] <= self.usuarios.get(dados['sub'], -1)
+
+    def __len__(self):
+        return len(self.jtis) + len(self.usuarios)
+
+
+class Autenticacao:
+    """Login com senha (scrypt), tokens de acesso assinados e permissões em cache no processo.
+
+    O token leva usuário, nível de acesso, professor e escola: conferir uma requisição não consulta o
+    banco. Tokens revogados antes de expirar ficam em uma lista por escola, curta porque cada entrada
+    só vale até o fim do AUTH_TOKEN_TTL; ela e as turmas/alunos de cada professor são atualizadas pelos
+    NOTIFY do banco (sem o LISTEN, a lista é relida a cada AUTH_REVOGACOES_TTL segundos e as
+    permissões vêm do banco)."""
+
+    def __init__(self, app=None):
+        self.revogacoes = {}
+        self.permissoes = {}
+        self._geracoes = {}
+        self._ficticio = (None, None)
+        self._lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.extensions['autenticacao'] = self
+        self._config = app.config
+        segredo = app.config['AUTH_SEGREDO']
+        if not segredo:
+            if app.config['AUTH_ATIVA']:
+                logger.warning('AUTH: AUTH_SEGREDO vazio; tokens valem só neste processo até ele reiniciar.')
+            segredo = secrets.token_hex(32)
+        self.segredo = segredo.encode()
+        if app.config['NOTIFICACOES_ATIVAS']:
+            barramento.assinar(self._alteracao)
+        if app.config['AUTH_ATIVA']:
+            app.before_request(self._autenticar)
+
+    @property
+    def ativa(self):
+        return self._config['AUTH_ATIVA']
+
+    def _alteracao(self, evento):
+        entidade = evento.get('entidade')
+        esquema = evento.get('esquema', ESQUEMA_PADRAO)
+        with self._lock:
+            if entidade in (None, 'revogacao'):
+                if entidade is None:
+                    self.revogacoes.clear()
+                else:
+                    self.revogacoes.pop(esquema, None)
+            if entidade in (None, 'turma', 'aluno'):
+                # Turmas trocam de professor e alunos de turma: descarta as permissões da escola
+                if entidade is None:
+                    self.permissoes.clear()
+                    self._geracoes = {chave: geracao + 1 for chave, geracao in self._geracoes.items()}
+                else:
+                    self._geracoes[esquema] = self._geracoes.get(esquema, 0) + 1
+                    for chave in [chave for chave in self.permissoes if chave[0] == esquema]:
+                        del self.permissoes[chave]
+
+    # Login e tokens
+    def entrar(self, login, senha):
+        """Token de acesso para login/senha válidos (None caso contrário); atualiza o hash da senha se preciso"""
+        custo = (self._config['SENHA_SCRYPT_N'], self._config['SENHA_SCRYPT_R'], self._config['SENHA_SCRYPT_P'])
+        usuario = Usuario.query.filter_by(login=login).first()
+        if usuario is None or usuario.nivel_acesso not in NIVEIS:
+            # Mesmo custo de uma senha errada: o tempo de resposta não revela se o login existe
+            conferir_senha(senha, self._hash_ficticio(custo))
+            return None
+        if not conferir_senha(senha, usuario.senha):
+            return None
+        if precisa_novo_hash(usuario.senha, *custo):
+            usuario.senha = gerar_hash(senha, *custo)
+            db.session.commit()
+            logger.info(f'AUTH: Hash da senha do usuário {usuario.login} atualizado.')
+        return self.emitir(usuario)
+
+    def _hash_ficticio(self, custo):
+        if self._ficticio[0] != custo:
+            self._ficticio = (custo, gerar_hash(secrets.token_hex(8), *custo))
+        return self._ficticio[1]
+
+    def emitir(self, usuario):
+        agora = time.time()
+        dados = {
+            'sub': usuario.id_usuario,
+            'nivel': usuario.nivel_acesso,
+            'professor': usuario.id_professor,
+            'esquema': escolas.esquema_atual(),
+            # Em milissegundos: um token emitido logo após revogar os do usuário continua válido
+            'iat': round(agora, 3),
+            'exp': int(agora) + self._config['AUTH_TOKEN_TTL'],
+            'jti': secrets.token_hex(8),
+        }
+        return emitir_token(dados, self.segredo), dados
+
+    def verificar(self, token, esquema, carregar=True):
+        """Dados do token válido, não revogado e da escola `esquema`; None caso contrário.
+
+        Com carregar=False não há consulta ao banco: também devolve None se a lista de revogação da
+        escola precisa ser relida."""
+        dados = ler_token(token, self.segredo)
+        if dados is None or dados.get('esquema') != esquema:
+            return None
+        revogacoes = self._revogacoes(esquema, carregar)
+        if revogacoes is None or revogacoes.revogado(dados):
+            return None
+        return dados
+
+    # Revogação
+    def _revogacoes(self, esquema, carregar):
+        with self._lock:
+            lista, carregada_em = self.revogacoes.get(esquema, (None, 0.0))
+        ttl = None if barramento.conectado.is_set() else self._config['AUTH_REVOGACOES_TTL']
+        if lista is not None and (ttl is None or time.monotonic() - carregada_em < ttl):
+            return lista
+        if not carregar:
+            return None
+        linhas = db.session.execute(
+            sa.select(Revogacao.jti, Revogacao.id_usuario, Revogacao.revogado_em, Revogacao.expira_em)
+            .where(Revogacao.expira_em > datetime.utcnow())
+        ).all()
+        lista = ListaRevogacao(
+            (jti, id_usuario, _utc(revogado_em), _utc(expira_em)) for jti, id_usuario, revogado_em, expira_em in linhas
+        )
+        with self._lock:
+            self.revogacoes[esquema] = (lista, time.monotonic())
+        return lista
+
+    def revogar(self, jti=None, id_usuario=None):
+        """Revoga um token (jti) ou todos os tokens já emitidos para o usuário; confirma a transação"""
+        agora = datetime.utcnow()
+        expira_em = agora + timedelta(seconds=self._config['AUTH_TOKEN_TTL'])
+        db.session.add(Revogacao(jti=jti, id_usuario=id_usuario, revogado_em=agora, expira_em=expira_em))
+        db.session.commit()
+        # O próprio processo não espera o NOTIFY; os demais descartam a lista e a releem
+        esquema = escolas.esquema_atual()
+        with self._lock:
+            lista, _ = self.revogacoes.get(esquema, (None, 0.0))
+            if lista is not None:
+                lista.adicionar(jti, id_usuario, _utc(agora).timestamp(), _utc(expira_em).timestamp())
+
+    # Permissões
+    def _carregar_permissoes(self, id_professor):
+        turmas = frozenset(db.session.scalars(sa.select(Turma.id_turma).where(Turma.id_professor == id_professor)))
+        alunos = frozenset(db.session.scalars(sa.select(Aluno.id_aluno).where(Aluno.id_turma.in_(turmas)))) if turmas else frozenset()
+        return turmas, alunos
+
+    def permissoes_professor(self, id_professor):
+        """(turmas, alunos) que o professor pode ver, em cache por escola"""
+        if not barramento.conectado.is_set():
+            return self._carregar_permissoes(id_professor)
+        esquema = escolas.esquema_atual()
+        chave = (esquema, id_professor)
+        with self._lock:
+            permissoes = self.permissoes.get(chave)
+            geracao = self._geracoes.get(esquema, 0)
+        if permissoes is not None:
+            return permissoes
+        permissoes = self._carregar_permissoes(id_professor)
+        with self._lock:
+            # Alteração chegou durante a carga: usa o resultado, mas não o guarda
+            if self._geracoes.get(esquema, 0) == geracao:
+                self.permissoes[chave] = permissoes
+        return permissoes
+
+    # Requisições
+    def _autenticar(self):
+        view = current_app.view_functions.get(request.endpoint)
+        if (
+            view is None or request.endpoint in ENDPOINTS_PUBLICOS or request.endpoint.startswith('restx_doc.')
+            or _marcada(view, '_publica')
+        ):
+            return None
+
+        token = _token_da_requisicao()
+        dados = self.verificar(token, escolas.esquema_atual()) if token else None
+        if dados is None:
+            AUTENTICACAO.labels('negada').inc()
+            if request.method == 'GET' and request.accept_mimetypes.best == 'text/html':
+                return redirect(f'/login?proximo={quote(request.full_path.rstrip("?"))}')
+            resposta = jsonify({'error': 'Autenticação necessária'})
+            resposta.status_code = 401
+            resposta.headers['WWW-Authenticate'] = 'Bearer'
+            return resposta
+
+        g.usuario = dados
+        proibida = self.autorizar()
+        AUTENTICACAO.labels('proibida' if proibida else 'autorizada').inc()
+        return proibida
+
+    def autorizar(self):
+        """Resposta 403 quando o usuário já autenticado (g.usuario) não pode usar a rota da requisição.
+
+        Também chamada pelas sub-requisições de POST /batch, que não passam pelo before_request."""
+        usuario = g.get('usuario')
+        if usuario is None or usuario['nivel'] != PROFESSOR:
+            return None
+        view = current_app.view_functions.get(request.endpoint)
+        # Professor só usa rotas marcadas: uma rota nova fica restrita ao administrador até aplicar o escopo
+        marca = '_escopo_professor' if request.method in ('GET', 'HEAD') else '_permite_professor'
+        if _marcada(view, '_somente_administrador') or not _marcada(view, marca):
+            return jsonify({'error': 'Acesso restrito a administradores'}), 403
+        return None
+
+
+def _marcada(view, marca):
+    # Resources do flask-restx: a marca pode estar na classe
+    return getattr(view, marca, False) or getattr(getattr(view, 'view_class', None), marca, False)
+
+
+def _utc(instante):
+    """datetime do banco (UTC sem fuso) com fuso, para timestamp() não aplicar o fuso local"""
+    return instante.replace(tzinfo=timezone.utc)
+
+
+def _token_da_requisicao():
+    cabecalho = request.headers.get('Authorization', '')
+    if cabecalho.startswith('Bearer '):
+        return cabecalho[len('Bearer '):].strip()
+    return request.cookies.get(COOKIE)
+
+
+autenticacao = Autenticacao()
+
+
+# Escopo do usuário da requisição: None quando não há restrição (autenticação desligada ou administrador)
+def turmas_permitidas():
+    usuario = g.get('usuario')
+    if usuario is None or usuario['nivel'] != PROFESSOR:
+        return None
+    return autenticacao.permissoes_professor(usuario['professor'])[0]
+
+
+def alunos_permitidos():
+    usuario = g.get('usuario')
+    if usuario is None or usuario['nivel'] != PROFESSOR:
+        return None
+    return autenticacao.permissoes_professor(usuario['professor'])[1]
+
+
+def pode_ver_turma(id_turma):
+    turmas = turmas_permitidas()
+    return turmas is None or id_turma in turmas
+
+
+def pode_ver_aluno(id_aluno):
+    alunos = alunos_permitidos()
+    return alunos is None or id_aluno in alunos
+
+
+def acesso_negado():
+    return {'error': 'Acesso negado'}, 403
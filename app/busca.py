@@ -0,0 +1,158 @@
+import bisect
+import logging
+import threading
+import unicodedata
+
+from models import db, Aluno, Turma, Professor
+from escolas import ESQUEMA_PADRAO, escolas
+from notificacoes import barramento
+
+logger = logging.getLogger(__name__)
+
+# Entidades disponíveis em /lookup/<entidade>: modelo e coluna exibida
+ENTIDADES_BUSCA = {
+    'alunos': (Aluno, 'nome_completo'),
+    'turmas': (Turma, 'nome_turma'),
+    'professores': (Professor, 'nome_completo'),
+}
+LIMITE_PADRAO = 10
+LIMITE_MAXIMO = 50
+
+
+def normalizar(texto):
+    """Minúsculas e sem acentos, para "joao" encontrar "João" """
+    decomposto = unicodedata.normalize('NFKD', texto or '')
+    return ''.join(c for c in decomposto if not unicodedata.combining(c)).casefold().strip()
+
+
+def _sufixos(nome):
+    """Trechos do nome que começam em cada palavra ("ana maria silva", "maria silva", "silva")"""
+    palavras = normalizar(nome).split()
+    return [' '.join(palavras[i:]) for i in range(len(palavras))]
+
+
+class IndiceNomes:
+    """Índice id -> nome de uma entidade, com busca por prefixo de qualquer palavra do nome.
+
+    Carregado na primeira busca; depois, só os IDs alterados (NOTIFY ou commit local) são
+    recarregados, na próxima busca."""
+
+    def __init__(self, modelo, coluna):
+        self.modelo = modelo
+        self.coluna = getattr(modelo, coluna)
+        self.pk = getattr(modelo, modelo.__table__.primary_key.columns.keys()[0])
+        self._nomes = {}
+        self._termos = []
+        self._carregado = False
+        self._pendentes = set()
+        self._lock = threading.Lock()
+
+    def marcar(self, ids):
+        with self._lock:
+            if ids is None:
+                self._carregado = False
+            else:
+                self._pendentes.update(ids)
+
+    def _remover(self, id_registro):
+        nome = self._nomes.pop(id_registro, None)
+        if nome is None:
+            return
+        for termo in _sufixos(nome):
+            posicao = bisect.bisect_left(self._termos, (termo, id_registro))
+            if posicao < len(self._termos) and self._termos[posicao] == (termo, id_registro):
+                del self._termos[posicao]
+
+    def _inserir(self, id_registro, nome):
+        self._nomes[id_registro] = nome
+        for termo in _sufixos(nome):
+            bisect.insort(self._termos, (termo, id_registro))
+
+    def _atualizar(self):
+        if not self._carregado:
+            linhas = db.session.query(self.pk, self.coluna).all()
+            self._nomes = {id_registro: nome or '' for id_registro, nome in linhas}
+            self._termos = sorted(
+                (termo, id_registro) for id_registro, nome in self._nomes.items() for termo in _sufixos(nome)
+            )
+            self._pendentes.clear()
+            self._carregado = True
+            logger.info(f'LOOKUP: Índice de {self.modelo.__tablename__} carregado ({len(self._nomes)} registros).')
+            return
+        if self._pendentes:
+            ids = list(self._pendentes)
+            self._pendentes.clear()
+            atuais = dict(db.session.query(self.pk, self.coluna).filter(self.pk.in_(ids)))
+            for id_registro in ids:
+                self._remover(id_registro)
+                if id_registro in atuais:
+                    self._inserir(id_registro, atuais[id_registro] or '')
+
+    def buscar(self, texto, limite):
+        prefixo = ' '.join(normalizar(texto).split())
+        with self._lock:
+            self._atualizar()
+            encontrados = []
+            if prefixo.isdigit() and int(prefixo) in self._nomes:
+                encontrados.append(int(prefixo))
+            posicao = bisect.bisect_left(self._termos, (prefixo,))
+            while len(encontrados) < limite and posicao < len(self._termos):
+                termo, id_registro = self._termos[posicao]
+                if not termo.startswith(prefixo):
+                    break
+                if id_registro not in encontrados:
+                    encontrados.append(id_registro)
+                posicao += 1
+            return [{'id': id_registro, 'nome': self._nomes[id_registro]} for id_registro in encontrados]
+
+
+class Busca:
+    """Índices por (esquema, entidade), criados na primeira busca de cada escola"""
+
+    def __init__(self, app=None):
+        self.indices = {}
+        self._lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.extensions['busca'] = self
+        if app.config['NOTIFICACOES_ATIVAS']:
+            barramento.assinar(self._alteracao)
+
+    def _indice(self, entidade):
+        chave = (escolas.esquema_atual(), entidade)
+        with self._lock:
+            indice = self.indices.get(chave)
+            if indice is None:
+                indice = self.indices[chave] = IndiceNomes(*ENTIDADES_BUSCA[entidade])
+            return indice
+
+    def _alteracao(self, evento):
+        with self._lock:
+            indices = list(self.indices.items())
+        if evento.get('entidade') is None:
+            for _, indice in indices:
+                indice.marcar(None)
+            return
+        esquema = evento.get('esquema', ESQUEMA_PADRAO)
+        for (esquema_indice, _), indice in indices:
+            if esquema_indice == esquema and indice.modelo.__tablename__ == evento['entidade']:
+                indice.marcar(evento.get('ids'))
+
+    def buscar(self, entidade, texto, limite):
+        indice = self._indice(entidade)
+        if barramento.conectado.is_set():
+            return indice.buscar(texto, limite)
+        # Sem o LISTEN o índice não saberia das alterações de outros processos: consulta direta
+        prefixo = texto.strip().replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+        linhas = (
+            db.session.query(indice.pk, indice.coluna)
+            .filter(indice.coluna.ilike(f'{prefixo}%', escape='\\'))
+            .order_by(indice.coluna)
+            .limit(limite)
+        )
+        return [{'id': id_registro, 'nome': nome} for id_registro, nome in linhas]
+
+
+busca = Busca()
@@ -0,0 +1,164 @@
+import logging
+import threading
+import time
+from collections import OrderedDict, defaultdict
+
+import sqlalchemy as sa
+from flask import g, render_template, request
+from markupsafe import Markup
+
+from escolas import ESQUEMA_PADRAO, escolas
+from metricas import CACHE_HTML
+from notificacoes import barramento
+
+logger = logging.getLogger(__name__)
+
+# Tabelas de associação cujas alterações mudam as linhas de outra entidade (IDs já vêm convertidos)
+LINHAS_RELACIONADAS = {'atividade_aluno': 'atividade'}
+
+
+class CacheHTML:
+    """Cache em memória das páginas renderizadas e das linhas das tabelas, invalidado por versão.
+
+    Recebe do barramento tanto os NOTIFY do banco quanto os commits do próprio processo, então a
+    página logo após um formulário já reflete a escrita.
+
+    Cada entidade tem uma versão (qualquer alteração) e uma geração (alteração sem IDs conhecidos);
+    cada linha tem a própria versão. Tudo é separado por esquema, então escolas diferentes nunca
+    compartilham entradas. As chaves incluem essas versões, então invalidar é só incrementar
+    um contador: entradas antigas deixam de ser encontradas e saem pelo LRU.
+    """
+
+    def __init__(self, app=None):
+        self._itens = OrderedDict()
+        self._lock = threading.Lock()
+        self._versoes = defaultdict(int)
+        self._geracoes = defaultdict(int)
+        self._linhas = defaultdict(int)
+        self.ativo = False
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.extensions['cache_html'] = self
+        # Sem o LISTEN/NOTIFY outros processos não teriam como invalidar o cache
+        self.ativo = app.config['CACHE_HTML_ATIVO'] and app.config['NOTIFICACOES_ATIVAS']
+        self._max_itens = app.config['CACHE_HTML_MAX_ITENS']
+        self._ttl = app.config['CACHE_HTML_TTL']
+        if self.ativo:
+            barramento.assinar(self.invalidar)
+
+    def _disponivel(self):
+        if not (self.ativo and barramento.conectado.is_set()):
+            return False
+        # O que é guardado fica válido até o próximo NOTIFY; lido de uma réplica atrasada, ficaria
+        # guardado já sob a versão nova. Com o cache ativo as listagens leem do primário.
+        g.usar_replica = False
+        return True
+
+    def invalidar(self, evento):
+        entidade, ids = evento.get('entidade'), evento.get('ids')
+        if entidade is None:
+            self.limpar()
+            return
+        esquema = evento.get('esquema', ESQUEMA_PADRAO)
+        with self._lock:
+            self._versoes[(esquema, entidade)] += 1
+            relacionada = LINHAS_RELACIONADAS.get(entidade)
+            if relacionada is not None:
+                self._versoes[(esquema, relacionada)] += 1
+            elif evento.get('operacao') == 'DELETE':
+                # Linhas excluídas somem da listagem; as demais continuam iguais
+                return
+            alvo = relacionada or entidade
+            if ids is None:
+                self._geracoes[(esquema, alvo)] += 1
+            else:
+                for id_linha in ids:
+                    self._linhas[(esquema, alvo, id_linha)] += 1
+
+    def limpar(self):
+        with self._lock:
+            self._itens.clear()
+            self._versoes.clear()
+            self._geracoes.clear()
+            self._linhas.clear()
+
+    def _obter(self, chave):
+        with self._lock:
+            item = self._itens.get(chave)
+            if item is None:
+                return None
+            valor, expira_em = item
+            if time.monotonic() > expira_em:
+                del self._itens[chave]
+                return None
+            self._itens.move_to_end(chave)
+            return valor
+
+    def _guardar(self, chave, valor):
+        with self._lock:
+            self._itens[chave] = (valor, time.monotonic() + self._ttl)
+            self._itens.move_to_end(chave)
+            while len(self._itens) > self._max_itens:
+                self._itens.popitem(last=False)
+
+    def pagina(self, dependencias, renderizar):
+        """HTML da página atual (rota + query string), renderizado de novo só quando alguma
+        entidade em `dependencias` mudou. Exceções de `renderizar` não são guardadas."""
+        if not self._disponivel():
+            return renderizar()
+        esquema = escolas.esquema_atual()
+        chave = ('pagina', esquema, request.endpoint, request.full_path,
+                 tuple(self._versoes[(esquema, entidade)] for entidade in dependencias))
+        html = self._obter(chave)
+        if html is not None:
+            CACHE_HTML.labels('pagina', 'acerto', escolas.rotulo()).inc()
+            return html
+        CACHE_HTML.labels('pagina', 'falha', escolas.rotulo()).inc()
+        html = renderizar()
+        self._guardar(chave, html)
+        return html
+
+    def linhas(self, modelo, template, nome, opcoes=(), dependencias=()):
+        """Linhas <tr> renderizadas de todos os registros do modelo, em ordem de chave primária.
+
+        Consulta só os IDs; os objetos são carregados (com `opcoes`) e renderizados apenas para as
+        linhas que mudaram desde a última vez. `dependencias` são entidades exibidas na linha
+        (ex.: o nome da turma na linha do aluno)."""
+        entidade = modelo.__tablename__
+        pk = sa.inspect(modelo).primary_key[0]
+        if not self._disponivel():
+            registros = modelo.query.options(*opcoes).order_by(pk).all()
+            return [Markup(render_template(template, **{nome: registro})) for registro in registros]
+
+        ids = [id_linha for id_linha, in modelo.query.with_entities(pk).order_by(pk)]
+
+        esquema = escolas.esquema_atual()
+        externas = tuple(self._versoes[(esquema, dependencia)] for dependencia in dependencias)
+        geracao = self._geracoes[(esquema, entidade)]
+        chaves = {
+            id_linha: ('linha', esquema, template, id_linha, geracao,
+                       self._linhas[(esquema, entidade, id_linha)], externas)
+            for id_linha in ids
+        }
+        fragmentos = {}
+        for id_linha, chave in chaves.items():
+            html = self._obter(chave)
+            if html is not None:
+                fragmentos[id_linha] = html
+
+        faltando = [id_linha for id_linha in ids if id_linha not in fragmentos]
+        CACHE_HTML.labels('linha', 'acerto', escolas.rotulo()).inc(len(fragmentos))
+        CACHE_HTML.labels('linha', 'falha', escolas.rotulo()).inc(len(faltando))
+        if faltando:
+            for registro in modelo.query.options(*opcoes).filter(pk.in_(faltando)):
+                id_linha = getattr(registro, pk.key)
+                html = Markup(render_template(template, **{nome: registro}))
+                fragmentos[id_linha] = html
+                self._guardar(chaves[id_linha], html)
+        return [fragmentos[id_linha] for id_linha in ids if id_linha in fragmentos]
+
+
+cache_html = CacheHTML()
+
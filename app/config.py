@@ -1,3 +1,155 @@
+import os
+import tempfile
+
+
+def _lista_env(nome):
+    """Lê uma variável de ambiente separada por vírgulas como lista"""
+    return [valor.strip() for valor in os.environ.get(nome, '').split(',') if valor.strip()]
+
+
+def _mapa_env(nome):
+    """Lê "chave=valor,chave=valor" de uma variável de ambiente como dicionário"""
+    return dict(item.split('=', 1) for item in _lista_env(nome))
+
+
+def _taxa_env(nome, padrao):
+    """Lê "taxa,rajada" de uma variável de ambiente"""
+    taxa, rajada = os.environ.get(nome, padrao).split(',')
+    return float(taxa), float(rajada)
+
+
 class Config:
-    SQLALCHEMY_DATABASE_URI = 'postgresql://postgres:postgres@db/escola'
-    SQLALCHEMY_TRACK_MODIFICATIONS = False
\ No newline at end of file
+    SQLALCHEMY_DATABASE_URI = os.environ.get('DATABASE_URL', 'postgresql://postgres:postgres@db/escola')
+    SQLALCHEMY_TRACK_MODIFICATIONS = False
+
+    # Réplicas de leitura (streaming replication) usadas pelas rotas GET
+    DATABASE_REPLICA_URLS = _lista_env('DATABASE_REPLICA_URLS')
+    # Atraso máximo tolerado (segundos) antes de uma réplica ser ignorada
+    REPLICA_MAX_LAG = float(os.environ.get('REPLICA_MAX_LAG', '5'))
+    # Intervalo mínimo (segundos) entre verificações de atraso de cada réplica
+    REPLICA_LAG_CHECK_INTERVAL = float(os.environ.get('REPLICA_LAG_CHECK_INTERVAL', '2'))
+    # Tempo máximo (segundos) para abrir uma conexão com uma réplica antes de considerá-la indisponível
+    REPLICA_CONNECT_TIMEOUT = int(os.environ.get('REPLICA_CONNECT_TIMEOUT', '2'))
+
+    # Worker de jobs em segundo plano (fila na tabela job)
+    JOB_WORKER_THREADS = int(os.environ.get('JOB_WORKER_THREADS', '2'))
+    JOB_POLL_INTERVAL = float(os.environ.get('JOB_POLL_INTERVAL', '1'))
+    # Tempo (segundos) sem renovação do arrendamento após o qual um job em execução é considerado abandonado
+    JOB_TIMEOUT = int(os.environ.get('JOB_TIMEOUT', '600'))
+    # Intervalo (segundos) entre renovações do arrendamento do job pelo worker que o executa
+    JOB_RENOVACAO = float(os.environ.get('JOB_RENOVACAO', '30'))
+    JOB_RETRY_BACKOFF = float(os.environ.get('JOB_RETRY_BACKOFF', '5'))
+
+    # Linhas validadas por lote antes de cada COPY na importação em massa
+    IMPORT_CHUNK_SIZE = int(os.environ.get('IMPORT_CHUNK_SIZE', '10000'))
+
+    # Barramento de alterações via LISTEN/NOTIFY (invalidação de cache e SSE)
+    NOTIFICACOES_ATIVAS = os.environ.get('NOTIFICACOES_ATIVAS', '1') == '1'
+    NOTIFY_CHANNEL = 'escola_alteracoes'  # mesmo canal usado em InfraBD/notificacoes.sql
+    # Intervalo (segundos) entre comentários de keep-alive no stream SSE
+    SSE_HEARTBEAT = float(os.environ.get('SSE_HEARTBEAT', '15'))
+    # Clientes SSE simultâneos por processo no Flask (cada um ocupa uma thread; fique abaixo de WEB_THREADS).
+    # No modo assíncrono (asgi.py) o /eventos roda em corrotinas e não tem esse limite
+    SSE_MAX_CLIENTES = int(os.environ.get('SSE_MAX_CLIENTES', '4'))
+    # Espera (segundos) pedida ao navegador antes de reconectar quando o limite foi atingido
+    SSE_RETRY_LOTADO = float(os.environ.get('SSE_RETRY_LOTADO', '30'))
+
+    # Proxies à frente da aplicação (nginx do perfil "escala" = 1): o IP do cliente vem do último item
+    # do X-Forwarded-For acrescentado por eles; 0 usa o IP da conexão e ignora o cabeçalho
+    PROXIES_CONFIAVEIS = int(os.environ.get('PROXIES_CONFIAVEIS', '0'))
+    # Controle de admissão: token bucket por cliente/classe ("taxa por segundo,rajada")
+    ADMISSAO_ATIVA = os.environ.get('ADMISSAO_ATIVA', '1') == '1'
+    LIMITES_TAXA = {
+        'leitura': _taxa_env('RATE_LIMIT_LEITURA', '20,40'),
+        'cara': _taxa_env('RATE_LIMIT_CARA', '2,10'),
+        'escrita': _taxa_env('RATE_LIMIT_ESCRITA', '5,20'),
+    }
+    # Requisições caras (listagens, relatórios, exportações) simultâneas por processo
+    LIMITES_CONCORRENCIA = {'cara': int(os.environ.get('CONCORRENCIA_CARA', '4'))}
+    # Espera máxima (segundos) por uma vaga antes de responder 503
+    ORCAMENTO_LATENCIA = float(os.environ.get('ORCAMENTO_LATENCIA', '0.5'))
+
+    # Instrumentação de SQL por requisição
+    SLOW_QUERY_MS = float(os.environ.get('SLOW_QUERY_MS', '100'))
+    SLOW_REQUEST_MS = float(os.environ.get('SLOW_REQUEST_MS', '500'))
+    # Instruções SQL compiladas guardadas por engine (cache do SQLAlchemy; cada banco/escola tem o seu)
+    SQLALCHEMY_ENGINE_OPTIONS = {'query_cache_size': int(os.environ.get('SQL_CACHE_INSTRUCOES', '500'))}
+    # Token exigido pelas rotas /admin (vazio desativa as rotas)
+    ADMIN_TOKEN = os.environ.get('ADMIN_TOKEN', '')
+
+    # Rastreamento distribuído (OpenTelemetry, exportado via OTLP para o Tempo)
+    TRACING_ATIVO = os.environ.get('TRACING_ATIVO', '0') == '1'
+    TRACING_OTLP_ENDPOINT = os.environ.get('TRACING_OTLP_ENDPOINT', 'http://tempo:4318/v1/traces')
+    # Fração de traces iniciados aqui que são gravados (requisições com traceparent seguem a origem)
+    TRACING_SAMPLE_RATIO = float(os.environ.get('TRACING_SAMPLE_RATIO', '0.1'))
+    TRACING_SERVICE_NAME = os.environ.get('TRACING_SERVICE_NAME', 'escola-web')
+
+    # Prontidão (/saude/pronto): segundos em que o resultado do SELECT 1 é reaproveitado
+    READINESS_CACHE = float(os.environ.get('READINESS_CACHE', '1'))
+
+    # Cache em disco dos templates Jinja compilados, compartilhado entre workers e reinícios (vazio desativa)
+    JINJA_CACHE_DIR = os.environ.get('JINJA_CACHE_DIR', os.path.join(tempfile.gettempdir(), 'escola-jinja'))
+
+    # Cache das páginas de listagem e das linhas das tabelas, invalidado pelos NOTIFY do banco
+    CACHE_HTML_ATIVO = os.environ.get('CACHE_HTML_ATIVO', '1') == '1'
+    CACHE_HTML_MAX_ITENS = int(os.environ.get('CACHE_HTML_MAX_ITENS', '20000'))
+    # Validade máxima (segundos) de uma entrada, como rede de segurança
+    CACHE_HTML_TTL = float(os.environ.get('CACHE_HTML_TTL', '300'))
+
+    # Presenças e pagamentos pagos mais antigos que isso (dias) vão para o esquema "arquivo"
+    ARQUIVO_RETENCAO_DIAS = int(os.environ.get('ARQUIVO_RETENCAO_DIAS', '730'))
+
+    # Multi-escola: escola da requisição pelo cabeçalho X-Escola ou pelo domínio (tabela escola_catalogo)
+    ESCOLAS_ATIVAS = os.environ.get('ESCOLAS_ATIVAS', '0') == '1'
+    # Shards adicionais ("nome=url,nome=url"); o banco de DATABASE_URL é o shard "principal"
+    ESCOLAS_SHARDS = _mapa_env('ESCOLAS_SHARDS')
+    # Réplicas de leitura dos shards adicionais ("nome=url|url,nome=url"); as do principal vêm de DATABASE_REPLICA_URLS
+    ESCOLAS_SHARDS_REPLICAS = {shard: urls.split('|') for shard, urls in _mapa_env('ESCOLAS_SHARDS_REPLICAS').items()}
+    # Escola usada quando a requisição não identifica nenhuma (vazio responde 404)
+    ESCOLA_PADRAO = os.environ.get('ESCOLA_PADRAO', '')
+    # Intervalo (segundos) entre leituras do catálogo; também é a espera antes de mover uma escola
+    ESCOLAS_CATALOGO_TTL = float(os.environ.get('ESCOLAS_CATALOGO_TTL', '10'))
+    # Pool de conexões de cada escola e quantidade máxima de pools abertos por processo
+    ESCOLAS_POOL_SIZE = int(os.environ.get('ESCOLAS_POOL_SIZE', '2'))
+    ESCOLAS_MAX_OVERFLOW = int(os.environ.get('ESCOLAS_MAX_OVERFLOW', '3'))
+    ESCOLAS_MAX_POOLS = int(os.environ.get('ESCOLAS_MAX_POOLS', '50'))
+
+    # Janela padrão (HH:MM) de GET /professores/<id>/disponibilidade
+    AGENDA_INICIO = os.environ.get('AGENDA_INICIO', '07:00')
+    AGENDA_FIM = os.environ.get('AGENDA_FIM', '19:00')
+
+    # Idempotency-Key em POST/PUT: segundos em que a resposta gravada é devolvida às repetições
+    IDEMPOTENCIA_TTL = int(os.environ.get('IDEMPOTENCIA_TTL', '86400'))
+
+    # Modo assíncrono (asgi.py): pool do asyncpg por banco/escola e threads que atendem as rotas do Flask
+    ASYNC_POOL_SIZE = int(os.environ.get('ASYNC_POOL_SIZE', '10'))
+    ASYNC_MAX_OVERFLOW = int(os.environ.get('ASYNC_MAX_OVERFLOW', '10'))
+    ASYNC_WSGI_THREADS = int(os.environ.get('ASYNC_WSGI_THREADS', '8'))
+    # Instruções preparadas no servidor guardadas por conexão do asyncpg (0 desativa, ex.: PgBouncer em modo transação)
+    ASYNC_INSTRUCOES_PREPARADAS = int(os.environ.get('ASYNC_INSTRUCOES_PREPARADAS', '100'))
+
+    # Autenticação (POST /auth/login): desligada mantém a API aberta como antes
+    AUTH_ATIVA = os.environ.get('AUTH_ATIVA', '0') == '1'
+    # Chave HMAC dos tokens, igual em todas as réplicas (vazio gera uma por processo)
+    AUTH_SEGREDO = os.environ.get('AUTH_SEGREDO', '')
+    # Validade (segundos) do token; também é quanto tempo uma revogação fica na lista
+    AUTH_TOKEN_TTL = int(os.environ.get('AUTH_TOKEN_TTL', '900'))
+    # Sem o LISTEN do banco, intervalo (segundos) entre releituras da lista de revogação
+    AUTH_REVOGACOES_TTL = float(os.environ.get('AUTH_REVOGACOES_TTL', '5'))
+    # Custo do scrypt das senhas; hashes com outro custo são refeitos no próximo login
+    SENHA_SCRYPT_N = int(os.environ.get('SENHA_SCRYPT_N', '16384'))
+    SENHA_SCRYPT_R = int(os.environ.get('SENHA_SCRYPT_R', '8'))
+    SENHA_SCRYPT_P = int(os.environ.get('SENHA_SCRYPT_P', '1'))
+
+    # Documentos em lote (.zip): processos que renderizam (0 = no próprio processo) e documentos por tarefa do pool
+    DOCUMENTOS_PROCESSOS = int(os.environ.get('DOCUMENTOS_PROCESSOS', '2'))
+    DOCUMENTOS_LOTE = int(os.environ.get('DOCUMENTOS_LOTE', '25'))
+
+    # Auditoria das escritas: gravada em lotes a cada AUDITORIA_INTERVALO segundos ou AUDITORIA_LOTE registros
+    AUDITORIA_ATIVA = os.environ.get('AUDITORIA_ATIVA', '1') == '1'
+    AUDITORIA_INTERVALO = float(os.environ.get('AUDITORIA_INTERVALO', '1'))
+    AUDITORIA_LOTE = int(os.environ.get('AUDITORIA_LOTE', '500'))
+    # Acima disso o commit que encheu o buffer grava os registros antes de seguir
+    AUDITORIA_MAX_PENDENTES = int(os.environ.get('AUDITORIA_MAX_PENDENTES', '20000'))
+    # Partições mensais mantidas criadas à frente (mês atual incluído)
+    AUDITORIA_MESES = int(os.environ.get('AUDITORIA_MESES', '3'))
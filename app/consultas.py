@@ -0,0 +1,33 @@
+import sqlalchemy as sa
+
+from models import db, Aluno, Professor, Turma
+
+# Consultas das rotas mais chamadas (listagens e totais da página inicial) como lambda_stmt: o SQLAlchemy
+# identifica cada instrução pelo código da lambda e a reaproveita, já montada e compilada, do cache do
+# engine. Os valores usados dentro das lambdas (ids, turmas do professor) viram parâmetros. Os GET por ID
+# usam db.session.get, que devolve o objeto do mapa de identidade sem ir ao banco e, quando vai, não
+# monta uma Query: o SELECT pela chave primária sai do mesmo cache.
+
+
+def instrucao_listagem(modelo, *opcoes, em=None):
+    """SELECT de `modelo` com os carregamentos `opcoes`; em=(coluna, valores) restringe a coluna IN valores"""
+    instrucao = sa.lambda_stmt(lambda: sa.select(modelo).options(*opcoes))
+    if em is not None:
+        coluna, valores = em
+        instrucao += lambda s: s.where(coluna.in_(valores))
+    return instrucao
+
+
+def listar(modelo, *opcoes, em=None):
+    """Objetos de `modelo` (ver instrucao_listagem) pela sessão da requisição"""
+    return db.session.scalars(instrucao_listagem(modelo, *opcoes, em=em)).all()
+
+
+def _contagem(modelo):
+    return sa.select(sa.func.count()).select_from(modelo).scalar_subquery()
+
+
+def totais_inicio():
+    """(turmas, professores, alunos) da página inicial em um SELECT só"""
+    instrucao = sa.lambda_stmt(lambda: sa.select(_contagem(Turma), _contagem(Professor), _contagem(Aluno)))
+    return tuple(db.session.execute(instrucao).one())
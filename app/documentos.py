@@ -0,0 +1,380 @@
+import calendar
+import multiprocessing
+import os
+import textwrap
+import threading
+import zipfile
+import zlib
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from datetime import date
+from itertools import islice
+
+import sqlalchemy as sa
+from jinja2 import Environment, FileSystemBytecodeCache, FileSystemLoader, select_autoescape
+
+from models import db, Aluno, Pagamento, Presenca, Professor, Turma
+
+PDF = 'application/pdf'
+HTML = 'text/html'
+FORMATOS = {'pdf': PDF, 'html': HTML}
+ZIP = 'application/zip'
+# Documento -> template HTML (o PDF é desenhado por _recibo_pdf/_frequencia_pdf com os mesmos dados)
+MODELOS = {'recibo': 'documentos/recibo.html', 'frequencia': 'documentos/frequencia.html'}
+ESCOLA = 'Escola Infantil'
+MESES = ('Janeiro', 'Fevereiro', 'Março', 'Abril', 'Maio', 'Junho', 'Julho', 'Agosto', 'Setembro',
+         'Outubro', 'Novembro', 'Dezembro')
+PASTA_TEMPLATES = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'templates')
+
+
+def moeda(valor):
+    if valor is None:
+        return '-'
+    return 'R$ ' + f'{valor:,.2f}'.replace(',', '_').replace('.', ',').replace('_', '.')
+
+
+def data_br(valor):
+    return valor.strftime('%d/%m/%Y') if valor else '-'
+
+
+def ler_mes(texto):
+    """(ano, mês) de "AAAA-MM" """
+    try:
+        ano, mes = (int(parte) for parte in texto.split('-'))
+        date(ano, mes, 1)
+    except (AttributeError, ValueError):
+        raise ValueError('mes deve estar no formato AAAA-MM') from None
+    return ano, mes
+
+
+def _limites_do_mes(ano, mes):
+    return date(ano, mes, 1), date(ano + mes // 12, mes % 12 + 1, 1)
+
+
+FILTROS = {'moeda': moeda, 'data': data_br}
+
+# Templates: um Environment por processo, e cada template é compilado uma vez e reaproveitado
+_ambiente = None
+_modelos = {}
+_cache_templates = None
+
+
+def _modelo(documento):
+    global _ambiente
+    modelo = _modelos.get(documento)
+    if modelo is None:
+        if _ambiente is None:
+            _ambiente = Environment(
+                loader=FileSystemLoader(PASTA_TEMPLATES), autoescape=select_autoescape(['html']), auto_reload=False,
+                bytecode_cache=FileSystemBytecodeCache(_cache_templates) if _cache_templates else None,
+            )
+            _ambiente.filters.update(FILTROS)
+        modelo = _modelos[documento] = _ambiente.get_template(MODELOS[documento])
+    return modelo
+
+
+class Pdf:
+    """PDF mínimo (texto em Helvetica e linhas), sem dependências: o suficiente para recibos e folhas
+    de frequência. Coordenadas em pontos, com y medido a partir do topo da página."""
+
+    def __init__(self, largura=595, altura=842):
+        self.largura, self.altura = largura, altura
+        self.paginas = []
+        self.nova_pagina()
+
+    def nova_pagina(self):
+        self._comandos = []
+        self.paginas.append(self._comandos)
+
+    def texto(self, x, y, texto, tamanho=10, negrito=False):
+        self._comandos.append(b'BT /F%d %d Tf %.1f %.1f Td (%s) Tj ET' % (
+            2 if negrito else 1, tamanho, x, self.altura - y, _escapar(texto)
+        ))
+
+    def linha(self, x1, y1, x2, y2, espessura=0.5):
+        self._comandos.append(b'%.1f w %.1f %.1f m %.1f %.1f l S' % (
+            espessura, x1, self.altura - y1, x2, self.altura - y2
+        ))
+
+    def gerar(self):
+        objetos = [
+            b'<< /Type /Catalog /Pages 2 0 R >>',
+            None,  # árvore de páginas, preenchida depois das páginas
+            b'<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica /Encoding /WinAnsiEncoding >>',
+            b'<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica-Bold /Encoding /WinAnsiEncoding >>',
+        ]
+        paginas = []
+        for comandos in self.paginas:
+            conteudo = zlib.compress(b'\n'.join(comandos))
+            objetos.append(b'<< /Length %d /Filter /FlateDecode >>\nstream\n%s\nendstream' % (len(conteudo), conteudo))
+            objetos.append(
+                b'<< /Type /Page /Parent 2 0 R /MediaBox [0 0 %d %d] /Resources << /Font << /F1 3 0 R /F2 4 0 R >> >> '
+                b'/Contents %d 0 R >>' % (self.largura, self.altura, len(objetos))
+            )
+            paginas.append(b'%d 0 R' % len(objetos))
+        objetos[1] = b'<< /Type /Pages /Kids [%s] /Count %d >>' % (b' '.join(paginas), len(paginas))
+
+        saida = bytearray(b'%PDF-1.4\n%\xe2\xe3\xcf\xd3\n')
+        posicoes = []
+        for numero, objeto in enumerate(objetos, 1):
+            posicoes.append(len(saida))
+            saida += b'%d 0 obj\n%s\nendobj\n' % (numero, objeto)
+        inicio_xref = len(saida)
+        saida += b'xref\n0 %d\n0000000000 65535 f \n' % (len(objetos) + 1)
+        saida += b''.join(b'%010d 00000 n \n' % posicao for posicao in posicoes)
+        saida += b'trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n' % (len(objetos) + 1, inicio_xref)
+        return bytes(saida)
+
+
+def _escapar(texto):
+    # Fontes padrão do PDF com WinAnsiEncoding (cp1252): cobre a acentuação do português
+    return str(texto).encode('cp1252', 'replace').replace(b'\\', b'\\\\').replace(b'(', b'\\(').replace(b')', b'\\)')
+
+
+def _recibo_pdf(recibo):
+    pdf = Pdf()
+    pdf.texto(50, 60, recibo['escola'], 16, negrito=True)
+    pdf.texto(50, 88, f"Recibo de pagamento nº {recibo['id_pagamento']:06d}", 13, negrito=True)
+    pdf.linha(50, 98, 545, 98)
+    corpo = (
+        f"Recebemos de {recibo['responsavel'] or '-'}, responsável pelo(a) aluno(a) {recibo['aluno']}, "
+        f"a quantia de {moeda(recibo['valor'])}, referente a {recibo['referencia'] or '-'}."
+    )
+    y = 130
+    for linha in textwrap.wrap(corpo, 88):
+        pdf.texto(50, y, linha, 11)
+        y += 16
+    y += 10
+    pdf.texto(50, y, f"Forma de pagamento: {recibo['forma_pagamento'] or '-'}", 11)
+    pdf.texto(50, y + 16, f"Data do pagamento: {data_br(recibo['data_pagamento'])}", 11)
+    pdf.linha(300, y + 90, 545, y + 90)
+    pdf.texto(300, y + 104, recibo['escola'], 9)
+    return pdf.gerar()
+
+
+def _frequencia_pdf(folha):
+    # Paisagem: nome do aluno, uma coluna por dia do mês e o total
+    pdf = Pdf(842, 595)
+    x_dias, largura_dia, altura_linha, topo, base = 200, 18, 14, 118, 560
+    x_total = x_dias + 31 * largura_dia + 6
+
+    def cabecalho():
+        pdf.texto(30, 40, folha['escola'], 14, negrito=True)
+        pdf.texto(30, 62, f"Frequência - {folha['turma']} - {MESES[folha['mes'] - 1]}/{folha['ano']}", 12, negrito=True)
+        pdf.texto(30, 80, f"Professor(a): {folha['professor'] or '-'}", 10)
+        pdf.texto(30, 104, 'Aluno', 8, negrito=True)
+        for dia in range(1, folha['dias'] + 1):
+            pdf.texto(x_dias + (dia - 1) * largura_dia + 3, 104, f'{dia:02d}', 7, negrito=True)
+        pdf.texto(x_total, 104, 'Pres.', 8, negrito=True)
+        pdf.linha(30, 108, 812, 108)
+
+    cabecalho()
+    y = topo
+    for aluno in folha['alunos']:
+        if y > base:
+            pdf.nova_pagina()
+            cabecalho()
+            y = topo
+        pdf.texto(30, y, aluno['nome'][:34], 8)
+        for dia, presente in aluno['marcas'].items():
+            pdf.texto(x_dias + (dia - 1) * largura_dia + 6, y, 'P' if presente else 'F', 8)
+        pdf.texto(x_total, y, f"{aluno['presentes']}/{len(aluno['marcas'])}", 8)
+        pdf.linha(30, y + 4, 812, y + 4, 0.2)
+        y += altura_linha
+    return pdf.gerar()
+
+
+_DESENHOS = {'recibo': _recibo_pdf, 'frequencia': _frequencia_pdf}
+
+
+def nome_arquivo(documento, dados, formato):
+    if documento == 'recibo':
+        return f"recibo-{dados['id_pagamento']:06d}.{formato}"
+    return f"frequencia-turma{dados['id_turma']}-{dados['ano']}-{dados['mes']:02d}.{formato}"
+
+
+def renderizar(documento, formato, dados):
+    """Bytes de um documento ('recibo' ou 'frequencia') em 'pdf' ou 'html'"""
+    if formato == 'pdf':
+        return _DESENHOS[documento](dados)
+    return _modelo(documento).render(meses=MESES, **{documento: dados}).encode('utf-8')
+
+
+def renderizar_lote(documento, formato, lote):
+    """[(nome do arquivo, bytes)] de um lote de documentos; executado nos processos do pool"""
+    return [(nome_arquivo(documento, dados, formato), renderizar(documento, formato, dados)) for dados in lote]
+
+
+def _iniciar_processo(cache_templates):
+    # Compila os templates antes do primeiro lote (ou lê o bytecode já gravado pelo servidor em
+    # JINJA_CACHE_DIR); os lotes seguintes reaproveitam os mesmos objetos
+    global _cache_templates
+    _cache_templates = cache_templates
+    for documento in MODELOS:
+        _modelo(documento)
+
+
+class _Fluxo:
+    """Destino do ZipFile que acumula os bytes escritos até o gerador entregá-los ao cliente"""
+
+    def __init__(self):
+        self.partes = []
+
+    def write(self, dados):
+        self.partes.append(bytes(dados))
+        return len(dados)
+
+    def flush(self):
+        pass
+
+    def esvaziar(self):
+        partes, self.partes = self.partes, []
+        return partes
+
+
+class Documentos:
+    """Recibos e folhas de frequência em PDF ou HTML; os lotes (.zip) são renderizados em um pool de processos"""
+
+    def __init__(self, app=None):
+        self.processos = 0
+        self.tamanho_lote = 50
+        self.cache_templates = None
+        self._pool = None
+        self._pool_pid = None
+        self._lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.extensions['documentos'] = self
+        self.processos = app.config['DOCUMENTOS_PROCESSOS']
+        self.tamanho_lote = app.config['DOCUMENTOS_LOTE']
+        self.cache_templates = app.config['JINJA_CACHE_DIR'] or None
+        # templates/documentos também é compilado pelo Environment do Flask (estaticos.py)
+        app.jinja_env.filters.update(FILTROS)
+
+    def _executor(self):
+        # Criado sob demanda em cada processo do servidor. spawn: os filhos não herdam threads,
+        # conexões do banco nem locks do processo pai
+        with self._lock:
+            if self._pool is None or self._pool_pid != os.getpid():
+                self._pool = ProcessPoolExecutor(
+                    max_workers=self.processos, mp_context=multiprocessing.get_context('spawn'),
+                    initializer=_iniciar_processo, initargs=(self.cache_templates,),
+                )
+                self._pool_pid = os.getpid()
+            return self._pool
+
+    def zip(self, documento, formato, dados, contar=None):
+        """Bytes de um .zip com um arquivo por item de `dados`, entregues à medida que ficam prontos.
+
+        Os itens são renderizados em lotes de DOCUMENTOS_LOTE no pool, com no máximo 2 lotes por processo
+        em andamento (memória limitada mesmo com milhares de documentos); os arquivos saem na ordem de
+        `dados`. Com DOCUMENTOS_PROCESSOS=0 tudo é renderizado no próprio processo."""
+        fluxo = _Fluxo()
+        executor = self._executor() if self.processos > 0 else None
+        pendentes = deque()
+        compressao = zipfile.ZIP_STORED if formato == 'pdf' else zipfile.ZIP_DEFLATED  # o PDF já vem comprimido
+        try:
+            with zipfile.ZipFile(fluxo, 'w', compressao) as arquivo:
+                def gravar(arquivos):
+                    for nome, conteudo in arquivos:
+                        arquivo.writestr(nome, conteudo)
+                    if contar is not None:
+                        contar(len(arquivos))
+                    return fluxo.esvaziar()
+
+                itens = iter(dados)
+                while True:
+                    lote = list(islice(itens, self.tamanho_lote))
+                    if not lote:
+                        break
+                    if executor is None:
+                        yield from gravar(renderizar_lote(documento, formato, lote))
+                        continue
+                    pendentes.append(executor.submit(renderizar_lote, documento, formato, lote))
+                    if len(pendentes) >= 2 * self.processos:
+                        yield from gravar(pendentes.popleft().result())
+                while pendentes:
+                    yield from gravar(pendentes.popleft().result())
+            yield from fluxo.esvaziar()
+        finally:
+            # Cliente desconectado: os lotes que ainda não começaram não são renderizados
+            for futuro in pendentes:
+                futuro.cancel()
+
+
+documentos = Documentos()
+
+
+# Dados dos documentos, lidos do banco no processo do servidor (os filhos só renderizam)
+def recibos(mes=None, referencia=None, ids=None):
+    """Dados dos recibos de pagamentos pagos, por mês do pagamento, referência ou IDs, em lotes do banco"""
+    consulta = (
+        sa.select(
+            Pagamento.id_pagamento, Aluno.nome_completo, Aluno.nome_responsavel, Pagamento.referencia,
+            Pagamento.valor_pago, Pagamento.data_pagamento, Pagamento.forma_pagamento,
+        )
+        .join(Aluno, Aluno.id_aluno == Pagamento.id_aluno)
+        .where(Pagamento.status == 'Pago')
+        .order_by(Pagamento.id_pagamento)
+    )
+    if mes is not None:
+        inicio, fim = _limites_do_mes(*mes)
+        consulta = consulta.where(Pagamento.data_pagamento >= inicio, Pagamento.data_pagamento < fim)
+    if referencia is not None:
+        consulta = consulta.where(Pagamento.referencia == referencia)
+    if ids is not None:
+        consulta = consulta.where(Pagamento.id_pagamento.in_(ids))
+    for id_pagamento, aluno, responsavel, ref, valor, data_pagamento, forma in db.session.execute(
+        consulta.execution_options(yield_per=1000)
+    ):
+        yield {
+            'escola': ESCOLA, 'id_pagamento': id_pagamento, 'aluno': aluno, 'responsavel': responsavel,
+            'referencia': ref, 'valor': valor, 'data_pagamento': data_pagamento, 'forma_pagamento': forma,
+        }
+
+
+def folhas_frequencia(ano, mes, turmas=None):
+    """Folhas de frequência do mês por turma (todas ou as de `turmas`): três consultas ao todo"""
+    inicio, fim = _limites_do_mes(ano, mes)
+    consulta = (
+        sa.select(Turma.id_turma, Turma.nome_turma, Professor.nome_completo)
+        .outerjoin(Professor, Professor.id_professor == Turma.id_professor)
+        .order_by(Turma.id_turma)
+    )
+    if turmas is not None:
+        consulta = consulta.where(Turma.id_turma.in_(turmas))
+    linhas_turmas = db.session.execute(consulta).all()
+    ids_turmas = [linha.id_turma for linha in linhas_turmas]
+    if not ids_turmas:
+        return []
+
+    alunos = {}
+    por_turma = {id_turma: [] for id_turma in ids_turmas}
+    for id_aluno, nome, id_turma in db.session.execute(
+        sa.select(Aluno.id_aluno, Aluno.nome_completo, Aluno.id_turma)
+        .where(Aluno.id_turma.in_(ids_turmas))
+        .order_by(Aluno.nome_completo, Aluno.id_aluno)
+    ):
+        alunos[id_aluno] = {'nome': nome or '-', 'marcas': {}, 'presentes': 0}
+        por_turma[id_turma].append(alunos[id_aluno])
+    for id_aluno, data_presenca, presente in db.session.execute(
+        sa.select(Presenca.id_aluno, Presenca.data_presenca, Presenca.presente)
+        .join(Aluno, Aluno.id_aluno == Presenca.id_aluno)
+        .where(Aluno.id_turma.in_(ids_turmas), Presenca.data_presenca >= inicio, Presenca.data_presenca < fim)
+    ):
+        aluno = alunos[id_aluno]
+        aluno['marcas'][data_presenca.day] = bool(presente)
+        aluno['presentes'] += bool(presente)
+
+    dias = calendar.monthrange(ano, mes)[1]
+    return [
+        {
+            'escola': ESCOLA, 'id_turma': id_turma, 'turma': nome_turma, 'professor': professor,
+            'ano': ano, 'mes': mes, 'dias': dias, 'alunos': [
+                dict(aluno, marcas=dict(sorted(aluno['marcas'].items()))) for aluno in por_turma[id_turma]
+            ],
+        }
+        for id_turma, nome_turma, professor in linhas_turmas
+    ]
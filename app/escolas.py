@@ -0,0 +1,208 @@
+import logging
+import re
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+
+import sqlalchemy as sa
+from flask import current_app, g, has_app_context, jsonify, request
+
+import rastreamento
+from admissao import LIVRE
+from metricas import POOLS_ESCOLAS
+
+logger = logging.getLogger(__name__)
+
+# Esquema das tabelas sem multi-escola (e de uma escola registrada com --esquema public)
+ESQUEMA_PADRAO = 'public'
+# Nome do shard do banco configurado em DATABASE_URL
+SHARD_PRINCIPAL = 'principal'
+SLUG_VALIDO = re.compile(r'^[a-z0-9_]{1,40}$')
+ESQUEMA_VALIDO = re.compile(r'^[a-z_][a-z0-9_]{0,50}$')
+
+# Catálogo das escolas, sempre no banco principal (fora do db.metadata para não ser criado em cada esquema)
+metadata = sa.MetaData()
+catalogo = sa.Table(
+    'escola_catalogo', metadata,
+    sa.Column('slug', sa.String(40), primary_key=True),
+    sa.Column('esquema', sa.String(63), nullable=False, unique=True),
+    sa.Column('shard', sa.String(50), nullable=False, server_default=SHARD_PRINCIPAL),
+    sa.Column('dominio', sa.String(255), unique=True),
+    sa.Column('status', sa.String(20), nullable=False, server_default='ativa'),
+    sa.CheckConstraint("status IN ('ativa', 'migrando')"),
+    schema='public'
+)
+
+
+def esquema_da_escola(slug):
+    return f'escola_{slug}'
+
+
+def esquema_arquivo(esquema):
+    """Esquema do histórico arquivado da escola (o esquema "arquivo" dos modelos é traduzido para ele)"""
+    return 'arquivo' if esquema == ESQUEMA_PADRAO else f'{esquema}_arquivo'
+
+
+class Escolas:
+    """Resolve a escola de cada requisição e mantém um pool de conexões por escola.
+
+    Cada escola é um esquema em um dos shards (bancos) configurados; o catálogo diz qual. As
+    conexões do pool da escola usam search_path no esquema dela, então modelos e SQL sem esquema
+    explícito funcionam sem alteração."""
+
+    def __init__(self, app=None):
+        self.ativo = False
+        self.shards = {}
+        self.replicas = {}
+        self._catalogo = None
+        self._carregado_em = 0.0
+        self._engines = OrderedDict()
+        self._lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.extensions['escolas'] = self
+        self.ativo = app.config['ESCOLAS_ATIVAS']
+        self._config = app.config
+        self.shards = {SHARD_PRINCIPAL: app.config['SQLALCHEMY_DATABASE_URI'], **app.config['ESCOLAS_SHARDS']}
+        self.replicas = {SHARD_PRINCIPAL: app.config['DATABASE_REPLICA_URLS'], **app.config['ESCOLAS_SHARDS_REPLICAS']}
+        if self.ativo:
+            app.before_request(self._resolver)
+            logger.info(f'ESCOLAS: Multi-escola ativa com {len(self.shards)} shard(s).')
+
+    def _resolver(self):
+        """Escola pelo cabeçalho X-Escola, pelo domínio da requisição ou ESCOLA_PADRAO"""
+        slug = request.headers.get('X-Escola')
+        escola = self.identificar(slug, request.host)
+        if escola is None:
+            view = current_app.view_functions.get(request.endpoint)
+            if getattr(view, '_classe_rota', None) == LIVRE:
+                # Saúde, métricas e estáticos não dependem da escola
+                return None
+            logger.warning(f'ESCOLAS: Escola não identificada ({slug or request.host}).')
+            return jsonify({'error': 'Escola não encontrada'}), 404
+
+        if escola['status'] == 'migrando' and request.method not in ('GET', 'HEAD'):
+            resposta = jsonify({'error': 'Escola em migração, tente novamente em instantes'})
+            resposta.status_code = 503
+            resposta.headers['Retry-After'] = '30'
+            return resposta
+        g.escola = escola
+
+    def identificar(self, slug, host):
+        """Escola do slug (X-Escola) ou, sem ele, do domínio; ESCOLA_PADRAO quando o domínio não é de nenhuma"""
+        catalogo_atual = self.catalogo()
+        if slug:
+            return catalogo_atual['slugs'].get(slug)
+        return (
+            catalogo_atual['dominios'].get(host.split(':')[0].lower())
+            or catalogo_atual['slugs'].get(self._config['ESCOLA_PADRAO'])
+        )
+
+    def catalogo_vencido(self):
+        """True quando a próxima chamada a catalogo() vai ao banco"""
+        return self._catalogo is None or time.monotonic() - self._carregado_em >= self._config['ESCOLAS_CATALOGO_TTL']
+
+    def catalogo(self, recarregar=False):
+        """Escolas registradas ({'slugs': {...}, 'dominios': {...}}), relidas a cada ESCOLAS_CATALOGO_TTL segundos"""
+        ttl = self._config['ESCOLAS_CATALOGO_TTL']
+        if not recarregar and self._catalogo is not None and time.monotonic() - self._carregado_em < ttl:
+            return self._catalogo
+        with self._lock:
+            if not recarregar and self._catalogo is not None and time.monotonic() - self._carregado_em < ttl:
+                return self._catalogo
+            try:
+                with current_app.extensions['sqlalchemy'].engine.connect() as conexao:
+                    linhas = conexao.execute(sa.select(catalogo)).mappings().all()
+            except Exception as e:
+                if self._catalogo is None or recarregar:
+                    raise
+                # Banco principal fora do ar: segue com o catálogo anterior até a próxima tentativa
+                logger.warning(f'ESCOLAS: Falha ao recarregar o catálogo, usando o anterior - {e}')
+                self._carregado_em = time.monotonic()
+                return self._catalogo
+
+            slugs = {linha['slug']: dict(linha) for linha in linhas}
+            self._catalogo = {
+                'slugs': slugs,
+                'dominios': {escola['dominio'].lower(): escola for escola in slugs.values() if escola['dominio']}
+            }
+            self._carregado_em = time.monotonic()
+            return self._catalogo
+
+    def todas(self):
+        return list(self.catalogo()['slugs'].values())
+
+    def engine(self, escola, replica=None):
+        """Engine do esquema da escola no seu shard (ou na réplica de índice `replica` do shard), com pool
+        próprio (no máximo ESCOLAS_MAX_POOLS abertos)"""
+        chave = (escola['shard'], escola['esquema'], replica)
+        with self._lock:
+            engine = self._engines.get(chave)
+            if engine is not None:
+                self._engines.move_to_end(chave)
+                return engine
+
+            if escola['shard'] not in self.shards:
+                raise RuntimeError(f"Shard desconhecido: {escola['shard']}")
+            url = self.shards[escola['shard']] if replica is None else self.replicas[escola['shard']][replica]
+            opcoes = dict(self._config.get('SQLALCHEMY_ENGINE_OPTIONS', {}))
+            opcoes.setdefault('pool_size', self._config['ESCOLAS_POOL_SIZE'])
+            opcoes.setdefault('max_overflow', self._config['ESCOLAS_MAX_OVERFLOW'])
+            opcoes.setdefault('pool_pre_ping', True)
+            connect_args = {'options': f"-csearch_path={escola['esquema']}"}
+            if replica is not None:
+                connect_args['connect_timeout'] = self._config['REPLICA_CONNECT_TIMEOUT']
+            engine = sa.create_engine(url, connect_args=connect_args, **opcoes)
+            # Pools criados sob demanda não estavam entre os engines instrumentados na inicialização
+            rastreamento.instrumentar(engine)
+            engine = engine.execution_options(schema_translate_map={'arquivo': esquema_arquivo(escola['esquema'])})
+            self._engines[chave] = engine
+
+            while len(self._engines) > self._config['ESCOLAS_MAX_POOLS']:
+                # Pool menos usado recentemente: as conexões livres são fechadas
+                _, antiga = self._engines.popitem(last=False)
+                antiga.dispose()
+            POOLS_ESCOLAS.set(len(self._engines))
+            return engine
+
+    def atual(self):
+        return g.get('escola') if has_app_context() else None
+
+    def engine_atual(self):
+        escola = self.atual()
+        return self.engine(escola) if escola is not None else None
+
+    def esquema_atual(self):
+        escola = self.atual()
+        return escola['esquema'] if escola is not None else ESQUEMA_PADRAO
+
+    def rotulo(self):
+        """Valor do rótulo "escola" das métricas"""
+        escola = self.atual()
+        return escola['slug'] if escola is not None else '-'
+
+    @contextmanager
+    def usar(self, slug):
+        """Executa o bloco (jobs, comandos) no banco da escola; usar no início do contexto de aplicação,
+        antes de a sessão abrir uma conexão"""
+        escola = self.catalogo()['slugs'][slug]
+        anterior = g.pop('escola', None)
+        g.escola = escola
+        try:
+            yield g.escola
+        finally:
+            g.pop('escola', None)
+            if anterior is not None:
+                g.escola = anterior
+
+    def dispose(self):
+        with self._lock:
+            while self._engines:
+                self._engines.popitem()[1].dispose()
+            POOLS_ESCOLAS.set(0)
+
+
+escolas = Escolas()
@@ -0,0 +1,94 @@
+import gzip
+import hashlib
+import logging
+import mimetypes
+import os
+
+from flask import Response, abort, request
+from jinja2 import FileSystemBytecodeCache
+
+from admissao import LIVRE, classe_rota
+
+logger = logging.getLogger(__name__)
+
+# Arquivos com o hash no nome nunca mudam de conteúdo: podem ficar um ano no cache do navegador
+CACHE_IMUTAVEL = 'public, max-age=31536000, immutable'
+# Abaixo disso a compressão não compensa o cabeçalho extra
+TAMANHO_MINIMO_GZIP = 512
+
+
+class Estaticos:
+    """Serve CSS/JS com o hash do conteúdo no nome, pré-comprimidos, e configura o cache de bytecode do Jinja"""
+
+    def __init__(self, app=None):
+        self.manifesto = {}
+        self._arquivos = {}
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.extensions['estaticos'] = self
+        self._carregar(app.static_folder)
+        app.jinja_env.globals['asset'] = self.url
+
+        @classe_rota(LIVRE)
+        def estaticos(nome):
+            return self.servir(nome)
+        app.add_url_rule('/estaticos/<path:nome>', 'estaticos', estaticos)
+
+        diretorio = app.config['JINJA_CACHE_DIR']
+        if diretorio:
+            os.makedirs(diretorio, exist_ok=True)
+            app.jinja_env.bytecode_cache = FileSystemBytecodeCache(diretorio)
+            # Compila (ou carrega do cache em disco) todos os templates antes da primeira requisição
+            for nome in app.jinja_env.list_templates(extensions=['html']):
+                app.jinja_env.get_template(nome)
+
+    def _carregar(self, pasta):
+        for raiz, _, arquivos in os.walk(pasta):
+            for arquivo in arquivos:
+                caminho = os.path.join(raiz, arquivo)
+                nome = os.path.relpath(caminho, pasta).replace(os.sep, '/')
+                with open(caminho, 'rb') as entrada:
+                    conteudo = entrada.read()
+
+                digest = hashlib.sha256(conteudo).hexdigest()[:12]
+                base, extensao = os.path.splitext(nome)
+                versionado = f'{base}.{digest}{extensao}'
+                comprimido = None
+                if len(conteudo) >= TAMANHO_MINIMO_GZIP:
+                    comprimido = gzip.compress(conteudo, compresslevel=9, mtime=0)
+
+                self.manifesto[nome] = versionado
+                self._arquivos[versionado] = {
+                    'conteudo': conteudo,
+                    'gzip': comprimido,
+                    'tipo': mimetypes.guess_type(nome)[0] or 'application/octet-stream',
+                    'etag': digest
+                }
+        logger.info(f'ESTATICOS: {len(self.manifesto)} arquivo(s) versionado(s).')
+
+    def url(self, nome):
+        """URL versionada de um arquivo de static/ (ex.: asset('css/escola.css'))"""
+        return f'/estaticos/{self.manifesto[nome]}'
+
+    def servir(self, nome):
+        arquivo = self._arquivos.get(nome)
+        if arquivo is None:
+            abort(404)
+
+        if request.if_none_match.contains_weak(arquivo['etag']):
+            resposta = Response(status=304)
+        elif arquivo['gzip'] is not None and 'gzip' in request.accept_encodings:
+            resposta = Response(arquivo['gzip'], mimetype=arquivo['tipo'])
+            resposta.headers['Content-Encoding'] = 'gzip'
+        else:
+            resposta = Response(arquivo['conteudo'], mimetype=arquivo['tipo'])
+        resposta.headers['Cache-Control'] = CACHE_IMUTAVEL
+        resposta.headers['Vary'] = 'Accept-Encoding'
+        # ETag fraca: o mesmo conteúdo é servido com e sem gzip
+        resposta.set_etag(arquivo['etag'], weak=True)
+        return resposta
+
+
+estaticos = Estaticos()
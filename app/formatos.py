@@ -0,0 +1,152 @@
+from datetime import date, datetime, time, timezone
+from decimal import Decimal
+from itertools import islice
+
+import sqlalchemy as sa
+from flask import Response, jsonify, request, stream_with_context
+
+from models import db
+
+JSON = 'application/json'
+MSGPACK = 'application/msgpack'
+ARROW = 'application/vnd.apache.arrow.stream'
+# ?formato= tem precedência sobre o Accept (útil em navegadores e ferramentas sem cabeçalhos)
+FORMATOS = {'json': JSON, 'msgpack': MSGPACK, 'arrow': ARROW}
+SINONIMOS = {'application/x-msgpack': MSGPACK}
+# Linhas por record batch do Arrow / por bloco enviado ao cliente
+LINHAS_POR_LOTE = 10000
+# Marcador de fim do formato de stream IPC do Arrow
+FIM_STREAM_ARROW = b'\xff\xff\xff\xff\x00\x00\x00\x00'
+
+
+def _disponivel(modulo):
+    try:
+        __import__(modulo)
+        return True
+    except ImportError:
+        return False
+
+
+def negociar():
+    """Formato da resposta pelo parâmetro ?formato= ou pelo Accept; JSON quando nenhum outro é pedido.
+
+    Devolve None se o formato pedido não existe ou a biblioteca dele não está instalada."""
+    pedido = request.args.get('formato')
+    if pedido:
+        tipo = FORMATOS.get(pedido)
+    else:
+        candidatos = [JSON, MSGPACK, ARROW, *SINONIMOS]
+        tipo = request.accept_mimetypes.best_match(candidatos, default=JSON)
+        tipo = SINONIMOS.get(tipo, tipo)
+    if tipo == MSGPACK and not _disponivel('msgpack'):
+        return None
+    if tipo == ARROW and not _disponivel('pyarrow'):
+        return None
+    return tipo
+
+
+def linhas_da_tabela(tabela, *condicoes):
+    """Tuplas da tabela (na ordem das colunas) lidas do banco em lotes, sem montar objetos ORM"""
+    consulta = sa.select(tabela).where(*condicoes).order_by(*tabela.primary_key.columns)
+    return db.session.execute(consulta.execution_options(yield_per=LINHAS_POR_LOTE))
+
+
+def _lotes(linhas, tamanho):
+    linhas = iter(linhas)
+    while True:
+        lote = list(islice(linhas, tamanho))
+        if not lote:
+            return
+        yield lote
+
+
+def _valor_msgpack(valor):
+    import msgpack
+    if isinstance(valor, datetime):
+        return msgpack.Timestamp.from_datetime(valor if valor.tzinfo else valor.replace(tzinfo=timezone.utc))
+    if isinstance(valor, date):
+        return msgpack.Timestamp.from_datetime(datetime.combine(valor, time(), tzinfo=timezone.utc))
+    if isinstance(valor, Decimal):
+        # Texto mantém o valor exato (msgpack não tem tipo decimal)
+        return str(valor)
+    if isinstance(valor, time):
+        return valor.isoformat()
+    raise TypeError(f'Tipo não suportado em MessagePack: {type(valor).__name__}')
+
+
+def _gerar_msgpack(colunas, linhas):
+    """Sequência de objetos MessagePack: a lista de colunas e depois uma lista de valores por linha"""
+    import msgpack
+    packer = msgpack.Packer(default=_valor_msgpack)
+    yield packer.pack([coluna.name for coluna in colunas])
+    for lote in _lotes(linhas, LINHAS_POR_LOTE):
+        yield b''.join(packer.pack(list(linha)) for linha in lote)
+
+
+def _tipo_arrow(tipo):
+    import pyarrow as pa
+    if isinstance(tipo, sa.Boolean):
+        return pa.bool_()
+    if isinstance(tipo, sa.SmallInteger):
+        return pa.int16()
+    if isinstance(tipo, sa.BigInteger):
+        return pa.int64()
+    if isinstance(tipo, sa.Integer):
+        return pa.int32()
+    if isinstance(tipo, sa.Float):
+        return pa.float64()
+    if isinstance(tipo, sa.Numeric):
+        return pa.decimal128(tipo.precision or 38, tipo.scale or 0)
+    if isinstance(tipo, sa.DateTime):
+        return pa.timestamp('us')
+    if isinstance(tipo, sa.Date):
+        return pa.date32()
+    if isinstance(tipo, sa.Time):
+        return pa.time64('us')
+    if isinstance(tipo, sa.LargeBinary):
+        return pa.binary()
+    return pa.string()
+
+
+def esquema_arrow(colunas):
+    import pyarrow as pa
+    return pa.schema([pa.field(coluna.name, _tipo_arrow(coluna.type)) for coluna in colunas])
+
+
+def _gerar_arrow(colunas, linhas):
+    """Stream IPC do Arrow: o esquema e um record batch a cada LINHAS_POR_LOTE linhas"""
+    import pyarrow as pa
+    esquema = esquema_arrow(colunas)
+    yield esquema.serialize().to_pybytes()
+    for lote in _lotes(linhas, LINHAS_POR_LOTE):
+        valores = list(zip(*lote))
+        batch = pa.record_batch(
+            [pa.array(coluna, type=campo.type) for coluna, campo in zip(valores, esquema)], schema=esquema
+        )
+        yield batch.serialize().to_pybytes()
+    yield FIM_STREAM_ARROW
+
+
+def resposta_tabular(formato, colunas, linhas):
+    """Resposta em fluxo com as linhas (tuplas na ordem de `colunas`) em MessagePack ou Arrow"""
+    gerar = _gerar_arrow if formato == ARROW else _gerar_msgpack
+    return Response(stream_with_context(gerar(colunas, linhas)), content_type=formato, headers={'Vary': 'Accept'})
+
+
+def resposta_negociada(colunas, linhas):
+    """Resposta em MessagePack/Arrow se o cliente pediu um deles (None quando a rota deve responder JSON).
+
+    `linhas` é chamada só quando o formato não é JSON e devolve as tuplas na ordem de `colunas`."""
+    formato = negociar()
+    if formato == JSON:
+        return None
+    if formato is None:
+        resposta = jsonify({'error': 'Formato não suportado', 'formatos': sorted(FORMATOS)})
+        resposta.status_code = 406
+        return resposta
+    return resposta_tabular(formato, colunas, linhas())
+
+
+def tabela_negociada(tabela, *condicoes):
+    """resposta_negociada com todas as linhas da tabela (filtradas por `condicoes`)"""
+    return resposta_negociada(list(tabela.columns), lambda: linhas_da_tabela(tabela, *condicoes))
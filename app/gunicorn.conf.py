@@ -0,0 +1,42 @@
+import os
+import signal
+
+# Configuração do gunicorn para as réplicas atrás do balanceador (perfil "escala" do docker-compose)
+bind = '0.0.0.0:5000'
+# Um processo por contêiner: métricas, controle de admissão e barramento são por processo;
+# a capacidade cresce adicionando réplicas, não workers
+workers = int(os.environ.get('WEB_CONCURRENCY', '1'))
+worker_class = 'gthread'
+# Cada cliente de /eventos ocupa uma thread: no perfil "escala" o nginx manda o SSE para o web-eventos
+# (uvicorn) e, chegando aqui, SSE_MAX_CLIENTES (abaixo de WEB_THREADS) limita os streams por processo
+threads = int(os.environ.get('WEB_THREADS', '8'))
+timeout = 60
+keepalive = 5
+# Tempo para concluir as requisições em andamento após o SIGTERM (menor que o stop_grace_period)
+graceful_timeout = int(os.environ.get('GRACEFUL_TIMEOUT', '25'))
+accesslog = '-'
+
+
+def post_worker_init(worker):
+    from saude import saude
+
+    encerrar = worker.handle_exit
+
+    def drenar(sig, frame):
+        # Prontidão passa a responder 503 e os streams SSE são fechados antes de o worker parar
+        saude.iniciar_drenagem()
+        encerrar(sig, frame)
+
+    signal.signal(signal.SIGTERM, drenar)
+
+
+def worker_exit(server, worker):
+    from models import db
+    from escolas import escolas
+    from app import app
+
+    # Devolve as conexões ao banco em vez de esperar o timeout do servidor
+    with app.app_context():
+        for engine in db.engines.values():
+            engine.dispose()
+    escolas.dispose()
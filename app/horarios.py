@@ -0,0 +1,203 @@
+import bisect
+import threading
+from datetime import time
+
+from models import db, HorarioTurma
+from escolas import ESQUEMA_PADRAO, escolas
+from notificacoes import barramento
+
+# dia_semana 0 = segunda, como date.weekday()
+DIAS_SEMANA = ['Seg', 'Ter', 'Qua', 'Qui', 'Sex', 'Sáb', 'Dom']
+# Código de erro do PostgreSQL para violação de restrição de exclusão
+EXCLUSAO_VIOLADA = '23P01'
+
+
+class ConflitoHorario(Exception):
+    """Aulas do professor que se sobrepõem aos horários pedidos"""
+
+    def __init__(self, conflitos):
+        super().__init__('Conflito de horário com outra turma do professor (' + ', '.join(
+            f"turma {c['id_turma']}: {DIAS_SEMANA[c['dia_semana']]} {c['inicio']}-{c['fim']}" for c in conflitos
+        ) + ')')
+        self.conflitos = conflitos
+
+
+def violou_exclusao(erro):
+    """IntegrityError causado pela exclusão de horario_turma (duas gravações concorrentes)"""
+    return getattr(getattr(erro, 'orig', None), 'pgcode', None) == EXCLUSAO_VIOLADA
+
+
+def ler_hora(texto):
+    if isinstance(texto, time):
+        return texto
+    try:
+        return time.fromisoformat(str(texto).strip())
+    except ValueError:
+        raise ValueError(f'Hora inválida: {texto} (use HH:MM)')
+
+
+def _minutos(hora):
+    return hora.hour * 60 + hora.minute
+
+
+def ler_horarios(itens):
+    """Valida [{"dia_semana", "inicio", "fim"}] e devolve [(dia, inicio, fim)] ordenados"""
+    horarios = []
+    for item in itens or []:
+        try:
+            dia = int(item['dia_semana'])
+        except (KeyError, TypeError, ValueError):
+            raise ValueError(f'dia_semana inválido em {item} (0 = segunda ... 6 = domingo)')
+        if not 0 <= dia <= 6:
+            raise ValueError(f'dia_semana inválido em {item} (0 = segunda ... 6 = domingo)')
+        inicio, fim = ler_hora(item.get('inicio')), ler_hora(item.get('fim'))
+        if inicio >= fim:
+            raise ValueError(f'Horário com início depois do fim: {item}')
+        horarios.append((dia, inicio, fim))
+    horarios.sort()
+    for (dia, _, fim), (proximo_dia, proximo_inicio, _) in zip(horarios, horarios[1:]):
+        if dia == proximo_dia and proximo_inicio < fim:
+            raise ValueError(f'Horários sobrepostos na {DIAS_SEMANA[dia]}')
+    return horarios
+
+
+def descrever(horarios, tamanho=100):
+    """Texto de Turma.horario a partir dos horários ("Seg/Qua 08:00-12:00, Sex 13:00-17:00")"""
+    faixas = {}
+    for dia, inicio, fim in horarios:
+        faixas.setdefault((inicio, fim), []).append(DIAS_SEMANA[dia])
+    texto = ', '.join(
+        f"{'/'.join(dias)} {inicio.strftime('%H:%M')}-{fim.strftime('%H:%M')}" for (inicio, fim), dias in faixas.items()
+    )
+    return texto if len(texto) <= tamanho else texto[:tamanho - 1] + '…'
+
+
+class IndiceProfessor:
+    """Aulas de um professor por dia: intervalos (inicio, fim, id_turma) ordenados pelo início.
+
+    A exclusão no banco garante que não se sobrepõem, então os fins também ficam em ordem e os
+    conflitos de um horário novo são achados com uma busca binária."""
+
+    def __init__(self, linhas):
+        self.dias = {}
+        for dia, inicio, fim, id_turma in sorted(linhas):
+            self.dias.setdefault(dia, []).append((inicio, fim, id_turma))
+
+    def conflitos(self, dia, inicio, fim, ignorar_turma=None):
+        intervalos = self.dias.get(dia, [])
+        # Primeira aula que começa no fim pedido ou depois; só as anteriores podem se sobrepor
+        posicao = bisect.bisect_left(intervalos, (fim,))
+        encontrados = []
+        while posicao > 0:
+            posicao -= 1
+            inicio_aula, fim_aula, id_turma = intervalos[posicao]
+            if fim_aula <= inicio:
+                break
+            if id_turma != ignorar_turma:
+                encontrados.append((dia, inicio_aula, fim_aula, id_turma))
+        return encontrados[::-1]
+
+    def livres(self, dia, inicio, fim, duracao=0):
+        """Intervalos livres do dia dentro de [inicio, fim) com pelo menos `duracao` minutos"""
+        livres = []
+        atual = inicio
+        for inicio_aula, fim_aula, _ in self.dias.get(dia, []):
+            if fim_aula <= atual:
+                continue
+            if inicio_aula >= fim:
+                break
+            if inicio_aula > atual:
+                livres.append((atual, inicio_aula))
+            atual = max(atual, fim_aula)
+        if atual < fim:
+            livres.append((atual, fim))
+        return [(a, b) for a, b in livres if _minutos(b) - _minutos(a) >= duracao]
+
+
+class Agenda:
+    """Índices de horários por (esquema, professor), carregados na primeira consulta de cada um"""
+
+    def __init__(self, app=None):
+        self.indices = {}
+        self._geracoes = {}
+        self._lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.extensions['agenda'] = self
+        app.jinja_env.globals['dias_semana'] = DIAS_SEMANA
+        if app.config['NOTIFICACOES_ATIVAS']:
+            barramento.assinar(self._alteracao)
+
+    def _alteracao(self, evento):
+        # Os IDs publicados são de turmas/horários, não de professores: descarta a escola inteira
+        if evento.get('entidade') not in (None, 'turma', 'horario_turma'):
+            return
+        with self._lock:
+            if evento.get('entidade') is None:
+                self.indices.clear()
+                self._geracoes = {esquema: geracao + 1 for esquema, geracao in self._geracoes.items()}
+                return
+            esquema = evento.get('esquema', ESQUEMA_PADRAO)
+            self._geracoes[esquema] = self._geracoes.get(esquema, 0) + 1
+            for chave in [chave for chave in self.indices if chave[0] == esquema]:
+                del self.indices[chave]
+
+    def _carregar(self, id_professor):
+        linhas = db.session.query(
+            HorarioTurma.dia_semana, HorarioTurma.inicio, HorarioTurma.fim, HorarioTurma.id_turma
+        ).filter(HorarioTurma.id_professor == id_professor).all()
+        return IndiceProfessor(linhas)
+
+    def indice(self, id_professor):
+        if not barramento.conectado.is_set():
+            # Sem o LISTEN o índice não saberia das alterações de outros processos: consulta direta
+            return self._carregar(id_professor)
+        esquema = escolas.esquema_atual()
+        chave = (esquema, id_professor)
+        with self._lock:
+            indice = self.indices.get(chave)
+            geracao = self._geracoes.get(esquema, 0)
+        if indice is not None:
+            return indice
+        indice = self._carregar(id_professor)
+        with self._lock:
+            # Alteração chegou durante a carga: usa o resultado, mas não o guarda
+            if self._geracoes.get(esquema, 0) == geracao:
+                self.indices[chave] = indice
+        return indice
+
+    def verificar(self, id_professor, horarios, ignorar_turma=None):
+        """Levanta ConflitoHorario se algum dos horários [(dia, inicio, fim)] ocupa o professor"""
+        if id_professor is None or not horarios:
+            return
+        indice = self.indice(id_professor)
+        conflitos = [
+            conflito for dia, inicio, fim in horarios
+            for conflito in indice.conflitos(dia, inicio, fim, ignorar_turma)
+        ]
+        if conflitos:
+            raise ConflitoHorario([
+                {'id_turma': id_turma, 'dia_semana': dia, 'inicio': inicio.strftime('%H:%M'), 'fim': fim.strftime('%H:%M')}
+                for dia, inicio, fim, id_turma in conflitos
+            ])
+
+    def disponibilidade(self, id_professor, dias, inicio, fim, duracao=0):
+        indice = self.indice(id_professor)
+        return [{
+            'dia_semana': dia,
+            'dia': DIAS_SEMANA[dia],
+            'disponivel': not indice.conflitos(dia, inicio, fim),
+            'ocupados': [
+                {'id_turma': id_turma, 'inicio': a.strftime('%H:%M'), 'fim': b.strftime('%H:%M')}
+                for a, b, id_turma in indice.dias.get(dia, []) if a < fim and b > inicio
+            ],
+            'livres': [
+                {'inicio': a.strftime('%H:%M'), 'fim': b.strftime('%H:%M')}
+                for a, b in indice.livres(dia, inicio, fim, duracao)
+            ],
+        } for dia in dias]
+
+
+agenda = Agenda()
@@ -0,0 +1,171 @@
+import hashlib
+import logging
+import zlib
+from datetime import datetime, timedelta
+
+import sqlalchemy as sa
+from flask import Response, current_app, g, jsonify, request
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+
+from metricas import IDEMPOTENCIA
+from models import db, ChaveIdempotencia
+from replicas import RoutingSession
+
+logger = logging.getLogger(__name__)
+
+CABECALHO = 'Idempotency-Key'
+METODOS = ('POST', 'PUT')
+TAMANHO_MAXIMO_CHAVE = 255
+
+
+def sem_idempotencia(view):
+    """Marca uma rota que ignora Idempotency-Key (ex.: corpo lido em fluxo, commits em lotes)"""
+    view._sem_idempotencia = True
+    return view
+
+
+def _assinatura():
+    """sha256 de método, caminho e corpo: a mesma chave com outra requisição é recusada"""
+    assinatura = hashlib.sha256(f'{request.method} {request.full_path}\n'.encode())
+    assinatura.update(request.get_data(cache=True))
+    return assinatura.digest()
+
+
+def _erro(status, mensagem, **cabecalhos):
+    resposta = jsonify({'error': mensagem})
+    resposta.status_code = status
+    resposta.headers.update(cabecalhos)
+    return resposta
+
+
+class Idempotencia:
+    """Repetições de POST/PUT com o mesmo Idempotency-Key recebem a resposta gravada da primeira execução.
+
+    A chave é reservada com INSERT ... ON CONFLICT na mesma transação da escrita: uma repetição
+    concorrente (em qualquer worker) espera no índice único até a original terminar. Se a original
+    confirma, a repetição encontra a chave; se desfaz, a repetição executa no lugar dela."""
+
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.extensions['idempotencia'] = self
+        app.before_request(self._reservar)
+        app.after_request(self._gravar)
+
+    def _reservar(self):
+        chave = request.headers.get(CABECALHO)
+        if not chave or request.method not in METODOS:
+            return None
+        view = current_app.view_functions.get(request.endpoint)
+        if view is None or getattr(view, '_sem_idempotencia', False):
+            return None
+        if len(chave) > TAMANHO_MAXIMO_CHAVE:
+            return _erro(400, f'{CABECALHO} deve ter no máximo {TAMANHO_MAXIMO_CHAVE} caracteres')
+
+        agora = datetime.utcnow()
+        assinatura = _assinatura()
+        valores = {
+            'chave': chave, 'assinatura': assinatura, 'status': None, 'content_type': None, 'corpo': None,
+            'criado_em': agora, 'expira_em': agora + timedelta(seconds=current_app.config['IDEMPOTENCIA_TTL']),
+        }
+        instrucao = pg_insert(ChaveIdempotencia).values(**valores)
+        # Chaves vencidas e ainda não removidas pela limpeza são reaproveitadas
+        instrucao = instrucao.on_conflict_do_update(
+            index_elements=['chave'],
+            set_={campo: valor for campo, valor in valores.items() if campo != 'chave'},
+            where=ChaveIdempotencia.expira_em < agora
+        ).returning(ChaveIdempotencia.chave)
+        if db.session.execute(instrucao).first() is not None:
+            # Reserva ainda não confirmada: vai junto com o commit da rota
+            db.session.info['idempotencia'] = chave
+            g.idempotencia_chave = chave
+            IDEMPOTENCIA.labels('nova').inc()
+            return None
+
+        existente = db.session.execute(
+            sa.select(
+                ChaveIdempotencia.assinatura, ChaveIdempotencia.status,
+                ChaveIdempotencia.content_type, ChaveIdempotencia.corpo
+            ).where(ChaveIdempotencia.chave == chave)
+        ).first()
+        db.session.rollback()
+        if existente is None:
+            # Removida entre o INSERT e a leitura (limpeza): o cliente pode repetir
+            return _erro(409, 'Requisição com esta chave em andamento', **{'Retry-After': '1'})
+        if existente.assinatura != assinatura:
+            IDEMPOTENCIA.labels('divergente').inc()
+            logger.warning(f'IDEMPOTENCIA: Chave {chave} reutilizada com outra requisição ({request.method} {request.path}).')
+            return _erro(422, f'{CABECALHO} já usada com outra requisição')
+        if existente.status is None:
+            IDEMPOTENCIA.labels('em_andamento').inc()
+            return _erro(409, 'Requisição com esta chave em andamento', **{'Retry-After': '1'})
+
+        IDEMPOTENCIA.labels('repetida').inc()
+        logger.info(f'IDEMPOTENCIA: Resposta gravada devolvida para a chave {chave} ({request.method} {request.path}).')
+        resposta = Response(zlib.decompress(existente.corpo) if existente.corpo else b'', status=existente.status,
+                            content_type=existente.content_type)
+        resposta.headers['Idempotent-Replayed'] = 'true'
+        return resposta
+
+    def _gravar(self, resposta):
+        chave = g.pop('idempotencia_chave', None)
+        if chave is None:
+            return resposta
+        confirmada = db.session.info.pop('idempotencia_confirmada', False)
+        db.session.info.pop('idempotencia', None)
+        valores = {
+            'status': resposta.status_code,
+            'content_type': resposta.content_type,
+            'corpo': b'' if resposta.is_streamed else zlib.compress(resposta.get_data()),
+        }
+        try:
+            if confirmada:
+                # A escrita já foi confirmada com a reserva: a resposta vale para as repetições, mesmo se for erro
+                db.session.execute(
+                    sa.update(ChaveIdempotencia).where(ChaveIdempotencia.chave == chave).values(**valores)
+                )
+            else:
+                # Nada confirmado: descarta a reserva; erros do servidor deixam o cliente tentar de novo
+                db.session.rollback()
+                if resposta.status_code >= 500:
+                    return resposta
+                agora = datetime.utcnow()
+                db.session.execute(pg_insert(ChaveIdempotencia).values(
+                    chave=chave, assinatura=_assinatura(), criado_em=agora,
+                    expira_em=agora + timedelta(seconds=current_app.config['IDEMPOTENCIA_TTL']), **valores
+                ).on_conflict_do_nothing())
+            db.session.commit()
+        except Exception as e:
+            db.session.rollback()
+            logger.error(f'IDEMPOTENCIA: Falha ao gravar a resposta da chave {chave} - {e}')
+        return resposta
+
+
+def limpar_vencidas(lote=1000):
+    """Remove chaves vencidas em lotes (cada lote em uma transação curta)"""
+    removidas = 0
+    while True:
+        vencidas = (
+            sa.select(ChaveIdempotencia.chave)
+            .where(ChaveIdempotencia.expira_em < datetime.utcnow())
+            .limit(lote)
+            .with_for_update(skip_locked=True)
+        )
+        quantidade = db.session.execute(
+            sa.delete(ChaveIdempotencia).where(ChaveIdempotencia.chave.in_(vencidas))
+        ).rowcount
+        db.session.commit()
+        removidas += quantidade
+        if quantidade < lote:
+            return removidas
+
+
+@sa.event.listens_for(RoutingSession, 'after_commit')
+def _confirmar_reserva(session):
+    if 'idempotencia' in session.info:
+        session.info['idempotencia_confirmada'] = True
+
+
+idempotencia = Idempotencia()
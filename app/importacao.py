@@ -0,0 +1,200 @@
+import csv
+import io
+import json
+import logging
+from datetime import date
+
+from sqlalchemy import text
+
+from models import db
+
+logger = logging.getLogger(__name__)
+
+# Quantidade máxima de rejeições detalhadas devolvidas no relatório
+MAX_ERROS_RELATORIO = 1000
+
+
+def texto(tamanho=None):
+    def converter(valor):
+        valor = str(valor).strip()
+        if tamanho and len(valor) > tamanho:
+            raise ValueError(f'excede {tamanho} caracteres')
+        return valor
+    return converter
+
+
+def inteiro(valor):
+    return int(valor)
+
+
+def data(valor):
+    # date.fromisoformat aceita apenas YYYY-MM-DD e é bem mais rápido que strptime
+    return date.fromisoformat(str(valor).strip()).isoformat()
+
+
+def booleano(valor):
+    if isinstance(valor, bool):
+        return 't' if valor else 'f'
+    valor = str(valor).strip().lower()
+    if valor in ('true', 't', '1', 'sim', 's'):
+        return 't'
+    if valor in ('false', 'f', '0', 'nao', 'não', 'n'):
+        return 'f'
+    raise ValueError('valor booleano inválido')
+
+
+# Para cada entidade: campos aceitos (nome, conversor, tipo na tabela de staging, obrigatório),
+# regra de rejeição por chave estrangeira e o INSERT ... SELECT de consolidação
+ENTIDADES = {
+    'professores': {
+        'campos': [
+            ('nome_completo', texto(255), 'TEXT', True),
+            ('email', texto(100), 'TEXT', False),
+            ('telefone', texto(20), 'TEXT', False),
+        ],
+        'rejeitar': None,
+        'inserir': """
+            INSERT INTO professor (nome_completo, email, telefone)
+            SELECT nome_completo, email, telefone FROM {stage}
+        """,
+    },
+    'alunos': {
+        'campos': [
+            ('nome_completo', texto(255), 'TEXT', True),
+            ('data_nascimento', data, 'DATE', False),
+            ('id_turma', inteiro, 'INT', False),
+            ('nome_turma', texto(50), 'TEXT', False),
+            ('nome_responsavel', texto(255), 'TEXT', False),
+            ('telefone_responsavel', texto(20), 'TEXT', False),
+            ('email_responsavel', texto(100), 'TEXT', False),
+            ('informacoes_adicionais', texto(), 'TEXT', False),
+        ],
+        'rejeitar': """
+            DELETE FROM {stage} s
+            WHERE (s.id_turma IS NOT NULL AND NOT EXISTS (SELECT 1 FROM turma t WHERE t.id_turma = s.id_turma))
+               OR (s.id_turma IS NULL AND s.nome_turma IS NOT NULL
+                   AND NOT EXISTS (SELECT 1 FROM turma t WHERE t.nome_turma = s.nome_turma))
+            RETURNING s.linha, 'turma não encontrada'
+        """,
+        'inserir': """
+            INSERT INTO aluno (nome_completo, data_nascimento, id_turma, nome_responsavel,
+                               telefone_responsavel, email_responsavel, informacoes_adicionais)
+            SELECT s.nome_completo, s.data_nascimento, COALESCE(s.id_turma, t.id_turma), s.nome_responsavel,
+                   s.telefone_responsavel, s.email_responsavel, s.informacoes_adicionais
+            FROM {stage} s
+            LEFT JOIN (SELECT nome_turma, min(id_turma) AS id_turma FROM turma GROUP BY nome_turma) t
+                   ON s.id_turma IS NULL AND t.nome_turma = s.nome_turma
+        """,
+    },
+    'presencas': {
+        'campos': [
+            ('id_aluno', inteiro, 'INT', True),
+            ('data_presenca', data, 'DATE', True),
+            ('presente', booleano, 'BOOLEAN', True),
+        ],
+        'rejeitar': """
+            DELETE FROM {stage} s
+            WHERE NOT EXISTS (SELECT 1 FROM aluno a WHERE a.id_aluno = s.id_aluno)
+            RETURNING s.linha, 'aluno não encontrado'
+        """,
+        'inserir': """
+            INSERT INTO presenca (id_aluno, data_presenca, presente)
+            SELECT id_aluno, data_presenca, presente FROM {stage}
+        """,
+    },
+}
+
+
+def ler_registros(arquivo, formato):
+    """Gera (número da linha, dicionário) a partir de um arquivo texto CSV ou NDJSON"""
+    if formato == 'csv':
+        leitor = csv.DictReader(arquivo)
+        for numero, registro in enumerate(leitor, start=2):
+            yield numero, registro
+    elif formato == 'ndjson':
+        for numero, linha in enumerate(arquivo, start=1):
+            if linha.strip():
+                try:
+                    yield numero, json.loads(linha)
+                except ValueError:
+                    yield numero, None
+    else:
+        raise ValueError(f'Formato de importação desconhecido: {formato}')
+
+
+def validar(campos, registro):
+    """Converte o registro para a ordem das colunas de staging ou levanta ValueError"""
+    if not isinstance(registro, dict):
+        raise ValueError('registro malformado')
+    valores = []
+    for nome, converter, _, obrigatorio in campos:
+        valor = registro.get(nome)
+        if valor is None or valor == '':
+            if obrigatorio:
+                raise ValueError(f'campo obrigatório ausente: {nome}')
+            valores.append(None)
+            continue
+        try:
+            valores.append(converter(valor))
+        except (TypeError, ValueError) as e:
+            raise ValueError(f'{nome}: {e}')
+    return valores
+
+
+def importar(entidade, arquivo, formato='csv', tamanho_lote=10000):
+    """Valida em lotes, carrega com COPY em tabela temporária e consolida com INSERT ... SELECT"""
+    spec = ENTIDADES[entidade]
+    campos = spec['campos']
+    stage = f'importacao_{entidade}'
+    colunas = ['linha'] + [nome for nome, _, _, _ in campos]
+
+    conexao = db.session.connection()
+    conexao.execute(text(
+        f"CREATE TEMP TABLE {stage} (linha INT, "
+        + ', '.join(f'{nome} {tipo}' for nome, _, tipo, _ in campos)
+        + ') ON COMMIT DROP'
+    ))
+    cursor = conexao.connection.cursor()
+    copy_sql = f"COPY {stage} ({', '.join(colunas)}) FROM STDIN WITH (FORMAT csv)"
+
+    relatorio = {'entidade': entidade, 'recebidas': 0, 'importadas': 0, 'rejeitadas': 0, 'erros': []}
+
+    def rejeitar(linha, motivo):
+        relatorio['rejeitadas'] += 1
+        if len(relatorio['erros']) < MAX_ERROS_RELATORIO:
+            relatorio['erros'].append({'linha': linha, 'motivo': motivo})
+
+    def enviar(buffer):
+        buffer.seek(0)
+        cursor.copy_expert(copy_sql, buffer)
+
+    buffer = io.StringIO()
+    escritor = csv.writer(buffer)
+    pendentes = 0
+    for numero, registro in ler_registros(arquivo, formato):
+        relatorio['recebidas'] += 1
+        try:
+            escritor.writerow([numero] + validar(campos, registro))
+            pendentes += 1
+        except ValueError as e:
+            rejeitar(numero, str(e))
+        if pendentes >= tamanho_lote:
+            enviar(buffer)
+            buffer = io.StringIO()
+            escritor = csv.writer(buffer)
+            pendentes = 0
+    if pendentes:
+        enviar(buffer)
+
+    if spec['rejeitar']:
+        for linha, motivo in conexao.execute(text(spec['rejeitar'].format(stage=stage))):
+            rejeitar(linha, motivo)
+    relatorio['importadas'] = conexao.execute(text(spec['inserir'].format(stage=stage))).rowcount
+    db.session.commit()
+
+    relatorio['erros'].sort(key=lambda erro: erro['linha'])
+    logger.info(
+        f"CREATE: Importação de {entidade}: {relatorio['importadas']} importada(s), "
+        f"{relatorio['rejeitadas']} rejeitada(s)."
+    )
+    return relatorio
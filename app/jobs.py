@@ -0,0 +1,246 @@
+import logging
+import threading
+import time
+from contextlib import contextmanager, nullcontext
+from datetime import datetime, timedelta
+
+from flask import current_app, g
+from sqlalchemy import delete, func, select, text, update
+
+from escolas import escolas
+from models import db, Job, ParteResultadoJob
+
+logger = logging.getLogger(__name__)
+
+# Chave do advisory lock que serializa a reserva dos jobs de um tipo com limite (um lock por esquema e tipo)
+RESERVA_LOCK_ID = 29001
+
+_tarefas = {}
+
+
+def tarefa(nome, limite=None):
+    """Registra uma função como tipo de job; `limite` restringe execuções simultâneas do tipo"""
+    def registrar(funcao):
+        _tarefas[nome] = {'funcao': funcao, 'limite': limite}
+        return funcao
+    return registrar
+
+
+def tipos_registrados():
+    return sorted(_tarefas)
+
+
+def enfileirar(tipo, parametros=None, max_tentativas=None):
+    """Cria um job pendente; o commit fica a cargo de quem chama"""
+    if tipo not in _tarefas:
+        raise ValueError(f'Tipo de job desconhecido: {tipo}')
+    job = Job(tipo=tipo, parametros=parametros or {})
+    if max_tentativas is not None:
+        job.max_tentativas = max_tentativas
+    db.session.add(job)
+    return job
+
+
+def _tipos_saturados():
+    em_execucao = dict(db.session.execute(
+        select(Job.tipo, func.count()).where(Job.status == 'executando').group_by(Job.tipo)
+    ).all())
+    return [
+        nome for nome, info in _tarefas.items()
+        if info['limite'] is not None and em_execucao.get(nome, 0) >= info['limite']
+    ]
+
+
+def _travar_tipo(tipo):
+    """Tenta travar a reserva do tipo até o fim da transação; False se outro worker o está reservando"""
+    return db.session.execute(
+        text('SELECT pg_try_advisory_xact_lock(:id, hashtext(current_schema() || :tipo))'),
+        {'id': RESERVA_LOCK_ID, 'tipo': tipo}
+    ).scalar()
+
+
+def reservar_job(timeout):
+    """Reserva o próximo job disponível, respeitando os limites de concorrência por tipo.
+
+    Os workers disputam as linhas com SKIP LOCKED; só a reserva de um tipo com limite é serializada
+    (lock por tipo, sem espera), e a contagem de execuções é refeita depois de obtido o lock."""
+    agora = datetime.utcnow()
+
+    # Jobs de workers que morreram durante a execução (arrendamento sem renovação) voltam para a fila
+    Job.query.filter(
+        Job.status == 'executando',
+        func.coalesce(Job.renovado_em, Job.iniciado_em) < agora - timedelta(seconds=timeout)
+    ).update({'status': 'pendente'}, synchronize_session=False)
+
+    excluidos = set(_tipos_saturados())
+    while True:
+        job = db.session.execute(
+            select(Job).where(
+                Job.status == 'pendente',
+                Job.executar_apos <= agora,
+                Job.tipo.in_([nome for nome in _tarefas if nome not in excluidos])
+            ).order_by(Job.id_job).limit(1).with_for_update(skip_locked=True)
+        ).scalar_one_or_none()
+        if job is None or _tarefas[job.tipo]['limite'] is None:
+            break
+        if _travar_tipo(job.tipo) and job.tipo not in _tipos_saturados():
+            break
+        # Tipo sendo reservado por outro worker ou já no limite: tenta os demais
+        excluidos.add(job.tipo)
+
+    if job is not None:
+        job.status = 'executando'
+        job.iniciado_em = agora
+        job.renovado_em = agora
+        job.tentativas += 1
+    db.session.commit()
+    return job
+
+
+def _da_tentativa(id_job, tentativa):
+    """Filtro do job enquanto a execução `tentativa` ainda é a dona dele"""
+    return (Job.id_job == id_job, Job.status == 'executando', Job.tentativas == tentativa)
+
+
+@contextmanager
+def _arrendamento(id_job, tentativa, intervalo):
+    """Renova o arrendamento do job a cada `intervalo` segundos enquanto o bloco executa.
+
+    A renovação usa uma conexão própria, fora da transação do job; se outra execução assumiu o job,
+    só registra o aviso (a conclusão desta é descartada por _concluir)."""
+    engine = escolas.engine_atual() or db.engine
+    parar = threading.Event()
+
+    def renovar():
+        while not parar.wait(intervalo):
+            try:
+                with engine.begin() as conexao:
+                    renovado = conexao.execute(
+                        update(Job).where(*_da_tentativa(id_job, tentativa)).values(renovado_em=datetime.utcnow())
+                    ).rowcount
+                if not renovado:
+                    logger.warning(f'JOB: Job {id_job} foi assumido por outra execução.')
+                    return
+            except Exception as e:
+                logger.warning(f'JOB: Falha ao renovar o arrendamento do job {id_job} - {e}')
+
+    thread = threading.Thread(target=renovar, name=f'job-{id_job}-arrendamento', daemon=True)
+    thread.start()
+    try:
+        yield
+    finally:
+        parar.set()
+        thread.join()
+
+
+def _concluir(id_job, tentativa, **valores):
+    """Grava o desfecho do job só se esta execução ainda for a dona dele; False se não for mais"""
+    return db.session.execute(
+        update(Job).where(*_da_tentativa(id_job, tentativa)).values(**valores)
+        .execution_options(synchronize_session=False)
+    ).rowcount == 1
+
+
+def executar_job(job, backoff, renovacao=None):
+    id_job, tipo, tentativa, max_tentativas = job.id_job, job.tipo, job.tentativas, job.max_tentativas
+    # Origem das escritas do job na auditoria
+    g.origem_auditoria = f'job {tipo} #{id_job}'
+    g.job = job
+    renovacao = renovacao or current_app.config['JOB_RENOVACAO']
+    try:
+        with _arrendamento(id_job, tentativa, renovacao):
+            resultado = _tarefas[tipo]['funcao'](**(job.parametros or {}))
+        # Fora do arrendamento: a renovação não pode esperar pela linha travada por este UPDATE
+        if not _concluir(id_job, tentativa, resultado=resultado, status='concluido', erro=None,
+                         concluido_em=datetime.utcnow()):
+            # Arrendamento perdido: as escritas desta execução são descartadas
+            db.session.rollback()
+            logger.warning(f'JOB: Job {id_job} ({tipo}) concluído, mas já assumido por outra execução; resultado descartado.')
+            return
+        db.session.commit()
+        logger.info(f'JOB: Job {id_job} ({tipo}) concluído.')
+    except Exception as e:
+        db.session.rollback()
+        if tentativa < max_tentativas:
+            # Nova tentativa com espera exponencial
+            valores = {'status': 'pendente',
+                       'executar_apos': datetime.utcnow() + timedelta(seconds=backoff * 2 ** (tentativa - 1))}
+            logger.warning(f'JOB: Job {id_job} ({tipo}) falhou na tentativa {tentativa} - {e}')
+        else:
+            valores = {'status': 'falhou', 'concluido_em': datetime.utcnow()}
+            logger.error(f'JOB: Job {id_job} ({tipo}) falhou definitivamente - {e}')
+        if not _concluir(id_job, tentativa, erro=str(e), **valores):
+            logger.warning(f'JOB: Falha do job {id_job} ignorada: já assumido por outra execução.')
+        db.session.commit()
+
+
+def gravar_partes(pedacos):
+    """Grava o arquivo de resultado do job em execução, uma linha por pedaço (bytes); retorna quantas partes.
+
+    Cada parte vai para o banco assim que é gerada, então o arquivo nunca fica inteiro em memória; tudo
+    fica na transação do job, e uma tentativa que falha não deixa partes para trás. Partes de uma execução
+    anterior do mesmo job são removidas antes."""
+    db.session.execute(delete(ParteResultadoJob).where(ParteResultadoJob.id_job == g.job.id_job))
+    partes = 0
+    for dados in pedacos:
+        db.session.execute(ParteResultadoJob.__table__.insert().values(id_job=g.job.id_job, parte=partes, dados=dados))
+        partes += 1
+    return partes
+
+
+def ler_partes(id_job, partes):
+    """Partes do arquivo de resultado do job, lidas uma de cada vez"""
+    for parte in range(partes):
+        yield db.session.execute(
+            select(ParteResultadoJob.dados).where(ParteResultadoJob.id_job == id_job, ParteResultadoJob.parte == parte)
+        ).scalar_one()
+
+
+def _escolas_da_rodada(app):
+    """Escolas cujas filas são consultadas a cada rodada ([None] sem multi-escola)"""
+    if not escolas.ativo:
+        return [None]
+    with app.app_context():
+        try:
+            # Escolas em migração ficam sem jobs até a troca de shard terminar
+            return [escola['slug'] for escola in escolas.todas() if escola['status'] == 'ativa']
+        except Exception as e:
+            logger.error(f'JOB: Falha ao ler o catálogo de escolas - {e}')
+            return []
+
+
+def _loop(app, parar):
+    config = app.config
+    while not parar.is_set():
+        executou = False
+        for slug in _escolas_da_rodada(app):
+            with app.app_context(), (escolas.usar(slug) if slug else nullcontext()):
+                try:
+                    job = reservar_job(config['JOB_TIMEOUT'])
+                    if job is not None:
+                        executar_job(job, config['JOB_RETRY_BACKOFF'])
+                        executou = True
+                except Exception as e:
+                    db.session.rollback()
+                    logger.error(f'JOB: Falha no loop do worker - {e}')
+        if not executou:
+            parar.wait(config['JOB_POLL_INTERVAL'])
+
+
+def executar_worker(app, parar=None):
+    """Executa JOB_WORKER_THREADS threads consumindo a fila até `parar` ser sinalizado"""
+    parar = parar or threading.Event()
+    threads = [
+        threading.Thread(target=_loop, args=(app, parar), name=f'job-worker-{i}', daemon=True)
+        for i in range(app.config['JOB_WORKER_THREADS'])
+    ]
+    for thread in threads:
+        thread.start()
+    logger.info(f'JOB: Worker iniciado com {len(threads)} thread(s); tipos: {", ".join(tipos_registrados())}.')
+    try:
+        while any(thread.is_alive() for thread in threads):
+            time.sleep(1)
+    except KeyboardInterrupt:
+        parar.set()
+    for thread in threads:
+        thread.join()
@@ -0,0 +1,153 @@
+import logging
+from urllib.parse import urlsplit
+
+from flask import current_app, request
+from sqlalchemy.orm.util import identity_key
+from werkzeug.exceptions import HTTPException
+
+from autenticacao import autenticacao
+from consultas import listar
+from models import db
+
+logger = logging.getLogger(__name__)
+
+# Limites de ?ids= e de sub-requisições por POST /batch
+MAXIMO_IDS = 500
+MAXIMO_REQUISICOES = 50
+# Cabeçalhos da requisição original que não valem para as sub-requisições
+CABECALHOS_IGNORADOS = {'content-length', 'content-type', 'accept', 'idempotency-key'}
+
+
+def carrega_por_id(modelo, argumento):
+    """Marca uma rota GET por ID: em POST /batch as linhas de todas as chamadas a ela vêm em um SELECT só"""
+    def marcar(view):
+        view._carrega_por_id = (modelo, argumento)
+        return view
+    return marcar
+
+
+def em_lote(view):
+    """Marca uma listagem JSON que pode ser chamada em POST /batch (além das rotas com carrega_por_id)"""
+    view._em_lote = True
+    return view
+
+
+def _aceita_em_lote(view):
+    # Só leituras JSON de tamanho limitado: fluxos (SSE, arquivo, .zip) prenderiam a thread do lote
+    return getattr(view, '_carrega_por_id', None) is not None or getattr(view, '_em_lote', False)
+
+
+def ler_ids(texto):
+    """IDs de "1,2,3" sem repetição, na ordem pedida"""
+    try:
+        ids = list(dict.fromkeys(int(parte) for parte in texto.split(',') if parte.strip()))
+    except ValueError:
+        raise ValueError('ids deve ser uma lista de números separados por vírgula') from None
+    if len(ids) > MAXIMO_IDS:
+        raise ValueError(f'No máximo {MAXIMO_IDS} ids por requisição')
+    return ids
+
+
+def carregar(modelo, ids, *opcoes):
+    """Objetos de `modelo` com os `ids` pedidos, na mesma ordem (os inexistentes ficam de fora).
+
+    O mapa de identidade da sessão (uma por requisição) evita buscar a mesma linha duas vezes: só os
+    IDs que ainda não estão nele vão ao banco, em um único SELECT ... WHERE id IN (...)."""
+    chave = modelo.__mapper__.primary_key[0]
+    mapa = db.session.identity_map
+    faltando = [id_ for id_ in dict.fromkeys(ids) if identity_key(modelo, id_) not in mapa]
+    if faltando:
+        listar(modelo, *opcoes, em=(chave, faltando))
+    objetos = (mapa.get(identity_key(modelo, id_)) for id_ in ids)
+    return [objeto for objeto in objetos if objeto is not None]
+
+
+def listar_por_ids(modelo, *opcoes):
+    """to_dict() das linhas de ?ids= (None quando a listagem não pede ids)"""
+    texto = request.args.get('ids')
+    if texto is None:
+        return None
+    return [objeto.to_dict() for objeto in carregar(modelo, ler_ids(texto), *opcoes)]
+
+
+def _view(endpoint):
+    view = current_app.view_functions.get(endpoint)
+    # Resources do flask-restx: a marca fica na classe
+    return getattr(view, 'view_class', view)
+
+
+def _pre_carregar(caminhos):
+    """Carrega de uma vez as linhas das rotas marcadas com carrega_por_id"""
+    adaptador = current_app.url_map.bind_to_environ(request.environ)
+    pedidos = {}
+    for caminho in caminhos:
+        try:
+            endpoint, argumentos = adaptador.match(urlsplit(caminho).path, method='GET')
+        except HTTPException:
+            continue
+        marca = getattr(_view(endpoint), '_carrega_por_id', None)
+        if marca is None:
+            continue
+        modelo, argumento = marca
+        try:
+            pedidos.setdefault(modelo, []).append(int(argumentos[argumento]))
+        except (KeyError, ValueError):
+            continue
+    for modelo, ids in pedidos.items():
+        carregar(modelo, ids)
+
+
+def _executar(caminho, cabecalhos):
+    """Status e corpo de uma sub-requisição GET, no mesmo contexto de aplicação (mesma sessão)"""
+    app = current_app._get_current_object()
+    with app.test_request_context(caminho, method='GET', base_url=request.host_url, headers=cabecalhos):
+        if request.endpoint is not None and not _aceita_em_lote(_view(request.endpoint)):
+            return 400, {'error': 'Rota não disponível em /batch'}
+        try:
+            proibida = autenticacao.autorizar()
+            resposta = app.make_response(proibida or app.dispatch_request())
+        except HTTPException as e:
+            resposta = e.get_response()
+        except Exception as e:
+            db.session.rollback()
+            logger.error(f'LOTE: Falha na sub-requisição {caminho} - {e}')
+            return 500, {'error': 'Falha na sub-requisição'}
+        if resposta.status_code >= 500:
+            db.session.rollback()
+        if resposta.is_streamed:
+            # ?formato= binário: resposta em fluxo, que não cabe no corpo JSON do lote
+            resposta.close()
+            return 400, {'error': 'Respostas em fluxo não são aceitas em /batch'}
+        corpo = resposta.get_json(silent=True) if resposta.is_json else resposta.get_data(as_text=True)
+        return resposta.status_code, corpo
+
+
+def executar_lote(requisicoes):
+    """Respostas de várias leituras (GET) em uma única chamada HTTP, na ordem pedida"""
+    if not isinstance(requisicoes, list) or not requisicoes:
+        raise ValueError('requisicoes deve ser uma lista não vazia')
+    if len(requisicoes) > MAXIMO_REQUISICOES:
+        raise ValueError(f'No máximo {MAXIMO_REQUISICOES} requisições por lote')
+    itens = []
+    for item in requisicoes:
+        if not isinstance(item, dict) or not isinstance(item.get('caminho'), str) or not item['caminho'].startswith('/'):
+            raise ValueError('Cada requisição deve ter um caminho começando com /')
+        itens.append((item['caminho'], (item.get('metodo') or 'GET').upper()))
+
+    cabecalhos = [(nome, valor) for nome, valor in request.headers if nome.lower() not in CABECALHOS_IGNORADOS]
+    cabecalhos.append(('Accept', 'application/json'))
+    try:
+        _pre_carregar(caminho for caminho, metodo in itens if metodo == 'GET')
+    except Exception as e:
+        # Sem a carga conjunta cada sub-requisição ainda busca as próprias linhas
+        db.session.rollback()
+        logger.warning(f'LOTE: Falha ao pré-carregar as linhas do lote - {e}')
+
+    respostas = []
+    for caminho, metodo in itens:
+        if metodo != 'GET':
+            status, corpo = 405, {'error': 'Somente GET é aceito em /batch'}
+        else:
+            status, corpo = _executar(caminho, cabecalhos)
+        respostas.append({'caminho': caminho, 'status': status, 'corpo': corpo})
+    return respostas
@@ -0,0 +1,98 @@
+from prometheus_client import CONTENT_TYPE_LATEST, Counter, Gauge, Histogram, generate_latest
+
+# Controle de admissão (limite de taxa e descarte de carga)
+ADMISSAO = Counter(
+    'escola_admissao_total',
+    'Requisições admitidas, limitadas (429) ou descartadas (503) por classe de rota',
+    ['classe', 'resultado']
+)
+EM_EXECUCAO = Gauge(
+    'escola_requisicoes_em_execucao',
+    'Requisições em execução por classe de rota',
+    ['classe']
+)
+ESPERA_FILA = Histogram(
+    'escola_admissao_espera_segundos',
+    'Tempo de espera por uma vaga de concorrência',
+    ['classe'],
+    buckets=(0.001, 0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1.0)
+)
+
+
+# Consultas SQL por requisição
+CONSULTAS_POR_REQUISICAO = Histogram(
+    'escola_sql_consultas_por_requisicao',
+    'Quantidade de instruções SQL executadas por requisição',
+    ['endpoint', 'escola'],
+    buckets=(0, 1, 2, 5, 10, 20, 50, 100, 500)
+)
+TEMPO_SQL = Histogram(
+    'escola_sql_tempo_por_requisicao_segundos',
+    'Tempo total gasto no banco por requisição',
+    ['endpoint', 'escola']
+)
+CONSULTAS_LENTAS = Counter(
+    'escola_sql_consultas_lentas_total',
+    'Instruções SQL acima do limite de consulta lenta',
+    ['endpoint', 'escola']
+)
+# Cache de SQL compilado do SQLAlchemy: acerto (SQL reaproveitado), falha (compilado agora) ou sem cache
+CACHE_SQL = Counter(
+    'escola_sql_cache_compilado_total',
+    'Instruções SQL por resultado da busca no cache de instruções compiladas',
+    ['endpoint', 'resultado']
+)
+
+
+# Cache de HTML renderizado (páginas inteiras e linhas de tabela)
+CACHE_HTML = Counter(
+    'escola_cache_html_total',
+    'Acertos e falhas do cache de HTML por tipo de entrada',
+    ['tipo', 'resultado', 'escola']
+)
+
+
+# Idempotency-Key nas escritas: chaves novas, respostas repetidas, chaves em andamento ou reutilizadas
+IDEMPOTENCIA = Counter(
+    'escola_idempotencia_total',
+    'Requisições POST/PUT com Idempotency-Key por resultado',
+    ['resultado']
+)
+
+
+# Autenticação: requisições autorizadas, sem token válido (401) ou sem permissão (403)
+AUTENTICACAO = Counter(
+    'escola_autenticacao_total',
+    'Verificações de token por resultado',
+    ['resultado']
+)
+
+# Auditoria: registros gravados (ou que falharam e voltaram ao buffer) e registros à espera da gravação
+AUDITORIA = Counter(
+    'escola_auditoria_registros_total',
+    'Registros de auditoria por resultado da gravação em lote',
+    ['resultado']
+)
+AUDITORIA_PENDENTES = Gauge(
+    'escola_auditoria_pendentes',
+    'Registros de auditoria em memória aguardando gravação'
+)
+
+# Documentos gerados (recibos e folhas de frequência), avulsos ou em lote
+DOCUMENTOS = Counter(
+    'escola_documentos_total',
+    'Documentos gerados por tipo e formato',
+    ['documento', 'formato']
+)
+
+
+# Multi-escola: pools de conexão abertos (um por escola usada recentemente)
+POOLS_ESCOLAS = Gauge(
+    'escola_pools_escolas_abertos',
+    'Pools de conexão de escolas abertos no processo'
+)
+
+
+def exportar():
+    """Corpo e content-type da resposta do endpoint /metrics"""
+    return generate_latest(), CONTENT_TYPE_LATEST
@@ -1,7 +1,88 @@
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import DDL, event
+from sqlalchemy.dialects.postgresql import ExcludeConstraint, JSONB
 from datetime import datetime
+from replicas import RoutingSession
 
-db = SQLAlchemy()
+db = SQLAlchemy(session_options={'class_': RoutingSession})
+# O create_all não cria esquemas; o histórico arquivado fica no esquema "arquivo"
+event.listen(db.metadata, 'before_create', DDL('CREATE SCHEMA IF NOT EXISTS arquivo'))
+# Intervalos de horário (faixa_horario) e igualdade de inteiros no GiST, usados pela exclusão de horario_turma;
+# ficam em public para valer em todos os esquemas de escola (o mesmo SQL de InfraBD/escola.sql)
+event.listen(db.metadata, 'before_create', DDL('CREATE EXTENSION IF NOT EXISTS btree_gist WITH SCHEMA public'))
+event.listen(db.metadata, 'before_create', DDL(
+    "DO $$ BEGIN CREATE TYPE public.faixa_horario AS RANGE (subtype = time); "
+    "EXCEPTION WHEN duplicate_object THEN NULL; END $$"
+))
+event.listen(db.metadata, 'before_create', DDL("""
+CREATE OR REPLACE FUNCTION public.horario_turma_professor() RETURNS trigger AS $f$
+BEGIN
+    EXECUTE format('SELECT id_professor FROM %%I.turma WHERE id_turma = $1', TG_TABLE_SCHEMA)
+        INTO NEW.id_professor USING NEW.id_turma;
+    RETURN NEW;
+END;
+$f$ LANGUAGE plpgsql
+"""))
+event.listen(db.metadata, 'before_create', DDL("""
+CREATE OR REPLACE FUNCTION public.turma_professor_horarios() RETURNS trigger AS $f$
+BEGIN
+    EXECUTE format('UPDATE %%I.horario_turma SET id_professor = $1 WHERE id_turma = $2', TG_TABLE_SCHEMA)
+        USING NEW.id_professor, NEW.id_turma;
+    RETURN NULL;
+END;
+$f$ LANGUAGE plpgsql
+"""))
+# Auditoria: partições mensais criadas adiante (a partição padrão recebe o que não tiver partição) e
+# tabela somente inserção. Esta é a única definição de auditoria_particoes: InfraBD/escola.sql e a
+# migração 007 não a repetem, o create_all e a thread de auditoria (em bancos sem ela) a criam daqui
+FUNCAO_AUDITORIA_PARTICOES = DDL("""
+CREATE OR REPLACE FUNCTION public.auditoria_particoes(meses INT DEFAULT 3) RETURNS INT AS $f$
+DECLARE
+    inicio TIMESTAMP := date_trunc('month', now() AT TIME ZONE 'utc');
+    mes TIMESTAMP;
+    criadas INT := 0;
+    esquema TEXT := current_schema();
+    mover BOOLEAN;
+    movidas BIGINT;
+BEGIN
+    -- Linhas da partição padrão dentro de um mês ainda sem partição impedem o PARTITION OF desse mês:
+    -- a padrão é trocada por uma vazia e as linhas são reinseridas depois, já nas partições mensais
+    EXECUTE format('SELECT EXISTS (SELECT 1 FROM %%I.auditoria_padrao WHERE registrado_em >= %%L AND registrado_em < %%L)',
+        esquema, inicio, inicio + make_interval(months => meses)) INTO mover;
+    IF mover THEN
+        EXECUTE format('ALTER TABLE %%I.auditoria DETACH PARTITION %%I.auditoria_padrao', esquema, esquema);
+        EXECUTE format('ALTER TABLE %%I.auditoria_padrao RENAME TO auditoria_padrao_antiga', esquema);
+        EXECUTE format('CREATE TABLE %%I.auditoria_padrao PARTITION OF %%I.auditoria DEFAULT', esquema, esquema);
+    END IF;
+
+    FOR i IN 0 .. meses - 1 LOOP
+        mes := inicio + make_interval(months => i);
+        IF to_regclass(format('%%I.%%I', esquema, 'auditoria_' || to_char(mes, 'YYYYMM'))) IS NULL THEN
+            EXECUTE format('CREATE TABLE %%I.%%I PARTITION OF %%I.auditoria FOR VALUES FROM (%%L) TO (%%L)',
+                esquema, 'auditoria_' || to_char(mes, 'YYYYMM'), esquema, mes, mes + interval '1 month');
+            criadas := criadas + 1;
+        END IF;
+    END LOOP;
+
+    IF mover THEN
+        -- A tabela antiga sai com DROP (o trigger de somente inserção recusaria o DELETE)
+        EXECUTE format('INSERT INTO %%I.auditoria SELECT * FROM %%I.auditoria_padrao_antiga', esquema, esquema);
+        GET DIAGNOSTICS movidas = ROW_COUNT;
+        EXECUTE format('DROP TABLE %%I.auditoria_padrao_antiga', esquema);
+        RAISE WARNING 'auditoria: %% registro(s) da partição padrão redistribuído(s) em %%', movidas, esquema;
+    END IF;
+    RETURN criadas;
+END;
+$f$ LANGUAGE plpgsql
+""")
+event.listen(db.metadata, 'before_create', FUNCAO_AUDITORIA_PARTICOES)
+event.listen(db.metadata, 'before_create', DDL("""
+CREATE OR REPLACE FUNCTION public.auditoria_somente_insercao() RETURNS trigger AS $f$
+BEGIN
+    RAISE EXCEPTION 'auditoria aceita somente inserções (%% recusado)', TG_OP;
+END;
+$f$ LANGUAGE plpgsql
+"""))
 
 class Professor(db.Model):
     id_professor = db.Column(db.Integer, primary_key=True)
@@ -20,32 +101,77 @@ class Professor(db.Model):
 class Turma(db.Model):
     id_turma = db.Column(db.Integer, primary_key=True)
     nome_turma = db.Column(db.String(50))
-    id_professor = db.Column(db.Integer, db.ForeignKey('professor.id_professor'))
+    id_professor = db.Column(db.Integer, db.ForeignKey('professor.id_professor', ondelete='SET NULL'), index=True)
     horario = db.Column(db.String(100))
     
-    professor = db.relationship('Professor', backref='turmas')
-    alunos = db.relationship('Aluno', backref='turma', lazy=True)
+    # passive_deletes: o banco aplica ON DELETE, sem carregar os filhos na sessão
+    professor = db.relationship('Professor', backref=db.backref('turmas', passive_deletes=True))
+    alunos = db.relationship('Aluno', backref='turma', lazy=True, passive_deletes=True)
+    horarios = db.relationship('HorarioTurma', backref='turma', lazy=True, passive_deletes=True,
+                               order_by='(HorarioTurma.dia_semana, HorarioTurma.inicio)')
 
     def to_dict(self):
         return {
             'id_turma': self.id_turma,
             'nome_turma': self.nome_turma,
             'id_professor': self.id_professor,
-            'horario': self.horario
+            'horario': self.horario,
+            'horarios': [horario.to_dict() for horario in self.horarios]
         }
 
+class HorarioTurma(db.Model):
+    """Aula semanal de uma turma (dia_semana 0 = segunda, como date.weekday()).
+
+    id_professor é copiado da turma pelas triggers, para a exclusão impedir que o mesmo professor
+    tenha duas aulas sobrepostas no mesmo dia."""
+    __tablename__ = 'horario_turma'
+    id_horario = db.Column(db.Integer, primary_key=True)
+    id_turma = db.Column(db.Integer, db.ForeignKey('turma.id_turma', ondelete='CASCADE'), nullable=False, index=True)
+    id_professor = db.Column(db.Integer)
+    dia_semana = db.Column(db.SmallInteger, nullable=False)
+    inicio = db.Column(db.Time, nullable=False)
+    fim = db.Column(db.Time, nullable=False)
+
+    __table_args__ = (
+        db.CheckConstraint('dia_semana BETWEEN 0 AND 6', name='ck_horario_turma_dia'),
+        db.CheckConstraint('inicio < fim', name='ck_horario_turma_intervalo'),
+        # Intervalos '[)': uma aula pode começar no minuto em que a anterior termina
+        ExcludeConstraint(
+            (id_professor, '='), (dia_semana, '='), (db.func.public.faixa_horario(inicio, fim), '&&'),
+            using='gist', name='ex_horario_turma_professor'
+        ),
+    )
+
+    def to_dict(self):
+        return {
+            'dia_semana': self.dia_semana,
+            'inicio': self.inicio.strftime('%H:%M'),
+            'fim': self.fim.strftime('%H:%M')
+        }
+
+# Triggers criadas junto com a tabela (create_all também roda nos esquemas novos de cada escola)
+event.listen(HorarioTurma.__table__, 'after_create', DDL(
+    'CREATE TRIGGER horario_turma_professor BEFORE INSERT OR UPDATE OF id_turma ON horario_turma '
+    'FOR EACH ROW EXECUTE FUNCTION public.horario_turma_professor()'
+))
+event.listen(HorarioTurma.__table__, 'after_create', DDL(
+    'CREATE TRIGGER turma_professor_horarios AFTER UPDATE OF id_professor ON turma '
+    'FOR EACH ROW WHEN (OLD.id_professor IS DISTINCT FROM NEW.id_professor) '
+    'EXECUTE FUNCTION public.turma_professor_horarios()'
+))
+
 class Aluno(db.Model):
     id_aluno = db.Column(db.Integer, primary_key=True)
     nome_completo = db.Column(db.String(255))
     data_nascimento = db.Column(db.Date)
-    id_turma = db.Column(db.Integer, db.ForeignKey('turma.id_turma'))
+    id_turma = db.Column(db.Integer, db.ForeignKey('turma.id_turma', ondelete='SET NULL'), index=True)
     nome_responsavel = db.Column(db.String(255))
     telefone_responsavel = db.Column(db.String(20))
     email_responsavel = db.Column(db.String(100))
     informacoes_adicionais = db.Column(db.Text)
     
-    pagamentos = db.relationship('Pagamento', backref='aluno', lazy=True)
-    presencas = db.relationship('Presenca', backref='aluno', lazy=True)
+    pagamentos = db.relationship('Pagamento', backref='aluno', lazy=True, cascade='all, delete-orphan', passive_deletes=True)
+    presencas = db.relationship('Presenca', backref='aluno', lazy=True, cascade='all, delete-orphan', passive_deletes=True)
     
     def to_dict(self):
         return {
@@ -61,7 +187,7 @@ class Aluno(db.Model):
 
 class Pagamento(db.Model):
     id_pagamento = db.Column(db.Integer, primary_key=True)
-    id_aluno = db.Column(db.Integer, db.ForeignKey('aluno.id_aluno'))
+    id_aluno = db.Column(db.Integer, db.ForeignKey('aluno.id_aluno', ondelete='CASCADE'), index=True)
     data_pagamento = db.Column(db.Date)
     valor_pago = db.Column(db.Numeric(10, 2))
     forma_pagamento = db.Column(db.String(50))
@@ -81,7 +207,7 @@ class Pagamento(db.Model):
 
 class Presenca(db.Model):
     id_presenca = db.Column(db.Integer, primary_key=True)
-    id_aluno = db.Column(db.Integer, db.ForeignKey('aluno.id_aluno'))
+    id_aluno = db.Column(db.Integer, db.ForeignKey('aluno.id_aluno', ondelete='CASCADE'), index=True)
     data_presenca = db.Column(db.Date)
     presente = db.Column(db.Boolean)
     
@@ -98,7 +224,8 @@ class Atividade(db.Model):
     descricao = db.Column(db.Text)
     data_realizacao = db.Column(db.Date)
     
-    alunos = db.relationship('Aluno', secondary='atividade_aluno', backref=db.backref('atividades', lazy='dynamic'))
+    alunos = db.relationship('Aluno', secondary='atividade_aluno', passive_deletes=True,
+                             backref=db.backref('atividades', lazy='dynamic', passive_deletes=True))
     
     def to_dict(self):
         return {
@@ -110,17 +237,17 @@ class Atividade(db.Model):
 
 class AtividadeAluno(db.Model):
     __tablename__ = 'atividade_aluno'
-    id_atividade = db.Column(db.Integer, db.ForeignKey('atividade.id_atividade'), primary_key=True)
-    id_aluno = db.Column(db.Integer, db.ForeignKey('aluno.id_aluno'), primary_key=True)
+    id_atividade = db.Column(db.Integer, db.ForeignKey('atividade.id_atividade', ondelete='CASCADE'), primary_key=True)
+    id_aluno = db.Column(db.Integer, db.ForeignKey('aluno.id_aluno', ondelete='CASCADE'), primary_key=True, index=True)
 
 class Usuario(db.Model):
     id_usuario = db.Column(db.Integer, primary_key=True)
     login = db.Column(db.String(50), unique=True)
     senha = db.Column(db.String(255))
     nivel_acesso = db.Column(db.String(20))
-    id_professor = db.Column(db.Integer, db.ForeignKey('professor.id_professor'), nullable=True)
+    id_professor = db.Column(db.Integer, db.ForeignKey('professor.id_professor', ondelete='SET NULL'), nullable=True, index=True)
     
-    professor = db.relationship('Professor', backref='usuario')
+    professor = db.relationship('Professor', backref=db.backref('usuario', passive_deletes=True))
     
     def to_dict(self):
         return {
@@ -128,4 +255,126 @@ class Usuario(db.Model):
             'login': self.login,
             'nivel_acesso': self.nivel_acesso,
             'id_professor': self.id_professor
-        }
\ No newline at end of file
+        }
+
+class Job(db.Model):
+    """Tarefa em segundo plano; a tabela é a própria fila (SELECT ... FOR UPDATE SKIP LOCKED)"""
+    id_job = db.Column(db.Integer, primary_key=True)
+    tipo = db.Column(db.String(50), nullable=False)
+    parametros = db.Column(db.JSON)
+    status = db.Column(db.String(20), nullable=False, default='pendente')
+    tentativas = db.Column(db.Integer, nullable=False, default=0)
+    max_tentativas = db.Column(db.Integer, nullable=False, default=3)
+    resultado = db.Column(db.JSON)
+    erro = db.Column(db.Text)
+    criado_em = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    executar_apos = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    iniciado_em = db.Column(db.DateTime)
+    # Arrendamento: renovado pelo worker durante a execução; sem renovação por JOB_TIMEOUT o job volta à fila
+    renovado_em = db.Column(db.DateTime)
+    concluido_em = db.Column(db.DateTime)
+
+    __table_args__ = (
+        db.Index('ix_job_fila', 'status', 'executar_apos'),
+    )
+
+    def to_dict(self):
+        return {
+            'id_job': self.id_job,
+            'tipo': self.tipo,
+            'parametros': self.parametros,
+            'status': self.status,
+            'tentativas': self.tentativas,
+            'max_tentativas': self.max_tentativas,
+            'erro': self.erro,
+            'criado_em': self.criado_em.isoformat() if self.criado_em else None,
+            'iniciado_em': self.iniciado_em.isoformat() if self.iniciado_em else None,
+            'concluido_em': self.concluido_em.isoformat() if self.concluido_em else None
+        }
+
+class ParteResultadoJob(db.Model):
+    """Parte do arquivo de resultado de um job (ex.: CSV exportado), para não guardá-lo inteiro em JSON"""
+    __tablename__ = 'parte_resultado_job'
+    id_job = db.Column(db.Integer, db.ForeignKey('job.id_job', ondelete='CASCADE'), primary_key=True)
+    parte = db.Column(db.Integer, primary_key=True)
+    dados = db.Column(db.LargeBinary, nullable=False)
+
+class ChaveIdempotencia(db.Model):
+    """Resposta de uma escrita com Idempotency-Key, devolvida às repetições até expira_em"""
+    __tablename__ = 'chave_idempotencia'
+    chave = db.Column(db.String(255), primary_key=True)
+    assinatura = db.Column(db.LargeBinary, nullable=False)  # sha256 de método, caminho e corpo
+    status = db.Column(db.SmallInteger)  # NULL enquanto a requisição original executa
+    content_type = db.Column(db.String(100))
+    corpo = db.Column(db.LargeBinary)  # comprimido com zlib
+    criado_em = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    expira_em = db.Column(db.DateTime, nullable=False, index=True)
+
+class Revogacao(db.Model):
+    """Revogação de tokens antes de expirarem: um token (jti) ou todos os de um usuário emitidos até revogado_em"""
+    id_revogacao = db.Column(db.Integer, primary_key=True)
+    jti = db.Column(db.String(32))
+    id_usuario = db.Column(db.Integer, db.ForeignKey('usuario.id_usuario', ondelete='CASCADE'), index=True)
+    revogado_em = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    # Depois disso os tokens revogados já expiraram e a linha pode ser removida
+    expira_em = db.Column(db.DateTime, nullable=False, index=True)
+    __table_args__ = (
+        db.CheckConstraint('jti IS NOT NULL OR id_usuario IS NOT NULL', name='ck_revogacao_alvo'),
+    )
+
+class LoteArquivo(db.Model):
+    """Linhas arquivadas de um aluno em um período, em colunas (JSON) comprimidas com zlib"""
+    __tablename__ = 'lote'
+    id_lote = db.Column(db.Integer, primary_key=True)
+    entidade = db.Column(db.String(20), nullable=False)
+    id_aluno = db.Column(db.Integer, db.ForeignKey('aluno.id_aluno', ondelete='CASCADE'), nullable=False)
+    inicio = db.Column(db.Date, nullable=False)
+    fim = db.Column(db.Date, nullable=False)
+    quantidade = db.Column(db.Integer, nullable=False)
+    dados = db.Column(db.LargeBinary, nullable=False)
+    arquivado_em = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+
+    __table_args__ = (
+        db.Index('ix_lote_entidade_aluno', 'entidade', 'id_aluno', 'inicio'),
+        {'schema': 'arquivo'},
+    )
+
+class RegistroAuditoria(db.Model):
+    """Alteração de uma linha (valores antigos e novos, usuário e origem); somente inserção, gravada em lotes por auditoria.py"""
+    __tablename__ = 'auditoria'
+    id_auditoria = db.Column(db.BigInteger, primary_key=True, autoincrement=True)
+    # Chave de partição (mês), por isso também faz parte da chave primária
+    registrado_em = db.Column(db.DateTime, primary_key=True)
+    entidade = db.Column(db.String(50), nullable=False)
+    id_registro = db.Column(db.String(100))  # NULL nas instruções em massa; chaves compostas como "3,5"
+    operacao = db.Column(db.String(10), nullable=False)
+    antes = db.Column(JSONB)
+    depois = db.Column(JSONB)
+    id_usuario = db.Column(db.Integer)  # sem chave estrangeira: o registro sobrevive ao usuário
+    origem = db.Column(db.String(255))
+
+    __table_args__ = (
+        db.Index('ix_auditoria_registro', 'entidade', 'id_registro', 'registrado_em'),
+        db.Index('ix_auditoria_entidade', 'entidade', 'registrado_em'),
+        {'postgresql_partition_by': 'RANGE (registrado_em)'},
+    )
+
+    def to_dict(self):
+        return {
+            'id_auditoria': self.id_auditoria,
+            'registrado_em': self.registrado_em.isoformat(),
+            'entidade': self.entidade,
+            'id_registro': self.id_registro,
+            'operacao': self.operacao,
+            'antes': self.antes,
+            'depois': self.depois,
+            'id_usuario': self.id_usuario,
+            'origem': self.origem
+        }
+
+event.listen(RegistroAuditoria.__table__, 'after_create', DDL('CREATE TABLE auditoria_padrao PARTITION OF auditoria DEFAULT'))
+event.listen(RegistroAuditoria.__table__, 'after_create', DDL(
+    'CREATE TRIGGER auditoria_somente_insercao BEFORE UPDATE OR DELETE ON auditoria '
+    'FOR EACH ROW EXECUTE FUNCTION public.auditoria_somente_insercao()'
+))
+event.listen(RegistroAuditoria.__table__, 'after_create', DDL('SELECT public.auditoria_particoes(3)'))
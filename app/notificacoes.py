@@ -0,0 +1,216 @@
+import json
+import logging
+import os
+import queue
+import select
+import threading
+import time
+
+import psycopg2
+import sqlalchemy as sa
+
+from escolas import ESQUEMA_PADRAO, escolas
+from replicas import RoutingSession
+
+logger = logging.getLogger(__name__)
+
+# Coluna publicada no lugar da chave primária (a mesma usada em InfraBD/notificacoes.sql)
+CHAVES_NOTIFICACAO = {'atividade_aluno': 'id_atividade'}
+
+
+class Barramento:
+    """Recebe os NOTIFY das triggers do banco e repassa para assinantes e clientes SSE do processo"""
+
+    def __init__(self):
+        self._assinantes = []
+        self._filas = {}
+        # Clientes SSE atendidos em threads do servidor (os do modo assíncrono não ocupam thread)
+        self._em_thread = set()
+        self._lock = threading.Lock()
+        self._threads = []
+        self._escutando = set()
+        self._pid = None
+        # Sinaliza que o LISTEN está ativo em todos os bancos; sem ele nenhum evento de invalidação chega ao processo
+        self.conectado = threading.Event()
+
+    def init_app(self, app):
+        app.extensions['barramento'] = self
+        self._config = app.config
+        if app.config['NOTIFICACOES_ATIVAS']:
+            # A thread é iniciada na primeira requisição de cada processo (compatível com fork)
+            app.before_request(self.iniciar)
+
+    def assinar(self, callback):
+        """Registra uma função chamada com cada evento (ex.: invalidação de cache)"""
+        self._assinantes.append(callback)
+        return callback
+
+    def _ativo(self):
+        return self._threads and all(thread.is_alive() for thread in self._threads) and self._pid == os.getpid()
+
+    def iniciar(self):
+        if self._ativo():
+            return
+        with self._lock:
+            if self._ativo():
+                return
+            self._pid = os.getpid()
+            self._escutando.clear()
+            dsns = self._dsns()
+            # Uma conexão de escuta por banco: com multi-escola, cada shard publica as próprias alterações
+            self._threads = [
+                threading.Thread(target=self._escutar, args=(dsn, len(dsns)), name=f'barramento-notify-{i}', daemon=True)
+                for i, dsn in enumerate(dsns)
+            ]
+            for thread in self._threads:
+                thread.start()
+
+    def _dsns(self):
+        urls = [self._config['SQLALCHEMY_DATABASE_URI']]
+        if self._config['ESCOLAS_ATIVAS']:
+            urls += [url for url in self._config['ESCOLAS_SHARDS'].values() if url not in urls]
+        return [
+            sa.engine.make_url(url).set(drivername='postgresql').render_as_string(hide_password=False)
+            for url in urls
+        ]
+
+    def _marcar_escuta(self, dsn, total, ativa):
+        with self._lock:
+            if ativa:
+                self._escutando.add(dsn)
+            else:
+                self._escutando.discard(dsn)
+            if len(self._escutando) == total:
+                self.conectado.set()
+            else:
+                self.conectado.clear()
+
+    def _escutar(self, dsn, total):
+        canal = self._config['NOTIFY_CHANNEL']
+        host = sa.engine.make_url(dsn).host
+        espera = 1
+        while True:
+            conexao = None
+            try:
+                conexao = psycopg2.connect(dsn)
+                conexao.set_isolation_level(psycopg2.extensions.ISOLATION_LEVEL_AUTOCOMMIT)
+                with conexao.cursor() as cursor:
+                    cursor.execute(f'LISTEN {canal}')
+                logger.info(f'NOTIFY: Escutando o canal {canal} em {host}.')
+                self._marcar_escuta(dsn, total, True)
+                # Eventos perdidos enquanto desconectado: assinantes descartam o que guardaram
+                self.publicar({'entidade': None, 'operacao': 'RESSINCRONIZAR', 'ids': None}, clientes=False)
+                espera = 1
+                while True:
+                    if select.select([conexao], [], [], 30) == ([], [], []):
+                        continue
+                    conexao.poll()
+                    while conexao.notifies:
+                        self.publicar(json.loads(conexao.notifies.pop(0).payload))
+            except Exception as e:
+                self._marcar_escuta(dsn, total, False)
+                logger.warning(f'NOTIFY: Conexão de escuta com {host} perdida, reconectando em {espera}s - {e}')
+                if conexao is not None:
+                    conexao.close()
+                time.sleep(espera)
+                espera = min(espera * 2, 30)
+
+    def publicar(self, evento, clientes=True):
+        for callback in self._assinantes:
+            try:
+                callback(evento)
+            except Exception as e:
+                logger.error(f'NOTIFY: Falha ao processar evento {evento} - {e}')
+        if not clientes:
+            return
+        esquema = evento.get('esquema', ESQUEMA_PADRAO)
+        with self._lock:
+            # Cada cliente SSE recebe só as alterações da própria escola
+            filas = [fila for fila, esquema_fila in self._filas.items() if esquema_fila == esquema]
+        for fila in filas:
+            try:
+                fila.put_nowait(evento)
+            except queue.Full:
+                # Cliente lento: descarta o evento em vez de acumular memória
+                pass
+
+    def conectar_cliente(self, esquema=ESQUEMA_PADRAO, limite=None, fila=None):
+        """Fila que recebe os eventos da escola; None quando já há `limite` clientes em threads.
+
+        Sem `fila`, o cliente é atendido por uma thread do servidor e conta para o limite; o modo
+        assíncrono passa a própria fila (com put_nowait) e não entra na conta."""
+        em_thread = fila is None
+        if em_thread:
+            fila = queue.Queue(maxsize=100)
+        with self._lock:
+            if em_thread and limite is not None and len(self._em_thread) >= limite:
+                return None
+            self._filas[fila] = esquema
+            if em_thread:
+                self._em_thread.add(fila)
+        return fila
+
+    def desconectar_cliente(self, fila):
+        with self._lock:
+            self._filas.pop(fila, None)
+            self._em_thread.discard(fila)
+
+
+barramento = Barramento()
+
+
+def evento_sse(evento):
+    """Evento do barramento no formato do stream SSE"""
+    return f'event: alteracao\ndata: {json.dumps(evento)}\n\n'
+
+
+# Commits do próprio processo também são publicados aos assinantes, sem esperar o NOTIFY
+# (que chega depois com o mesmo conteúdo; os assinantes tratam eventos repetidos sem efeito colateral)
+def _pendentes(session):
+    return session.info.setdefault('notificacoes', [])
+
+
+@sa.event.listens_for(RoutingSession, 'after_flush')
+def _registrar_flush(session, flush_context):
+    if not barramento._assinantes:
+        return
+    esquema = escolas.esquema_atual()
+    for operacao, objetos in (('INSERT', session.new), ('UPDATE', session.dirty), ('DELETE', session.deleted)):
+        for objeto in objetos:
+            mapper = sa.inspect(objeto).mapper
+            entidade = mapper.local_table.name
+            if entidade in CHAVES_NOTIFICACAO:
+                ids = [getattr(objeto, CHAVES_NOTIFICACAO[entidade])]
+            else:
+                ids = [valor for valor in mapper.primary_key_from_instance(objeto) if valor is not None]
+            _pendentes(session).append({'entidade': entidade, 'operacao': operacao, 'ids': ids or None, 'esquema': esquema})
+
+
+@sa.event.listens_for(RoutingSession, 'do_orm_execute')
+def _registrar_instrucao(orm_execute_state):
+    # INSERT/UPDATE/DELETE em massa (query.delete(), INSERT ... SELECT) não passam pelo flush
+    if not barramento._assinantes or orm_execute_state.is_select:
+        return
+    tabela = getattr(orm_execute_state.statement, 'table', None)
+    if tabela is None:
+        return
+    if orm_execute_state.is_delete:
+        operacao = 'DELETE'
+    elif orm_execute_state.is_insert:
+        operacao = 'INSERT'
+    else:
+        operacao = 'UPDATE'
+    _pendentes(orm_execute_state.session).append(
+        {'entidade': tabela.name, 'operacao': operacao, 'ids': None, 'esquema': escolas.esquema_atual()}
+    )
+
+
+@sa.event.listens_for(RoutingSession, 'after_commit')
+def _publicar_commit(session):
+    for evento in session.info.pop('notificacoes', []):
+        barramento.publicar(evento, clientes=False)
+
+
+@sa.event.listens_for(RoutingSession, 'after_rollback')
+def _descartar_rollback(session):
+    session.info.pop('notificacoes', None)
@@ -0,0 +1,185 @@
+import cProfile
+import functools
+import heapq
+import hmac
+import io
+import logging
+import pstats
+import random
+import threading
+import time
+import uuid
+from collections import deque
+
+from flask import current_app, g, has_request_context, jsonify, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from sqlalchemy.engine.default import CACHE_HIT, CACHE_MISS
+
+from escolas import escolas
+from metricas import CACHE_SQL, CONSULTAS_LENTAS, CONSULTAS_POR_REQUISICAO, TEMPO_SQL
+
+logger = logging.getLogger(__name__)
+
+# Instruções mais lentas guardadas por requisição
+MAX_CONSULTAS_LENTAS = 5
+# Perfis guardados por endpoint no profiler sob demanda
+MAX_PERFIS = 20
+# Resultado da busca no cache de SQL compilado (context.cache_hit); o resto é SQL textual ou sem cache
+RESULTADOS_CACHE = {CACHE_HIT: 'acerto', CACHE_MISS: 'falha'}
+
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def _antes_consulta(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault('inicio_consulta', []).append(time.perf_counter())
+
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def _depois_consulta(conn, cursor, statement, parameters, context, executemany):
+    inicios = conn.info.get('inicio_consulta')
+    if not inicios:
+        return
+    duracao = time.perf_counter() - inicios.pop()
+    requisicao = has_request_context()
+    if context is not None:
+        CACHE_SQL.labels(
+            (request.endpoint or 'desconhecido') if requisicao else 'fora_de_requisicao',
+            RESULTADOS_CACHE.get(context.cache_hit, 'sem_cache'),
+        ).inc()
+    if not requisicao or 'perfil_sql' not in g:
+        return
+
+    perfil = g.perfil_sql
+    perfil['consultas'] += 1
+    perfil['tempo'] += duracao
+    item = (duracao, perfil['consultas'], statement)
+    if len(perfil['lentas']) < MAX_CONSULTAS_LENTAS:
+        heapq.heappush(perfil['lentas'], item)
+    else:
+        heapq.heappushpop(perfil['lentas'], item)
+
+    if duracao * 1000 >= current_app.config['SLOW_QUERY_MS']:
+        CONSULTAS_LENTAS.labels(request.endpoint or 'desconhecido', escolas.rotulo()).inc()
+        logger.warning(
+            f'SQL LENTA: [{g.request_id}] {duracao * 1000:.1f} ms em {request.method} {request.path} - '
+            f'{" ".join(statement.split())[:500]}'
+        )
+
+
+def admin_requerido(view):
+    """Restringe a rota a quem envia o cabeçalho X-Admin-Token igual a ADMIN_TOKEN"""
+    @functools.wraps(view)
+    def verificar(*args, **kwargs):
+        esperado = current_app.config.get('ADMIN_TOKEN')
+        recebido = request.headers.get('X-Admin-Token', '')
+        if not esperado or not hmac.compare_digest(esperado, recebido):
+            logger.warning(f'ADMIN: Acesso negado a {request.path}.')
+            return jsonify({'error': 'Acesso restrito a administradores'}), 403
+        return view(*args, **kwargs)
+    return verificar
+
+
+class Profiler:
+    """Profiling por amostragem (cProfile) de endpoints escolhidos em tempo de execução"""
+
+    def __init__(self):
+        self._ativos = {}
+        self._perfis = {}
+        self._lock = threading.Lock()
+
+    def ativar(self, endpoint, taxa, duracao):
+        with self._lock:
+            self._ativos[endpoint] = {'taxa': taxa, 'ate': time.time() + duracao}
+            self._perfis.setdefault(endpoint, deque(maxlen=MAX_PERFIS))
+
+    def desativar(self, endpoint):
+        with self._lock:
+            return self._ativos.pop(endpoint, None) is not None
+
+    def amostrar(self, endpoint):
+        config = self._ativos.get(endpoint)
+        if config is None:
+            return False
+        if time.time() > config['ate']:
+            self.desativar(endpoint)
+            return False
+        return random.random() < config['taxa']
+
+    def registrar(self, endpoint, perfil, request_id, duracao):
+        saida = io.StringIO()
+        pstats.Stats(perfil, stream=saida).sort_stats('cumulative').print_stats(30)
+        with self._lock:
+            self._perfis.setdefault(endpoint, deque(maxlen=MAX_PERFIS)).append({
+                'request_id': request_id,
+                'duracao_ms': round(duracao * 1000, 2),
+                'coletado_em': time.strftime('%Y-%m-%dT%H:%M:%S'),
+                'estatisticas': saida.getvalue()
+            })
+
+    def estado(self):
+        with self._lock:
+            return {
+                'ativos': {
+                    endpoint: {'taxa': config['taxa'], 'restante_s': max(0, round(config['ate'] - time.time()))}
+                    for endpoint, config in self._ativos.items()
+                },
+                'perfis': {endpoint: list(perfis) for endpoint, perfis in self._perfis.items()}
+            }
+
+
+class PerfilRequisicoes:
+    """Contabiliza as instruções SQL de cada requisição e publica o cabeçalho Server-Timing"""
+
+    def __init__(self, app=None):
+        self.profiler = Profiler()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.extensions['perfil'] = self
+        app.before_request(self._iniciar)
+        app.after_request(self._finalizar)
+
+    def _iniciar(self):
+        g.request_id = request.headers.get('X-Request-ID') or uuid.uuid4().hex[:16]
+        g.inicio_requisicao = time.perf_counter()
+        g.perfil_sql = {'consultas': 0, 'tempo': 0.0, 'lentas': []}
+        if self.profiler.amostrar(request.endpoint):
+            g.profiler = cProfile.Profile()
+            g.profiler.enable()
+
+    def _finalizar(self, response):
+        if 'perfil_sql' not in g:
+            return response
+        duracao = time.perf_counter() - g.inicio_requisicao
+        perfil = g.perfil_sql
+        endpoint = request.endpoint or 'desconhecido'
+
+        profiler = g.pop('profiler', None)
+        if profiler is not None:
+            profiler.disable()
+            self.profiler.registrar(endpoint, profiler, g.request_id, duracao)
+
+        escola = escolas.rotulo()
+        CONSULTAS_POR_REQUISICAO.labels(endpoint, escola).observe(perfil['consultas'])
+        TEMPO_SQL.labels(endpoint, escola).observe(perfil['tempo'])
+
+        response.headers['X-Request-ID'] = g.request_id
+        response.headers['Server-Timing'] = (
+            f'db;dur={perfil["tempo"] * 1000:.2f};desc="{perfil["consultas"]} consultas", '
+            f'app;dur={duracao * 1000:.2f}'
+        )
+
+        if duracao * 1000 >= current_app.config['SLOW_REQUEST_MS']:
+            lentas = '; '.join(
+                f'{tempo * 1000:.1f} ms: {" ".join(sql.split())[:200]}'
+                for tempo, _, sql in sorted(perfil['lentas'], reverse=True)
+            )
+            logger.warning(
+                f'PERF: [{g.request_id}] {request.method} {request.path} em {duracao * 1000:.1f} ms, '
+                f'{perfil["consultas"]} consultas SQL em {perfil["tempo"] * 1000:.1f} ms. Mais lentas: {lentas}'
+            )
+        return response
+
+
+perfil_requisicoes = PerfilRequisicoes()
@@ -0,0 +1,140 @@
+import logging
+import tempfile
+import time
+
+import sqlalchemy as sa
+from flask import current_app
+
+from escolas import (
+    ESQUEMA_PADRAO, ESQUEMA_VALIDO, SHARD_PRINCIPAL, SLUG_VALIDO,
+    catalogo, escolas, esquema_arquivo, esquema_da_escola
+)
+from models import db
+
+logger = logging.getLogger(__name__)
+
+# Triggers de NOTIFY nas tabelas de um esquema (função criada por InfraBD/notificacoes.sql em cada shard)
+INSTALAR_NOTIFICACOES = sa.text('SELECT public.instalar_notificacoes(:esquema)')
+
+
+def _nome_tabela(conexao, tabela):
+    """Nome qualificado da tabela no esquema da escola (respeitando a tradução do esquema "arquivo")"""
+    preparador = conexao.dialect.identifier_preparer
+    esquema = conexao.schema_for_object(tabela)
+    if esquema is None:
+        return preparador.quote(tabela.name)
+    return f'{preparador.quote_schema(esquema)}.{preparador.quote(tabela.name)}'
+
+
+def _criar_esquema(engine, esquema):
+    preparador = engine.dialect.identifier_preparer
+    with engine.begin() as conexao:
+        conexao.execute(sa.text(f'CREATE SCHEMA IF NOT EXISTS {preparador.quote_schema(esquema)}'))
+        conexao.execute(sa.text(f'CREATE SCHEMA IF NOT EXISTS {preparador.quote_schema(esquema_arquivo(esquema))}'))
+    # search_path no esquema da escola: as tabelas dos modelos são criadas nele
+    db.metadata.create_all(engine)
+
+
+def _definir_status(slug, status):
+    with db.engine.begin() as conexao:
+        conexao.execute(catalogo.update().where(catalogo.c.slug == slug).values(status=status))
+    escolas.catalogo(recarregar=True)
+
+
+def registrar(slug, shard=SHARD_PRINCIPAL, dominio=None, esquema=None):
+    """Cria o esquema da escola no shard (tabelas e triggers de notificação) e a registra no catálogo.
+
+    `esquema='public'` registra os dados que já existem no banco principal como uma escola."""
+    if not SLUG_VALIDO.match(slug):
+        raise ValueError('Identificador da escola deve ter só letras minúsculas, números e _')
+    if shard not in escolas.shards:
+        raise ValueError(f'Shard desconhecido: {shard} (configure ESCOLAS_SHARDS)')
+    esquema = esquema or esquema_da_escola(slug)
+    if not ESQUEMA_VALIDO.match(esquema):
+        raise ValueError(f'Nome de esquema inválido: {esquema}')
+
+    escola = {'slug': slug, 'esquema': esquema, 'shard': shard, 'dominio': dominio, 'status': 'ativa'}
+    engine = escolas.engine(escola)
+    _criar_esquema(engine, esquema)
+    with engine.begin() as conexao:
+        conexao.execute(INSTALAR_NOTIFICACOES, {'esquema': esquema})
+
+    with db.engine.begin() as conexao:
+        catalogo.create(conexao, checkfirst=True)
+        conexao.execute(catalogo.insert().values(**escola))
+    escolas.catalogo(recarregar=True)
+    logger.info(f'ESCOLAS: Escola {slug} registrada no shard {shard} (esquema {esquema}).')
+    return escola
+
+
+def _copiar(origem, destino):
+    """COPY binário de cada tabela, na ordem das chaves estrangeiras, a partir de um único snapshot da origem"""
+    copiadas = {}
+    with origem.connect() as leitura, destino.begin() as escrita:
+        leitura = leitura.execution_options(isolation_level='REPEATABLE READ')
+        with leitura.begin():
+            cursor_origem = leitura.connection.cursor()
+            cursor_destino = escrita.connection.cursor()
+            for tabela in db.metadata.sorted_tables:
+                nome = _nome_tabela(leitura, tabela)
+                with tempfile.TemporaryFile() as buffer:
+                    # COPY (SELECT ...): tabelas particionadas (auditoria) não aceitam COPY ... TO direto
+                    cursor_origem.copy_expert(f'COPY (SELECT * FROM {nome}) TO STDOUT (FORMAT binary)', buffer)
+                    buffer.seek(0)
+                    cursor_destino.copy_expert(f'COPY {nome} FROM STDIN (FORMAT binary)', buffer)
+                copiadas[tabela.name] = cursor_destino.rowcount
+
+                chave = [coluna for coluna in tabela.primary_key.columns if isinstance(coluna.type, sa.Integer)]
+                if len(chave) == 1 and not chave[0].foreign_keys:
+                    # A sequência do destino continua de onde a origem parou
+                    coluna = chave[0]
+                    escrita.execute(sa.text(
+                        f'SELECT setval(pg_get_serial_sequence(:tabela, :coluna), '
+                        f'COALESCE(MAX({escrita.dialect.identifier_preparer.quote(coluna.name)}), 0) + 1, false) '
+                        f'FROM {nome}'
+                    ), {'tabela': nome, 'coluna': coluna.name})
+    return copiadas
+
+
+def mover(slug, destino, remover_origem=False):
+    """Copia o esquema da escola para outro shard e troca o shard no catálogo.
+
+    A escola fica "migrando" durante a cópia: escritas recebem 503 e o worker deixa de pegar os
+    jobs dela. Antes de copiar, espera ESCOLAS_CATALOGO_TTL para todos os processos verem o status."""
+    escola = escolas.catalogo(recarregar=True)['slugs'].get(slug)
+    if escola is None:
+        raise ValueError(f'Escola não encontrada: {slug}')
+    if destino not in escolas.shards:
+        raise ValueError(f'Shard desconhecido: {destino} (configure ESCOLAS_SHARDS)')
+    if escola['shard'] == destino:
+        raise ValueError(f'Escola {slug} já está no shard {destino}')
+    if remover_origem and escola['esquema'] == ESQUEMA_PADRAO:
+        raise ValueError('O esquema public não é removido; apague os dados de origem manualmente')
+
+    origem = escolas.engine(escola)
+    engine_destino = escolas.engine(dict(escola, shard=destino))
+    _definir_status(slug, 'migrando')
+    try:
+        time.sleep(current_app.config['ESCOLAS_CATALOGO_TTL'] + 1)
+        _criar_esquema(engine_destino, escola['esquema'])
+        copiadas = _copiar(origem, engine_destino)
+        # Triggers depois da cópia: o COPY não gera NOTIFY no destino
+        with engine_destino.begin() as conexao:
+            conexao.execute(INSTALAR_NOTIFICACOES, {'esquema': escola['esquema']})
+    except Exception:
+        _definir_status(slug, 'ativa')
+        raise
+
+    with db.engine.begin() as conexao:
+        conexao.execute(
+            catalogo.update().where(catalogo.c.slug == slug).values(shard=destino, status='ativa')
+        )
+    escolas.catalogo(recarregar=True)
+    logger.info(f"ESCOLAS: Escola {slug} movida de {escola['shard']} para {destino} ({copiadas}).")
+
+    if remover_origem:
+        preparador = origem.dialect.identifier_preparer
+        with origem.begin() as conexao:
+            for esquema in (escola['esquema'], esquema_arquivo(escola['esquema'])):
+                conexao.execute(sa.text(f'DROP SCHEMA IF EXISTS {preparador.quote_schema(esquema)} CASCADE'))
+    return copiadas
@@ -0,0 +1,65 @@
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Instrumenta um engine criado depois da inicialização; definido por init_app com o rastreamento ativo
+_instrumentar_engine = None
+
+
+def instrumentar(engine):
+    """Garante spans para as instruções de um engine criado sob demanda (pools das escolas e réplicas dos shards)"""
+    if _instrumentar_engine is not None:
+        _instrumentar_engine(engine)
+
+
+def init_app(app):
+    """Configura o rastreamento OpenTelemetry (rotas Flask, instruções SQL e renderização de templates)"""
+    global _instrumentar_engine
+    if not app.config['TRACING_ATIVO']:
+        return
+
+    # Importações aqui para não carregar o SDK quando o rastreamento está desligado
+    from opentelemetry import trace
+    from opentelemetry.exporter.otlp.proto.http.trace_exporter import OTLPSpanExporter
+    from opentelemetry.instrumentation.flask import FlaskInstrumentor
+    from opentelemetry.instrumentation.jinja2 import Jinja2Instrumentor
+    from opentelemetry.instrumentation.sqlalchemy import SQLAlchemyInstrumentor
+    from opentelemetry.instrumentation.sqlalchemy.engine import EngineTracer
+    from opentelemetry.sdk.resources import Resource
+    from opentelemetry.sdk.trace import TracerProvider
+    from opentelemetry.sdk.trace.export import BatchSpanProcessor
+    from opentelemetry.sdk.trace.sampling import ParentBased, TraceIdRatioBased
+
+    # Respeita a decisão de amostragem de quem chamou (traceparent W3C); raízes seguem a taxa
+    provider = TracerProvider(
+        resource=Resource.create({'service.name': app.config['TRACING_SERVICE_NAME']}),
+        sampler=ParentBased(TraceIdRatioBased(app.config['TRACING_SAMPLE_RATIO']))
+    )
+    provider.add_span_processor(BatchSpanProcessor(
+        OTLPSpanExporter(endpoint=app.config['TRACING_OTLP_ENDPOINT'])
+    ))
+    trace.set_tracer_provider(provider)
+
+    FlaskInstrumentor().instrument_app(app, excluded_urls='metrics,eventos,saude,estaticos')
+    Jinja2Instrumentor().instrument()
+    # models importa replicas, que importa escolas, que importa este módulo: db só é lido aqui
+    from models import db
+    with app.app_context():
+        engines = list(db.engines.values())
+    engines += app.extensions.get('replicas', {}).get('engines', [])
+    SQLAlchemyInstrumentor().instrument(engines=engines, tracer_provider=provider)
+    tracer = trace.get_tracer('opentelemetry.instrumentation.sqlalchemy', tracer_provider=provider)
+
+    def instrumentar_engine(engine):
+        # sa.create_engine já sai instrumentado depois do instrument(); o listener só é acrescentado
+        # quando falta (engine criado por uma referência a create_engine importada antes)
+        if not any(isinstance(getattr(ouvinte, '__self__', None), EngineTracer)
+                   for ouvinte in engine.dispatch.before_cursor_execute):
+            EngineTracer(tracer, engine)
+
+    _instrumentar_engine = instrumentar_engine
+
+    logger.info(
+        f"Rastreamento ativo (amostragem {app.config['TRACING_SAMPLE_RATIO']:.0%}) "
+        f"enviando para {app.config['TRACING_OTLP_ENDPOINT']}."
+    )
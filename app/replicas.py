@@ -0,0 +1,166 @@
+import itertools
+import logging
+import threading
+import time
+from collections import defaultdict
+
+import sqlalchemy as sa
+from flask import current_app, g, has_app_context, request
+from flask_sqlalchemy.session import Session
+
+from escolas import SHARD_PRINCIPAL, escolas
+
+logger = logging.getLogger(__name__)
+
+# Consulta de atraso da réplica: zero quando todo o WAL recebido já foi aplicado
+LAG_SQL = sa.text(
+    "SELECT CASE WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0 "
+    "ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0) END"
+)
+
+
+def usa_primario(view):
+    """Marca uma rota GET que precisa ler do banco primário (ex.: exclusões via link)"""
+    view._usa_primario = True
+    return view
+
+
+def somente_leitura(view):
+    """Marca uma rota POST que só lê (ex.: /batch): as leituras podem ir para as réplicas"""
+    view._somente_leitura = True
+    return view
+
+
+class ReplicaRouter:
+    """Distribui as leituras das requisições GET entre as réplicas configuradas.
+
+    Sem escola na requisição, as réplicas são as de DATABASE_REPLICA_URLS; com multi-escola, as do shard
+    da escola, com o search_path no esquema dela. O atraso é medido por réplica, não por escola."""
+
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        urls = app.config.get('DATABASE_REPLICA_URLS') or []
+        engine_options = app.config.get('SQLALCHEMY_ENGINE_OPTIONS', {})
+        # Réplica fora do ar falha rápido em vez de esperar o timeout de conexão do TCP
+        connect_args = {'connect_timeout': app.config['REPLICA_CONNECT_TIMEOUT']}
+        state = {
+            'engines': [sa.create_engine(url, connect_args=connect_args, **engine_options) for url in urls],
+            'lag': {},
+            # Protege só o estado; a consulta de atraso roda fora dele
+            'lock': threading.Lock(),
+            # Réplicas com verificação de atraso em andamento
+            'verificando': set(),
+            # Rodízio independente por shard
+            'ciclos': defaultdict(itertools.count),
+        }
+        app.extensions['replicas'] = state
+
+        replicas_escolas = app.config.get('ESCOLAS_ATIVAS') and any(app.config.get('ESCOLAS_SHARDS_REPLICAS', {}).values())
+        if state['engines'] or replicas_escolas:
+            app.before_request(self._marcar_requisicao)
+            logger.info(f'Roteamento de leitura ativo com {len(urls)} réplica(s) no primário.')
+
+    def _marcar_requisicao(self):
+        view = current_app.view_functions.get(request.endpoint)
+        g.usar_replica = (
+            view is not None
+            and (request.method in ('GET', 'HEAD') or getattr(view, '_somente_leitura', False))
+            and not getattr(view, '_usa_primario', False)
+        )
+
+    def _atraso(self, state, chave, engine):
+        """Retorna o atraso (em segundos) da réplica `chave` (shard, índice), consultando no máximo a cada intervalo"""
+        intervalo = current_app.config['REPLICA_LAG_CHECK_INTERVAL']
+        agora = time.monotonic()
+        lag, verificado_em = state['lag'].get(chave, (None, 0.0))
+        if lag is not None and agora - verificado_em < intervalo:
+            return lag
+
+        with state['lock']:
+            lag, verificado_em = state['lag'].get(chave, (None, 0.0))
+            if lag is not None and agora - verificado_em < intervalo:
+                return lag
+            if chave in state['verificando']:
+                # Outra thread já consulta esta réplica: segue com o último atraso conhecido (sem nenhum,
+                # a réplica é pulada) em vez de esperar a consulta, que pode demorar com a réplica fora do ar
+                return lag if lag is not None else float('inf')
+            state['verificando'].add(chave)
+
+        lag = float('inf')
+        try:
+            with engine.connect() as conn:
+                lag = float(conn.execute(LAG_SQL).scalar() or 0)
+        except Exception as e:
+            logger.warning(f'REPLICA: Réplica {chave[1]} do shard {chave[0]} indisponível - {e}')
+        finally:
+            with state['lock']:
+                state['lag'][chave] = (lag, agora)
+                state['verificando'].discard(chave)
+        return lag
+
+    def _replicas(self, state):
+        """(shard, quantidade de réplicas, engine da réplica de índice i) da requisição atual"""
+        escola = escolas.atual()
+        if escola is None:
+            return SHARD_PRINCIPAL, len(state['engines']), state['engines'].__getitem__
+        shard = escola['shard']
+        return shard, len(escolas.replicas.get(shard) or ()), lambda indice: escolas.engine(escola, indice)
+
+    def engine_para_leitura(self):
+        """Engine de réplica para a requisição atual ou None para usar o primário"""
+        if not has_app_context() or not g.get('usar_replica') or g.get('escreveu'):
+            return None
+
+        engine = g.get('engine_replica')
+        if engine is not None:
+            return engine
+
+        state = current_app.extensions.get('replicas')
+        if not state:
+            return None
+        shard, quantidade, engine_replica = self._replicas(state)
+        if not quantidade:
+            return None
+
+        max_lag = current_app.config['REPLICA_MAX_LAG']
+        for _ in range(quantidade):
+            indice = next(state['ciclos'][shard]) % quantidade
+            engine = engine_replica(indice)
+            if self._atraso(state, (shard, indice), engine) <= max_lag:
+                # Mantém a mesma réplica durante toda a requisição
+                g.engine_replica = engine
+                return g.engine_replica
+
+        logger.warning(f'REPLICA: Nenhuma réplica do shard {shard} dentro do atraso tolerado, usando o primário.')
+        g.usar_replica = False
+        return None
+
+
+router = ReplicaRouter()
+
+
+class RoutingSession(Session):
+    """Sessão que envia leituras para réplicas e escritas para o primário (ou para o banco da escola)"""
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if bind is None and not self._flushing:
+            # Com multi-escola, a réplica vem do shard da escola da requisição
+            engine = router.engine_para_leitura()
+            if engine is not None:
+                return engine
+        if bind is None:
+            # Multi-escola: escritas (e leituras sem réplica) vão para o pool da escola da requisição
+            engine = escolas.engine_atual()
+            if engine is not None:
+                return engine
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+
+@sa.event.listens_for(RoutingSession, 'after_flush')
+def _fixar_primario(session, flush_context):
+    # Depois de uma escrita, o restante da requisição lê do primário (read-after-write)
+    if has_app_context():
+        g.escreveu = True
@@ -0,0 +1,59 @@
+import logging
+import threading
+import time
+
+from sqlalchemy import text
+
+from models import db
+
+logger = logging.getLogger(__name__)
+
+
+class Saude:
+    """Estado de vida/prontidão do processo consultado pelo balanceador de carga"""
+
+    def __init__(self, app=None):
+        self.drenando = threading.Event()
+        self._lock = threading.Lock()
+        self._ultimo = (0.0, True, None)
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.extensions['saude'] = self
+        self._intervalo = app.config['READINESS_CACHE']
+        self._app = app
+
+    def iniciar_drenagem(self):
+        """Marca o processo como saindo: prontidão passa a falhar e streams longos são encerrados"""
+        if not self.drenando.is_set():
+            logger.info('SAUDE: Drenando conexões antes do desligamento.')
+            self.drenando.set()
+
+    def _verificar_banco(self):
+        try:
+            # Conexão direta no primário, sem sessão: um SELECT 1 com timeout curto
+            with self._app.app_context(), db.engine.connect() as conexao:
+                conexao.execute(text("SET LOCAL statement_timeout = '1s'"))
+                conexao.execute(text('SELECT 1'))
+            return True, None
+        except Exception as e:
+            logger.warning(f'SAUDE: Banco de dados inacessível - {e}')
+            return False, 'banco de dados inacessível'
+
+    def pronto(self):
+        """(pronto, motivo); o resultado da verificação do banco é reaproveitado por READINESS_CACHE segundos"""
+        if self.drenando.is_set():
+            return False, 'drenando'
+        verificado_em, ok, erro = self._ultimo
+        if time.monotonic() - verificado_em < self._intervalo:
+            return ok, erro
+        with self._lock:
+            verificado_em, ok, erro = self._ultimo
+            if time.monotonic() - verificado_em >= self._intervalo:
+                ok, erro = self._verificar_banco()
+                self._ultimo = (time.monotonic(), ok, erro)
+        return ok, erro
+
+
+saude = Saude()
@@ -0,0 +1,97 @@
+// Campos de seleção com busca assíncrona em /lookup/<entidade> (typeahead).
+// Simples: <div class="busca" data-lookup="alunos"> com um input hidden (id) e um de texto.
+// Múltiplo: data-multiplo e data-campo com o nome enviado no formulário; cada item escolhido
+// vira um input hidden dentro de .busca-selecionados.
+(function () {
+    function iniciar(caixa) {
+        var texto = caixa.querySelector('.busca-texto');
+        var oculto = caixa.querySelector('input[type="hidden"]:not([data-item])');
+        var lista = caixa.querySelector('.busca-resultados');
+        var selecionados = caixa.querySelector('.busca-selecionados');
+        var multiplo = caixa.hasAttribute('data-multiplo');
+        var espera, pedido = 0;
+
+        function limpar() {
+            lista.innerHTML = '';
+            lista.hidden = true;
+        }
+
+        function escolher(item) {
+            if (multiplo) {
+                if (!selecionados.querySelector('[data-item="' + item.id + '"]')) {
+                    var li = document.createElement('li');
+                    li.setAttribute('data-item', item.id);
+                    li.textContent = item.nome + ' ';
+                    var remover = document.createElement('button');
+                    remover.type = 'button';
+                    remover.className = 'busca-remover';
+                    remover.textContent = '×';
+                    var valor = document.createElement('input');
+                    valor.type = 'hidden';
+                    valor.name = caixa.dataset.campo;
+                    valor.value = item.id;
+                    valor.setAttribute('data-item', item.id);
+                    li.appendChild(remover);
+                    li.appendChild(valor);
+                    selecionados.appendChild(li);
+                }
+                texto.value = '';
+            } else {
+                oculto.value = item.id;
+                texto.value = item.nome;
+                texto.setCustomValidity('');
+            }
+            limpar();
+        }
+
+        function buscar() {
+            var atual = ++pedido;
+            var url = '/lookup/' + caixa.dataset.lookup + '?limit=10&q=' + encodeURIComponent(texto.value);
+            fetch(url).then(function (resposta) { return resposta.json(); }).then(function (itens) {
+                // Respostas fora de ordem: só a busca mais recente é exibida
+                if (atual !== pedido || !Array.isArray(itens)) {
+                    return;
+                }
+                lista.innerHTML = '';
+                itens.forEach(function (item) {
+                    var li = document.createElement('li');
+                    li.textContent = item.nome;
+                    li.addEventListener('mousedown', function (evento) {
+                        evento.preventDefault();
+                        escolher(item);
+                    });
+                    lista.appendChild(li);
+                });
+                lista.hidden = itens.length === 0;
+            });
+        }
+
+        texto.addEventListener('input', function () {
+            if (!multiplo) {
+                oculto.value = '';
+            }
+            clearTimeout(espera);
+            espera = setTimeout(buscar, 150);
+        });
+        texto.addEventListener('focus', buscar);
+        texto.addEventListener('blur', limpar);
+        if (selecionados) {
+            selecionados.addEventListener('click', function (evento) {
+                if (evento.target.classList.contains('busca-remover')) {
+                    evento.target.parentNode.remove();
+                }
+            });
+        }
+        if (!multiplo && texto.required) {
+            texto.form.addEventListener('submit', function (evento) {
+                if (!oculto.value) {
+                    texto.setCustomValidity('Selecione um item da lista');
+                    texto.reportValidity();
+                    evento.preventDefault();
+                }
+            });
+        }
+    }
+
+    document.querySelectorAll('.busca').forEach(iniciar);
+})();
@@ -0,0 +1,13 @@
+// Atualiza a página quando os dados mudam no banco (Server-Sent Events).
+// As entidades observadas vêm do atributo data-eventos da tag <script>.
+(function () {
+    var entidades = document.currentScript.dataset.eventos;
+    if (!entidades || !window.EventSource) {
+        return;
+    }
+    var recarregar;
+    new EventSource('/eventos?entidades=' + encodeURIComponent(entidades)).addEventListener('alteracao', function () {
+        clearTimeout(recarregar);
+        recarregar = setTimeout(function () { location.reload(); }, 500);
+    });
+})();
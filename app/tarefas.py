@@ -0,0 +1,105 @@
+import csv
+import io
+from datetime import date, datetime, timedelta
+
+from flask import current_app
+from sqlalchemy import delete, exists, func, literal, select
+
+from arquivo import arquivar, historico
+from idempotencia import limpar_vencidas
+from jobs import gravar_partes, tarefa
+from models import db, Aluno, Pagamento, Presenca, Professor, Revogacao, Turma
+
+# Entidades que podem ser exportadas em CSV
+EXPORTAVEIS = {
+    'alunos': Aluno,
+    'professores': Professor,
+    'turmas': Turma,
+    'pagamentos': Pagamento,
+    'presencas': Presenca
+}
+
+# Tamanho aproximado (bytes) de cada parte do CSV exportado gravada no banco
+TAMANHO_PARTE = 1024 * 1024
+
+
+@tarefa('gerar_mensalidades', limite=1)
+def gerar_mensalidades(referencia, valor, status='Pendente'):
+    """Cria a cobrança do mês para todos os alunos que ainda não a possuem"""
+    ja_cobrado = exists().where(Pagamento.id_aluno == Aluno.id_aluno, Pagamento.referencia == referencia)
+    stmt = Pagamento.__table__.insert().from_select(
+        ['id_aluno', 'valor_pago', 'referencia', 'status'],
+        select(Aluno.id_aluno, literal(valor, Pagamento.valor_pago.type), literal(referencia), literal(status))
+        .where(~ja_cobrado)
+    )
+    gerados = db.session.execute(stmt).rowcount
+    db.session.commit()
+    return {'referencia': referencia, 'gerados': gerados}
+
+
+@tarefa('exportar_csv', limite=2)
+def exportar_csv(entidade):
+    """Exporta todas as linhas da entidade em CSV, lendo o resultado em lotes e gravando o arquivo em partes"""
+    tabela = EXPORTAVEIS[entidade].__table__
+    linhas = 0
+
+    def gerar():
+        nonlocal linhas
+        saida = io.StringIO()
+        escritor = csv.writer(saida)
+        escritor.writerow([coluna.name for coluna in tabela.columns])
+        for linha in db.session.execute(select(tabela).execution_options(yield_per=1000)):
+            escritor.writerow(linha)
+            linhas += 1
+            if saida.tell() >= TAMANHO_PARTE:
+                yield saida.getvalue().encode('utf-8')
+                saida.seek(0)
+                saida.truncate()
+        if saida.tell():
+            yield saida.getvalue().encode('utf-8')
+
+    partes = gravar_partes(gerar())
+    return {'entidade': entidade, 'linhas': linhas, 'partes': partes}
+
+
+@tarefa('relatorio_pagamentos', limite=2)
+def relatorio_pagamentos(incluir_arquivo=False):
+    """Totais de pagamentos agrupados por referência e status (opcionalmente com o histórico arquivado)"""
+    linhas = db.session.execute(
+        select(Pagamento.referencia, Pagamento.status, func.count(), func.sum(Pagamento.valor_pago))
+        .group_by(Pagamento.referencia, Pagamento.status)
+    ).all()
+    totais = {(referencia, status): [quantidade, total or 0] for referencia, status, quantidade, total in linhas}
+    if incluir_arquivo:
+        for pagamento in historico('pagamentos'):
+            total = totais.setdefault((pagamento['referencia'], pagamento['status']), [0, 0])
+            total[0] += 1
+            total[1] += pagamento['valor_pago'] or 0
+    return [
+        {'referencia': referencia, 'status': status, 'quantidade': quantidade, 'total': float(total)}
+        for (referencia, status), (quantidade, total) in sorted(totais.items(), key=lambda item: (item[0][0] is None, item[0][0] or ''))
+    ]
+
+
+@tarefa('arquivar_historico', limite=1)
+def arquivar_historico(antes_de=None):
+    """Arquiva presenças e pagamentos pagos anteriores à data (padrão: ARQUIVO_RETENCAO_DIAS atrás)"""
+    if antes_de:
+        corte = date.fromisoformat(antes_de)
+    else:
+        corte = date.today() - timedelta(days=current_app.config['ARQUIVO_RETENCAO_DIAS'])
+    return {'antes_de': corte.isoformat(), **arquivar(corte)}
+
+
+@tarefa('limpar_idempotencia', limite=1)
+def limpar_idempotencia():
+    """Remove as chaves de idempotência vencidas (IDEMPOTENCIA_TTL)"""
+    return {'removidas': limpar_vencidas()}
+
+
+@tarefa('limpar_revogacoes', limite=1)
+def limpar_revogacoes():
+    """Remove as revogações de tokens que já expiraram de qualquer forma (AUTH_TOKEN_TTL)"""
+    removidas = db.session.execute(delete(Revogacao).where(Revogacao.expira_em < datetime.utcnow())).rowcount
+    db.session.commit()
+    return {'removidas': removidas}
@@ -0,0 +1,11 @@
+import signal
+import threading
+
+from app import app
+from jobs import executar_worker
+
+
+if __name__ == '__main__':
+    parar = threading.Event()
+    signal.signal(signal.SIGTERM, lambda *_: parar.set())
+    executar_worker(app, parar)
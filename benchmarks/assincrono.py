@@ -0,0 +1,108 @@
+"""Leituras com muitos clientes simultâneos: modo síncrono (gunicorn/Flask) x assíncrono (uvicorn/asyncpg).
+
+Uso (na raiz do projeto, com os dois modos no ar):
+
+    docker compose up -d web                     # síncrono, porta 5001
+    docker compose --profile async up -d web-async  # assíncrono, porta 5002
+    python benchmarks/assincrono.py --concorrencia 64,256,1024 --duracao 20
+
+Cada cliente mantém uma conexão keep-alive e consulta em ciclo as rotas de --rotas, esperando
+--intervalo segundos entre as consultas (0 = sem pausa), como telas que fazem polling. Os clientes
+são corrotinas, então milhares deles cabem em um só processo. Para cada concorrência o script
+imprime vazão, latências p50/p99 e erros de cada modo.
+"""
+import argparse
+import asyncio
+import statistics
+import time
+from urllib.parse import urlsplit
+
+
+async def _consultar(leitor, escritor, host, caminho):
+    escritor.write(f'GET {caminho} HTTP/1.1\r\nHost: {host}\r\nAccept: application/json\r\n\r\n'.encode())
+    await escritor.drain()
+    cabecalho = await leitor.readuntil(b'\r\n\r\n')
+    linhas = cabecalho.decode('latin-1').split('\r\n')
+    status = int(linhas[0].split()[1])
+    campos = dict(linha.split(':', 1) for linha in linhas[1:] if ':' in linha)
+    campos = {nome.strip().lower(): valor.strip() for nome, valor in campos.items()}
+    if 'content-length' not in campos:
+        raise ConnectionError('Resposta sem Content-Length')
+    await leitor.readexactly(int(campos['content-length']))
+    return status, campos.get('connection', '').lower() == 'close'
+
+
+async def _cliente(alvo, rotas, fim, intervalo, latencias, erros, indice):
+    conexao = None
+    rodada = indice
+    while time.monotonic() < fim:
+        caminho = rotas[rodada % len(rotas)]
+        rodada += 1
+        inicio = time.perf_counter()
+        try:
+            if conexao is None:
+                conexao = await asyncio.open_connection(alvo.hostname, alvo.port or 80)
+            status, fechar = await asyncio.wait_for(_consultar(*conexao, alvo.netloc, caminho), timeout=10)
+            if fechar:
+                conexao[1].close()
+                conexao = None
+            if status != 200:
+                erros[0] += 1
+            else:
+                latencias.append(time.perf_counter() - inicio)
+        except (OSError, asyncio.TimeoutError, asyncio.IncompleteReadError, ConnectionError, ValueError):
+            erros[0] += 1
+            if conexao is not None:
+                conexao[1].close()
+                conexao = None
+        if intervalo:
+            await asyncio.sleep(intervalo)
+    if conexao is not None:
+        conexao[1].close()
+
+
+async def carga(url, rotas, duracao, concorrencia, intervalo):
+    alvo = urlsplit(url)
+    latencias, erros = [], [0]
+    fim = time.monotonic() + duracao
+    inicio = time.monotonic()
+    await asyncio.gather(*(
+        _cliente(alvo, rotas, fim, intervalo, latencias, erros, indice) for indice in range(concorrencia)
+    ))
+    decorrido = time.monotonic() - inicio
+
+    latencias.sort()
+    return {
+        'vazao': len(latencias) / decorrido,
+        'p50': statistics.median(latencias) * 1000 if latencias else 0.0,
+        'p99': latencias[int(len(latencias) * 0.99) - 1] * 1000 if latencias else 0.0,
+        'erros': erros[0],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sincrono', default='http://localhost:5001')
+    parser.add_argument('--assincrono', default='http://localhost:5002')
+    parser.add_argument('--rotas', default='/turmas/,/alunos/1,/alunos/3,/professores/1,/presencas/1')
+    parser.add_argument('--concorrencia', default='64,256,1024')
+    parser.add_argument('--duracao', type=float, default=20)
+    parser.add_argument('--intervalo', type=float, default=0.0, help='Pausa (s) de cada cliente entre consultas')
+    parser.add_argument('--aquecimento', type=float, default=3)
+    args = parser.parse_args()
+
+    rotas = args.rotas.split(',')
+    modos = {'síncrono': args.sincrono.rstrip('/'), 'assíncrono': args.assincrono.rstrip('/')}
+    print(f'{"clientes":>8} {"modo":<11} {"req/s":>10} {"p50 ms":>8} {"p99 ms":>8} {"erros":>6}')
+    for concorrencia in [int(valor) for valor in args.concorrencia.split(',')]:
+        for modo, url in modos.items():
+            asyncio.run(carga(url, rotas, args.aquecimento, concorrencia, args.intervalo))
+            resultado = asyncio.run(carga(url, rotas, args.duracao, concorrencia, args.intervalo))
+            print(
+                f'{concorrencia:>8} {modo:<11} {resultado["vazao"]:>10.1f} {resultado["p50"]:>8.1f} '
+                f'{resultado["p99"]:>8.1f} {resultado["erros"]:>6}'
+            )
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,96 @@
+"""Geração de recibos em lote: no processo do servidor x pool de processos, com e sem reaproveitar o template.
+
+Uso (na raiz do projeto, com as dependências de app/requirements.txt):
+
+    python benchmarks/documentos.py --recibos 5000 --processos 1,2,4
+    python benchmarks/documentos.py --url http://localhost:5001 --mes 2023-03
+
+Sem --url, recibos sintéticos são renderizados pelas mesmas funções da aplicação (app/documentos.py),
+sem servidor nem banco: primeiro um a um no próprio processo, compilando o template HTML a cada
+documento (como um Environment novo por requisição faria) e reaproveitando-o; depois o .zip inteiro
+com DOCUMENTOS_PROCESSOS = cada valor de --processos. Com --url, baixa GET /documentos/recibos?mes=
+e mede o tempo até o primeiro byte e o total.
+"""
+import argparse
+import io
+import os
+import sys
+import time
+import zipfile
+from datetime import date
+from decimal import Decimal
+from urllib.request import urlopen
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'app'))
+import documentos  # noqa: E402
+
+
+def recibos_sinteticos(quantidade):
+    for indice in range(1, quantidade + 1):
+        yield {
+            'escola': documentos.ESCOLA, 'id_pagamento': indice, 'aluno': f'Aluno Sintético {indice}',
+            'responsavel': f'Responsável {indice}', 'referencia': 'Mensalidade Março', 'valor': Decimal('500.00'),
+            'data_pagamento': date(2023, 3, 1 + indice % 28), 'forma_pagamento': 'Cartão',
+        }
+
+
+def sem_reaproveitar(dados):
+    # Descarta o template compilado antes de cada documento
+    documentos._ambiente = None
+    documentos._modelos.clear()
+    return documentos.renderizar('recibo', 'html', dados)
+
+
+def local(args):
+    print(f'{"modo":<44} {"formato":<8} {"docs/s":>10} {"MB":>8}')
+    linhas = [('um a um, template compilado a cada documento', 'html', lambda: [
+        sem_reaproveitar(dados) for dados in recibos_sinteticos(args.recibos)
+    ])]
+    for formato in ('html', 'pdf'):
+        linhas.append(('um a um, template reaproveitado', formato, lambda formato=formato: [
+            documentos.renderizar('recibo', formato, dados) for dados in recibos_sinteticos(args.recibos)
+        ]))
+    for processos in [int(valor) for valor in args.processos.split(',')]:
+        gerador = documentos.Documentos()
+        gerador.processos, gerador.tamanho_lote = processos, args.lote
+        for formato in ('html', 'pdf'):
+            # Um .zip pequeno antes, para a medição não incluir a subida dos processos
+            b''.join(gerador.zip('recibo', formato, recibos_sinteticos(processos * args.lote)))
+            linhas.append((f'.zip com {processos} processo(s)', formato, lambda gerador=gerador, formato=formato: [
+                b''.join(gerador.zip('recibo', formato, recibos_sinteticos(args.recibos)))
+            ]))
+
+    for modo, formato, executar in linhas:
+        inicio = time.perf_counter()
+        partes = executar()
+        decorrido = time.perf_counter() - inicio
+        tamanho = sum(len(parte) for parte in partes) / 1e6
+        print(f'{modo:<44} {formato:<8} {args.recibos / decorrido:>10.0f} {tamanho:>8.1f}')
+
+
+def remoto(args):
+    print(f'{"formato":<8} {"primeiro byte ms":>17} {"total s":>9} {"arquivos":>9} {"MB":>8}')
+    for formato in ('html', 'pdf'):
+        inicio = time.perf_counter()
+        with urlopen(f'{args.url.rstrip("/")}/documentos/recibos?mes={args.mes}&formato={formato}') as resposta:
+            primeiro = resposta.read(1)
+            primeiro_byte = time.perf_counter() - inicio
+            corpo = primeiro + resposta.read()
+        total = time.perf_counter() - inicio
+        arquivos = len(zipfile.ZipFile(io.BytesIO(corpo)).namelist())
+        print(f'{formato:<8} {primeiro_byte * 1000:>17.0f} {total:>9.2f} {arquivos:>9} {len(corpo) / 1e6:>8.1f}')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--recibos', type=int, default=5000)
+    parser.add_argument('--processos', default='1,2,4')
+    parser.add_argument('--lote', type=int, default=25, help='DOCUMENTOS_LOTE')
+    parser.add_argument('--url', help='Servidor para baixar o .zip (opcional)')
+    parser.add_argument('--mes', default='2023-03')
+    args = parser.parse_args()
+    remoto(args) if args.url else local(args)
+
+
+if __name__ == '__main__':
+    main()
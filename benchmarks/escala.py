@@ -0,0 +1,115 @@
+"""Vazão do perfil "escala" do docker-compose com 1, 2, 4... réplicas atrás do nginx.
+
+Uso (na raiz do projeto, com o docker compose disponível):
+
+    ADMISSAO_ATIVA=0 python benchmarks/escala.py --replicas 1,2,4 --duracao 30 --concorrencia 64
+
+Para cada quantidade de réplicas o script escala o serviço web-escala, espera todas ficarem
+saudáveis (/saude/pronto), gera carga por --duracao segundos e imprime vazão, latências e a
+eficiência em relação ao ideal linear (vazão / (réplicas x vazão com uma réplica)).
+"""
+import argparse
+import http.client
+import statistics
+import subprocess
+import threading
+import time
+from urllib.parse import urlsplit
+
+SERVICO = 'web-escala'
+
+
+def compose(*args):
+    return subprocess.run(
+        ['docker', 'compose', '--profile', 'escala', *args],
+        check=True, capture_output=True, text=True
+    ).stdout
+
+
+def escalar(replicas, espera_maxima=120):
+    compose('up', '-d', '--build', '--scale', f'{SERVICO}={replicas}', SERVICO, 'lb')
+    limite = time.monotonic() + espera_maxima
+    while time.monotonic() < limite:
+        saudaveis = compose('ps', SERVICO).count('(healthy)')
+        if saudaveis == replicas:
+            # Tempo para o resolver do nginx (valid=5s) enxergar as novas réplicas
+            time.sleep(6)
+            return
+        time.sleep(2)
+    raise RuntimeError(f'{replicas} réplica(s) não ficaram saudáveis em {espera_maxima}s')
+
+
+def carga(url, duracao, concorrencia):
+    alvo = urlsplit(url)
+    caminho = alvo.path or '/'
+    latencias = []
+    erros = [0]
+    lock = threading.Lock()
+    fim = time.monotonic() + duracao
+
+    def cliente():
+        conexao = http.client.HTTPConnection(alvo.hostname, alvo.port or 80, timeout=10)
+        locais, falhas = [], 0
+        while time.monotonic() < fim:
+            inicio = time.perf_counter()
+            try:
+                conexao.request('GET', caminho)
+                resposta = conexao.getresponse()
+                resposta.read()
+                if resposta.status != 200:
+                    falhas += 1
+                    continue
+            except (OSError, http.client.HTTPException):
+                falhas += 1
+                conexao.close()
+                conexao = http.client.HTTPConnection(alvo.hostname, alvo.port or 80, timeout=10)
+                continue
+            locais.append(time.perf_counter() - inicio)
+        conexao.close()
+        with lock:
+            latencias.extend(locais)
+            erros[0] += falhas
+
+    threads = [threading.Thread(target=cliente) for _ in range(concorrencia)]
+    inicio = time.monotonic()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    decorrido = time.monotonic() - inicio
+
+    latencias.sort()
+    return {
+        'vazao': len(latencias) / decorrido,
+        'p50': statistics.median(latencias) * 1000 if latencias else 0.0,
+        'p99': latencias[int(len(latencias) * 0.99) - 1] * 1000 if latencias else 0.0,
+        'erros': erros[0],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--replicas', default='1,2,4')
+    parser.add_argument('--url', default='http://localhost:8080/turmas/')
+    parser.add_argument('--duracao', type=float, default=30)
+    parser.add_argument('--concorrencia', type=int, default=64)
+    parser.add_argument('--aquecimento', type=float, default=5)
+    args = parser.parse_args()
+
+    base = None
+    print(f'{"réplicas":>8} {"req/s":>10} {"p50 ms":>8} {"p99 ms":>8} {"erros":>6} {"eficiência":>10}')
+    for replicas in [int(valor) for valor in args.replicas.split(',')]:
+        escalar(replicas)
+        carga(args.url, args.aquecimento, args.concorrencia)
+        resultado = carga(args.url, args.duracao, args.concorrencia)
+        if base is None:
+            base = resultado['vazao'] / replicas
+        eficiencia = resultado['vazao'] / (replicas * base) if base else 0.0
+        print(
+            f'{replicas:>8} {resultado["vazao"]:>10.1f} {resultado["p50"]:>8.1f} '
+            f'{resultado["p99"]:>8.1f} {resultado["erros"]:>6} {eficiencia:>10.0%}'
+        )
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,116 @@
+"""Tamanho da resposta e tempo de decodificação no cliente: JSON x MessagePack x Arrow.
+
+Uso (na raiz do projeto):
+
+    python benchmarks/formatos.py --url http://localhost:5001 --rotas /presencas,/pagamentos/
+    python benchmarks/formatos.py --local 200000
+
+Com --url, cada rota é baixada em cada formato (?formato=json|msgpack|arrow) e decodificada como
+um cliente de análise faria: JSON em lista de dicts, MessagePack em listas de valores e Arrow em
+uma tabela colunar. Com --local, pagamentos sintéticos são codificados pelos mesmos geradores da
+aplicação (app/formatos.py), sem servidor nem banco (requer as dependências de app/requirements.txt).
+"""
+import argparse
+import decimal
+import io
+import json
+import os
+import statistics
+import sys
+import time
+from datetime import date, timedelta
+from urllib.request import urlopen
+
+import msgpack
+import pyarrow as pa
+
+FORMATOS = ('json', 'msgpack', 'arrow')
+
+
+def decodificar(formato, corpo):
+    if formato == 'json':
+        return len(json.loads(corpo))
+    if formato == 'msgpack':
+        objetos = msgpack.Unpacker(io.BytesIO(corpo), timestamp=3)
+        next(objetos)  # nomes das colunas
+        return sum(1 for _ in objetos)
+    return pa.ipc.open_stream(corpo).read_all().num_rows
+
+
+def medir(formato, obter, repeticoes):
+    """Mediana do download (ou codificação) e da decodificação, em ms, e o tamanho do corpo"""
+    downloads, decodificacoes = [], []
+    for _ in range(repeticoes):
+        inicio = time.perf_counter()
+        corpo = obter()
+        downloads.append(time.perf_counter() - inicio)
+        inicio = time.perf_counter()
+        linhas = decodificar(formato, corpo)
+        decodificacoes.append(time.perf_counter() - inicio)
+    return len(corpo), linhas, statistics.median(downloads) * 1000, statistics.median(decodificacoes) * 1000
+
+
+def obtencoes_http(url, rota):
+    separador = '&' if '?' in rota else '?'
+    return {
+        formato: (lambda formato=formato: urlopen(f'{url}{rota}{separador}formato={formato}').read())
+        for formato in FORMATOS
+    }
+
+
+def obtencoes_locais(quantidade):
+    sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'app'))
+    import formatos
+    from models import Pagamento
+
+    colunas = list(Pagamento.__table__.columns)
+    inicio = date(2020, 1, 1)
+    linhas = [
+        (i, i % 500 + 1, inicio + timedelta(days=i % 1500), decimal.Decimal(f'{150 + i % 100}.{i % 100:02d}'),
+         'Pix' if i % 2 else 'Boleto', f'{inicio + timedelta(days=i % 1500):%m/%Y}', 'Pago')
+        for i in range(1, quantidade + 1)
+    ]
+
+    def como_json():
+        # Mesmo formato de Pagamento.to_dict() com jsonify
+        return json.dumps([{
+            'id_pagamento': p[0], 'id_aluno': p[1], 'data_pagamento': p[2].strftime('%Y-%m-%d'),
+            'valor_pago': float(p[3]), 'forma_pagamento': p[4], 'referencia': p[5], 'status': p[6],
+        } for p in linhas]).encode()
+
+    return {
+        'json': como_json,
+        'msgpack': lambda: b''.join(formatos._gerar_msgpack(colunas, linhas)),
+        'arrow': lambda: b''.join(formatos._gerar_arrow(colunas, linhas)),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--url', default='http://localhost:5001')
+    parser.add_argument('--rotas', default='/presencas,/pagamentos/')
+    parser.add_argument('--local', type=int, help='Quantidade de pagamentos sintéticos (sem servidor)')
+    parser.add_argument('--repeticoes', type=int, default=5)
+    args = parser.parse_args()
+
+    if args.local:
+        casos = {f'{args.local} pagamentos sintéticos': obtencoes_locais(args.local)}
+        rotulo = 'codificar'
+    else:
+        casos = {rota: obtencoes_http(args.url.rstrip('/'), rota) for rota in args.rotas.split(',')}
+        rotulo = 'download'
+
+    print(f'{"caso":<32} {"formato":<8} {"linhas":>8} {"bytes":>12} {"x JSON":>7} {rotulo + " ms":>13} {"decodificar ms":>15}')
+    for caso, obtencoes in casos.items():
+        base = None
+        for formato in FORMATOS:
+            tamanho, linhas, obtencao, decodificacao = medir(formato, obtencoes[formato], args.repeticoes)
+            base = base or tamanho
+            print(
+                f'{caso:<32} {formato:<8} {linhas:>8} {tamanho:>12} {tamanho / base:>7.2f} '
+                f'{obtencao:>13.1f} {decodificacao:>15.1f}'
+            )
+
+
+if __name__ == '__main__':
+    main()